@@ -0,0 +1,89 @@
+"""Benchmark of import time of the package and its modules
+
+Every import runs in a fresh interpreter, as in a dispatch worker. With
+--max-seconds the exit code is 1 if any median import time is above it,
+so the benchmark can guard startup time in CI.
+
+Run with: python benchmarks/bench_import.py --repeat 5
+"""
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+MODULES = (
+    "sumo.table_aggregation",
+    "sumo.table_aggregation.executor",
+    "sumo.table_aggregation.dispatch",
+    "sumo.table_aggregation.aggregate",
+    "sumo.table_aggregation.utilities",
+    "sumo.table_aggregation.utilities.fetch",
+    "sumo.table_aggregation.utilities.upload",
+)
+HEAVY = ("pandas", "pyarrow", "numpy", "psutil", "sumo.wrapper", "httpx")
+PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"seconds": seconds, "modules": len(sys.modules), "heavy": heavy}}))
+"""
+
+
+def probe(module: str) -> dict:
+    """Import module in fresh interpreter
+
+    Args:
+        module (str): name of module
+
+    Returns:
+        dict: seconds used, number of modules loaded, heavy modules loaded
+    """
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--max-seconds", type=float, default=None)
+    parser.add_argument("--output", help="path to write results as json")
+    args = parser.parse_args()
+    results = {}
+    for module in args.modules:
+        probes = [probe(module) for _ in range(args.repeat)]
+        results[module] = {
+            "median_seconds": statistics.median(item["seconds"] for item in probes),
+            "modules": probes[-1]["modules"],
+            "heavy": probes[-1]["heavy"],
+        }
+        result = results[module]
+        print(
+            f"{module:<45} {result['median_seconds'] * 1000:8.1f} ms"
+            f" {result['modules']:5} modules  heavy: {', '.join(result['heavy'])}"
+        )
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(results, stream, indent=2)
+    if args.max_seconds is not None:
+        slow = [
+            module
+            for module, result in results.items()
+            if result["median_seconds"] > args.max_seconds
+        ]
+        if slow:
+            print(f"Slower than {args.max_seconds} s: {', '.join(slow)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
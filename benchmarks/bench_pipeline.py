@@ -0,0 +1,252 @@
+"""Offline benchmark of the aggregation pipeline, stage by stage
+
+Runs against a synthetic ensemble served by an in-process fake sumo, so
+no network or credentials are needed. Times discovery, fetch, decode,
+concat, statistics, serialize and upload, and makes scaling curves over
+number of realizations and cores.
+
+Run with:
+python benchmarks/bench_pipeline.py --reals 10 50 100 --cores 1 2 4 --vectors 200
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+import pyarrow as pa
+from sumo.table_aggregation import metrics
+from sumo.table_aggregation import utilities as ut
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# pylint: disable=wrong-import-position
+import synthetic  # noqa: E402
+from fake_sumo import FakeSumoClient  # noqa: E402
+
+STAGES = ("discovery", "fetch", "decode", "concat", "statistics", "serialize", "upload")
+
+
+def timed(func, *args, **kwargs):
+    """Return runtime in seconds and results of func"""
+    start = time.perf_counter()
+    results = func(*args, **kwargs)
+    return time.perf_counter() - start, results
+
+
+def clear_cache(cache_dir: str):
+    """Empty blob cache, so the next fetch goes to the (fake) network
+
+    Args:
+        cache_dir (str): the cache folder
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+
+
+def fetch_all(sumo, object_ids: dict, columns: list, cores: int) -> float:
+    """Fetch all objects through the cache, as the aggregation does
+
+    Args:
+        sumo (FakeSumoClient): the client
+        object_ids (dict): object id per realization
+        columns (list): columns to read
+        cores (int): number of threads
+
+    Returns:
+        float: seconds used
+    """
+    with ThreadPoolExecutor(cores) as executor:
+        seconds, _ = timed(
+            lambda: list(
+                executor.map(
+                    lambda object_id: ut.get_object(object_id, columns, sumo),
+                    object_ids.values(),
+                )
+            )
+        )
+    return seconds
+
+
+async def concat(sumo, object_ids: dict, columns: list, cores: int) -> pa.Table:
+    """Aggregate realizations into one table with the given number of threads
+
+    Args:
+        sumo (FakeSumoClient): the client
+        object_ids (dict): object id per realization
+        columns (list): columns to read
+        cores (int): number of threads
+
+    Returns:
+        pa.Table: the aggregated table
+    """
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(cores))
+    return await ut.aggregate_arrow(object_ids, sumo, columns, loop)
+
+
+async def upload(sumo, parent_id, table, table_index, meta_stub, cores: int):
+    """Upload collections and index of table, without statistics
+
+    Args:
+        sumo (FakeSumoClient): the client
+        parent_id (str): the case uuid
+        table (pa.Table): the aggregated table
+        table_index (list): the table index
+        meta_stub (dict): the aggregated metadata
+        cores (int): number of threads
+    """
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(cores) as executor:
+        await ut.extract_and_upload(
+            sumo, parent_id, table, table_index, meta_stub, loop, executor, None
+        )
+
+
+def run_pipeline(objects: dict, args, cores: int, cache_dir: str) -> dict:
+    """Run every stage once against fake sumo serving the objects
+
+    Args:
+        objects (dict): the ensemble, see synthetic.make_ensemble
+        args (argparse.Namespace): the options
+        cores (int): number of threads and processes
+        cache_dir (str): the blob cache folder
+
+    Returns:
+        dict: seconds per stage, and pipeline metrics
+    """
+    metrics.METRICS.reset()
+    ut.forget_uploaded_indexes()
+    sumo = FakeSumoClient(objects, args.latency, args.bandwidth)
+    seconds = {}
+    seconds["discovery"], (object_ids, meta_stub, table_index) = timed(
+        ut.query_for_table,
+        sumo,
+        synthetic.CASE_UUID,
+        "summary",
+        "eclipse",
+        "iter-0",
+    )
+    columns = table_index + [f"V{number}" for number in range(args.vectors)]
+    clear_cache(cache_dir)
+    seconds["fetch"] = fetch_all(sumo, object_ids, columns, cores)
+    blobs = [blob for blob, _ in objects.values()]
+    seconds["decode"], _ = timed(
+        lambda: [ut.blob_to_table(BytesIO(blob)) for blob in blobs]
+    )
+    seconds["concat"], table = timed(
+        asyncio.run, concat(sumo, object_ids, columns, cores)
+    )
+    seconds["statistics"], _ = timed(
+        ut.make_stat_aggregations, table, table_index, args.aggfuncs, "exact", cores
+    )
+    seconds["serialize"], _ = timed(
+        lambda: [
+            ut.table_to_bytes(table.select(table_index + ["REAL", column]))
+            for column in table.column_names
+            if column not in table_index + ["REAL"]
+        ]
+    )
+    seconds["upload"], _ = timed(
+        asyncio.run,
+        upload(sumo, synthetic.CASE_UUID, table, table_index, meta_stub, cores),
+    )
+    return {
+        "reals": len(object_ids),
+        "cores": cores,
+        "rows": table.num_rows,
+        "columns": table.num_columns,
+        "nbytes": table.nbytes,
+        "seconds": seconds,
+        "uploaded_objects": len(sumo.uploaded_blobs),
+        "requests": sumo.requests,
+        "metrics": metrics.METRICS.to_dict(),
+    }
+
+
+def print_result(result: dict):
+    """Print one line with seconds per stage
+
+    Args:
+        result (dict): results from run_pipeline
+    """
+    stages = " ".join(f"{stage}={result['seconds'][stage]:.3f}" for stage in STAGES)
+    print(f"reals={result['reals']:<5} cores={result['cores']:<3} {stages}")
+
+
+def parse_args(argv=None):
+    """Parse command line
+
+    Args:
+        argv (list, optional): the arguments, defaults to sys.argv
+
+    Returns:
+        argparse.Namespace: the options
+    """
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        "--reals", type=int, nargs="+", default=[100], help="one curve point each"
+    )
+    parser.add_argument(
+        "--cores", type=int, nargs="+", default=[1], help="one curve point each"
+    )
+    parser.add_argument("--dates", type=int, default=500)
+    parser.add_argument("--vectors", type=int, default=200)
+    parser.add_argument("--format", choices=synthetic.FORMATS, default="parquet")
+    parser.add_argument("--missing-rate", type=float, default=0.0)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds added to every request"
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=None, help="bytes per second for blobs"
+    )
+    parser.add_argument("--aggfuncs", nargs="+", default="standards")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="path to write results as json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    """Run the benchmark"""
+    args = parse_args(argv)
+    cache_dir = tempfile.mkdtemp(prefix="sumo-aggregation-bench-")
+    previous = os.environ.get(ut.BLOB_CACHE)
+    os.environ[ut.BLOB_CACHE] = cache_dir
+    results = []
+    try:
+        print(
+            f"{args.vectors} vectors x {args.dates} dates, {args.format},"
+            f" missing rate {args.missing_rate}, latency {args.latency} s"
+        )
+        for nr_reals in args.reals:
+            objects = synthetic.make_ensemble(
+                nr_reals,
+                args.dates,
+                args.vectors,
+                args.format,
+                args.missing_rate,
+                args.seed,
+            )
+            for cores in args.cores:
+                result = run_pipeline(objects, args, cores, cache_dir)
+                print_result(result)
+                results.append(result)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if previous is None:
+            del os.environ[ut.BLOB_CACHE]
+        else:
+            os.environ[ut.BLOB_CACHE] = previous
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump({"options": vars(args), "results": results}, stream, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Benchmark of statistics engine against the former process pool
+
+Run with: python benchmarks/bench_stats.py --vectors 1000 --reals 200 --dates 100
+"""
+import argparse
+import time
+from copy import deepcopy
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from sumo.table_aggregation.utilities import make_stat_aggregations
+
+
+def make_table(nr_vectors, nr_reals, nr_dates, seed=0):
+    """Make long format table with DATE, REAL and vectors
+
+    Args:
+        nr_vectors (int): number of vectors
+        nr_reals (int): number of realizations
+        nr_dates (int): number of dates per realization
+        seed (int, optional): seed for random numbers. Defaults to 0.
+
+    Returns:
+        pa.Table: the table
+    """
+    rng = np.random.default_rng(seed)
+    start = np.datetime64("2020-01-01", "D")
+    dates = np.arange(start, start + nr_dates).astype("datetime64[ms]")
+    columns = {
+        "DATE": np.tile(dates, nr_reals),
+        "REAL": np.repeat(np.arange(nr_reals, dtype=np.int16), nr_dates),
+    }
+    for number in range(nr_vectors):
+        columns[f"V{number}"] = rng.random(nr_dates * nr_reals, dtype=np.float32)
+    return pa.table(columns)
+
+
+def legacy_p10(array_like):
+    """p10 as in the former implementation (labels swapped)"""
+    return np.percentile(array_like, 90)
+
+
+def legacy_p90(array_like):
+    """p90 as in the former implementation (labels swapped)"""
+    return np.percentile(array_like, 10)
+
+
+def legacy_do_stats(frame, index, col_name, aggfunc, aggname):
+    """Single statistic as made by the former process pool"""
+    stat = frame.groupby(index)[col_name].agg(aggfunc).to_frame().reset_index()
+    return (aggname, pa.Table.from_pandas(stat))
+
+
+def legacy_stats(table, table_index):
+    """The former make_stat_aggregations: pandas, pickling and spawn pool"""
+    aggfuncs = {
+        "mean": "mean",
+        "min": "min",
+        "max": "max",
+        "p10": legacy_p10,
+        "p90": legacy_p90,
+    }
+    stat_input = []
+    for col_name in table.column_names[2:]:
+        frame = deepcopy(
+            table.select(table_index + ["REAL", col_name]).to_pandas(
+                ignore_metadata=True
+            )
+        )
+        stat_input.extend(
+            (frame, table_index, col_name, aggfunc, aggname)
+            for aggname, aggfunc in aggfuncs.items()
+        )
+    with get_context("spawn").Pool() as pool:
+        return pool.starmap(legacy_do_stats, stat_input)
+
+
+def timed(func, *args):
+    """Return runtime in seconds and results of func"""
+    start = time.perf_counter()
+    results = func(*args)
+    return time.perf_counter() - start, results
+
+
+def main():
+    """Run the benchmark"""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--vectors", type=int, default=1000)
+    parser.add_argument("--reals", type=int, default=200)
+    parser.add_argument("--dates", type=int, default=100)
+    parser.add_argument("--processes", type=int, default=None)
+    parser.add_argument("--skip-legacy", action="store_true")
+    args = parser.parse_args()
+    table = make_table(args.vectors, args.reals, args.dates)
+    print(f"{args.vectors} vectors x {args.reals} reals x {args.dates} dates")
+    engine_time, results = timed(
+        make_stat_aggregations,
+        table,
+        ["DATE"],
+        ["mean", "min", "max", "p10", "p90"],
+        "exact",
+        args.processes,
+    )
+    print(f"engine: {engine_time:.2f} s ({len(results)} tables)")
+    if not args.skip_legacy:
+        legacy_time, results = timed(legacy_stats, table, ["DATE"])
+        print(f"legacy: {legacy_time:.2f} s ({len(results)} tables)")
+        print(f"speedup: {legacy_time / engine_time:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
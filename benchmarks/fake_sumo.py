@@ -0,0 +1,264 @@
+"""In-process stand-in for SumoClient, serving synthetic ensembles
+
+Serves the parts of the sumo api the aggregation uses: /search with term
+queries, terms/cardinality aggregations and _source includes, object blobs,
+and metadata/blob uploads. Latency and bandwidth can be tuned to model
+the network.
+"""
+import re
+import threading
+from copy import deepcopy
+import time
+import uuid
+
+BLOB_PATH = re.compile(r"^/objects\('(?P<object_id>[^']+)'\)/blob$")
+OBJECT_PATH = re.compile(r"^/objects\('(?P<object_id>[^']+)'\)$")
+
+
+class FakeResponse:
+    """Response with the attributes the aggregation reads"""
+
+    def __init__(self, status_code=200, payload=None, content=b""):
+        """Store response
+
+        Args:
+            status_code (int): http status
+            payload (dict): json payload
+            content (bytes): raw content
+        """
+        self.status_code = status_code
+        self._payload = payload
+        self.content = content
+
+    def json(self):
+        """Return json payload"""
+        return self._payload
+
+
+def get_field(source: dict, field: str):
+    """Get value of dotted field from document
+
+    Args:
+        source (dict): the document
+        field (str): dotted path, .keyword suffix is ignored
+
+    Returns:
+        any: the value, None if missing
+    """
+    if field.endswith(".keyword"):
+        field = field[: -len(".keyword")]
+    value = source
+    for part in field.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def select_fields(source: dict, includes: list) -> dict:
+    """Make document with only the included dotted fields
+
+    Args:
+        source (dict): the document
+        includes (list): dotted paths
+
+    Returns:
+        dict: the reduced document
+    """
+    selected = {}
+    for field in includes:
+        value = get_field(source, field)
+        if value is None:
+            continue
+        parts = field.split(".")
+        target = selected
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return selected
+
+
+def aggregate(sources: list, aggs: dict) -> dict:
+    """Run terms and cardinality aggregations
+
+    Args:
+        sources (list): the matching documents
+        aggs (dict): the aggregations
+
+    Returns:
+        dict: results per aggregation
+    """
+    results = {}
+    for name, spec in aggs.items():
+        if "cardinality" in spec:
+            field = spec["cardinality"]["field"]
+            values = {get_field(source, field) for source in sources}
+            results[name] = {"value": len(values - {None})}
+        elif "terms" in spec:
+            groups = {}
+            for source in sources:
+                key = get_field(source, spec["terms"]["field"])
+                if key is not None:
+                    groups.setdefault(key, []).append(source)
+            buckets = []
+            for key, members in list(groups.items())[: spec["terms"].get("size", 10)]:
+                bucket = {"key": key, "doc_count": len(members)}
+                bucket.update(aggregate(members, spec.get("aggs", {})))
+                buckets.append(bucket)
+            results[name] = {"buckets": buckets}
+    return results
+
+
+class FakeBlobClient:
+    """Stand in for the blob client of SumoClient"""
+
+    def __init__(self, sumo):
+        """Keep reference to the fake client
+
+        Args:
+            sumo (FakeSumoClient): the client
+        """
+        self._sumo = sumo
+
+    def upload_blob(self, blob: bytes, url: str) -> FakeResponse:
+        """Store uploaded blob
+
+        Args:
+            blob (bytes): the blob
+            url (str): the blob url from metadata upload
+
+        Returns:
+            FakeResponse: the response
+        """
+        self._sumo.wait(len(blob))
+        with self._sumo.lock:
+            self._sumo.uploaded_blobs[url] = blob
+        return FakeResponse(201)
+
+
+class FakeSumoClient:
+    """In-process sumo serving given objects"""
+
+    def __init__(self, objects: dict, latency: float = 0.0, bandwidth: float = None):
+        """Set up client
+
+        Args:
+            objects (dict): object id as key, tuple of blob and metadata as
+                            value, see synthetic.make_ensemble
+            latency (float): seconds added to every request
+            bandwidth (float, optional): bytes per second for blob transfers,
+                                         None for no limit
+        """
+        self.objects = objects
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.lock = threading.Lock()
+        self.uploaded_metadata = {}
+        self.uploaded_blobs = {}
+        self.requests = 0
+        self.blob_client = FakeBlobClient(self)
+
+    def wait(self, nbytes: int = 0):
+        """Sleep as long as the modelled network would take
+
+        Args:
+            nbytes (int): bytes transferred
+        """
+        with self.lock:
+            self.requests += 1
+        seconds = self.latency
+        if self.bandwidth:
+            seconds += nbytes / self.bandwidth
+        if seconds:
+            time.sleep(seconds)
+
+    def _matches(self, source: dict, query: dict) -> bool:
+        """Check if document matches bool query of term filters
+
+        Args:
+            source (dict): the document
+            query (dict): the query
+
+        Returns:
+            bool: True if match
+        """
+        bool_query = query.get("bool", {})
+        for clause, wanted in (("must", True), ("must_not", False)):
+            for term in bool_query.get(clause, []):
+                ((field, value),) = term["term"].items()
+                if field.startswith("_sumo.parent_object"):
+                    field = "fmu.case.uuid"
+                matched = get_field(source, field) == value["value"]
+                if matched != wanted:
+                    return False
+        return True
+
+    def search(self, query: dict) -> dict:
+        """Run search
+
+        Args:
+            query (dict): the search body
+
+        Returns:
+            dict: search results
+        """
+        matching = [
+            (object_id, metadata)
+            for object_id, (_, metadata) in self.objects.items()
+            if self._matches(metadata, query.get("query", {}))
+        ]
+        includes = (query.get("_source") or {}).get("includes")
+        hits = []
+        for object_id, metadata in matching[: query.get("size", 10)]:
+            # Copied, as documents from the network are, callers may modify them
+            source = (
+                deepcopy(metadata)
+                if includes is None
+                else select_fields(metadata, includes)
+            )
+            hits.append({"_id": object_id, "_source": source})
+        results = {"hits": {"total": {"value": len(matching)}, "hits": hits}}
+        if "aggs" in query:
+            results["aggregations"] = aggregate(
+                [metadata for _, metadata in matching], query["aggs"]
+            )
+        return results
+
+    def post(self, path: str, json: dict = None, **kwargs) -> FakeResponse:
+        """Search, or upload metadata of child object
+
+        Args:
+            path (str): /search or /objects('<parent id>')
+            json (dict): the body
+
+        Returns:
+            FakeResponse: the response
+        """
+        self.wait()
+        if path == "/search":
+            return FakeResponse(200, self.search(json))
+        if OBJECT_PATH.match(path):
+            object_id = str(uuid.uuid4())
+            with self.lock:
+                self.uploaded_metadata[object_id] = json
+            return FakeResponse(
+                200, {"_id": object_id, "blob_url": f"fake://{object_id}"}
+            )
+        return FakeResponse(404, {"error": f"Unknown path {path}"})
+
+    def get(self, path: str, **kwargs) -> FakeResponse:
+        """Get blob of object
+
+        Args:
+            path (str): /objects('<object id>')/blob
+
+        Returns:
+            FakeResponse: the response
+        """
+        match = BLOB_PATH.match(path)
+        if match is None or match["object_id"] not in self.objects:
+            self.wait()
+            return FakeResponse(404)
+        blob = self.objects[match["object_id"]][0]
+        self.wait(len(blob))
+        return FakeResponse(200, content=blob)
@@ -0,0 +1,154 @@
+"""Synthetic ensembles of summary-like tables, with metadata as stored in sumo"""
+import hashlib
+from io import BytesIO
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyarrow import feather
+from sumo.table_aggregation.utilities import uuid_from_string
+
+FORMATS = ("parquet", "feather", "csv")
+CASE_UUID = "00000000-0000-4000-8000-000000000000"
+
+
+def make_realization(
+    real, nr_dates, vectors, missing_rate=0.0, seed=0, start="2020-01-01"
+) -> pa.Table:
+    """Make table for one realization, with DATE and vectors
+
+    Args:
+        real (int): realization number
+        nr_dates (int): number of dates
+        vectors (list): names of the vectors
+        missing_rate (float): fraction of vectors left out of this realization
+        seed (int): seed for random numbers, combined with real
+        start (str): first date
+
+    Returns:
+        pa.Table: the table
+    """
+    rng = np.random.default_rng([seed, real])
+    first = np.datetime64(start, "D")
+    columns = {"DATE": np.arange(first, first + nr_dates).astype("datetime64[ms]")}
+    for vector in vectors:
+        if missing_rate and rng.random() < missing_rate:
+            continue
+        # Cumulative like totals, so resampling and statistics see real shapes
+        columns[vector] = np.cumsum(rng.random(nr_dates, dtype=np.float32))
+    return pa.table(columns)
+
+
+def table_to_blob(table: pa.Table, fformat: str = "parquet") -> bytes:
+    """Serialize table as uploaded by fmu-dataio
+
+    Args:
+        table (pa.Table): the table
+        fformat (str): parquet, feather or csv
+
+    Raises:
+        ValueError: if format is not supported
+
+    Returns:
+        bytes: the blob
+    """
+    sink = BytesIO()
+    if fformat == "parquet":
+        pq.write_table(table, sink)
+    elif fformat == "feather":
+        feather.write_feather(table, sink)
+    elif fformat == "csv":
+        table.to_pandas().to_csv(sink, index=False)
+    else:
+        raise ValueError(f"Format must be one of {FORMATS}, not {fformat}")
+    return sink.getvalue()
+
+
+def make_metadata(
+    real,
+    table,
+    blob,
+    name="summary",
+    tag="eclipse",
+    iteration="iter-0",
+    fformat="parquet",
+) -> dict:
+    """Make realization metadata like the one stored in sumo
+
+    Args:
+        real (int): realization number
+        table (pa.Table): the table
+        blob (bytes): the serialized table
+        name (str): data.name
+        tag (str): data.tagname
+        iteration (str): fmu.iteration.name
+        fformat (str): data.format
+
+    Returns:
+        dict: the metadata
+    """
+    return {
+        "class": "table",
+        "data": {
+            "name": name,
+            "tagname": tag,
+            "table_index": ["DATE"],
+            "format": fformat,
+            "spec": {
+                "columns": table.column_names,
+                "num_columns": table.num_columns,
+                "num_rows": table.num_rows,
+            },
+        },
+        "display": {"name": name},
+        "file": {
+            "checksum_md5": hashlib.md5(blob).hexdigest(),
+            "relative_path": f"realization-{real}/{iteration}/share/results/{name}",
+            "absolute_path": "",
+            "size_bytes": len(blob),
+        },
+        "fmu": {
+            "case": {"uuid": CASE_UUID, "name": "synthetic"},
+            "iteration": {"name": iteration},
+            "realization": {"id": real, "name": f"realization-{real}"},
+            "context": {"stage": "realization"},
+        },
+        "_sumo": {"blob_size": len(blob)},
+    }
+
+
+def make_ensemble(
+    nr_reals=100,
+    nr_dates=500,
+    nr_vectors=200,
+    fformat="parquet",
+    missing_rate=0.0,
+    seed=0,
+    name="summary",
+    tag="eclipse",
+    iteration="iter-0",
+) -> dict:
+    """Make ensemble of realization blobs with metadata
+
+    Args:
+        nr_reals (int): number of realizations
+        nr_dates (int): number of dates per realization
+        nr_vectors (int): number of vectors
+        fformat (str): parquet, feather or csv
+        missing_rate (float): fraction of vectors left out of each realization
+        seed (int): seed for random numbers
+        name (str): data.name
+        tag (str): data.tagname
+        iteration (str): fmu.iteration.name
+
+    Returns:
+        dict: object id as key, tuple of blob and metadata as value
+    """
+    vectors = [f"V{number}" for number in range(nr_vectors)]
+    objects = {}
+    for real in range(nr_reals):
+        table = make_realization(real, nr_dates, vectors, missing_rate, seed)
+        blob = table_to_blob(table, fformat)
+        metadata = make_metadata(real, table, blob, name, tag, iteration, fformat)
+        object_id = uuid_from_string(f"{name}--{tag}--{iteration}--{real}")
+        objects[object_id] = (blob, metadata)
+    return objects
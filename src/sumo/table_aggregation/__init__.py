@@ -1,4 +1,44 @@
-"""Package for table aggregation via sumo"""
-from sumo.table_aggregation.aggregate import TableAggregator
-from sumo.table_aggregation.utilities import query_for_name_and_tags
-from sumo.table_aggregation.aggregate import AggregationRunner
+"""Package for table aggregation via sumo
+
+The public names are imported on first use, so importing the package, e.g.
+in dispatch workers, does not pull in pandas, pyarrow or the sumo wrapper.
+"""
+import importlib
+
+_LOCATIONS = {
+    "TableAggregator": "sumo.table_aggregation.aggregate",
+    "AggregationRunner": "sumo.table_aggregation.aggregate",
+    "query_for_name_and_tags": "sumo.table_aggregation.utilities",
+}
+
+__all__ = sorted(_LOCATIONS)
+
+
+def __getattr__(name: str):
+    """Import public name on first use
+
+    Args:
+        name (str): the name
+
+    Raises:
+        AttributeError: if name is not public
+
+    Returns:
+        any: the object
+    """
+    try:
+        module = _LOCATIONS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list:
+    """List names of the package, also the ones not loaded yet
+
+    Returns:
+        list: the names
+    """
+    return sorted(set(globals()) | set(_LOCATIONS))
@@ -27,24 +27,24 @@ def delete(path):
     path.unlink()
 
 
-async def delete_file(path, loop):
+async def delete_file(path):
     """Delete object
 
     Args:
         object_id (str): the object id in sumo
     """
     print(path)
-    loop.run_in_executor(None, delete, path)
+    await asyncio.get_running_loop().run_in_executor(None, delete, path)
 
 
-async def killem_all(file_paths, loop):
+async def killem_all(file_paths):
     """Delete all objects in list
 
     Args:
         objects (list): list of sumo query hits
     """
     for file_path in file_paths:
-        await delete_file(file_path, loop)
+        await delete_file(file_path)
 
 
 def main(extension="parquet", folder=None):
@@ -61,8 +61,7 @@ def main(extension="parquet", folder=None):
         folder = Path(folder)
 
     files_to_del = folder.glob(f"*.{extension}")
-    death_loop = asyncio.get_event_loop()
-    death_loop.run_until_complete(killem_all(files_to_del, death_loop))
+    asyncio.run(killem_all(files_to_del))
     logger.debug("Done with cleaning!")
 
 
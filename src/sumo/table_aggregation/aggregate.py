@@ -1,12 +1,33 @@
 """Contains classes for aggregation of tables"""
+import os
 import warnings
 import asyncio
+import threading
+from time import perf_counter, time
+from functools import partial
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Union
 from concurrent.futures import ThreadPoolExecutor
-import pandas as pd
-from sumo.wrapper import SumoClient
 import sumo.table_aggregation.utilities as ut
+from sumo.table_aggregation import (
+    dispatch,
+    limits,
+    memory,
+    metrics,
+    plan,
+    profiling,
+    schedule,
+)
+from sumo.table_aggregation.executor import estimate_job_memory, MEMORY_FRACTION
+from sumo.table_aggregation.limits import ResourceLimiter
 from sumo.table_aggregation._tidy import main as clean
 
+if TYPE_CHECKING:
+    import pyarrow as pa
+    from sumo.wrapper import SumoClient
+    from sumo.table_aggregation.gather import RealizationTables
+    from sumo.table_aggregation.registry import RealizationRegistry
+
 
 class AggregationBasics:
     """Class defining the basics for the aggregation"""
@@ -14,6 +35,8 @@ class AggregationBasics:
     def __init__(
         self, case_identifier: str, env: str = "prod", token: str = None
     ) -> None:
+        from sumo.wrapper import SumoClient  # pylint: disable=import-outside-toplevel
+
         self._case_identifier = case_identifier
         self._sumo = SumoClient(env, token)
         self._uuid = ut.return_uuid(self._sumo, case_identifier)
@@ -33,7 +56,7 @@ class AggregationBasics:
         return self._uuid
 
     @property
-    def sumo(self) -> SumoClient:
+    def sumo(self) -> "SumoClient":
         """return the _sumo_attribute"""
         return self._sumo
 
@@ -57,12 +80,25 @@ class TableAggregator(AggregationBasics):
         name (str): name of tables to aggregate
         tag (str): name of tag for table
         token (str): authentication token
+        kwargs: env (str), and frequencies (tuple) for also uploading
+                resampled results, e.g. ("monthly", "yearly"), and
+                spill (str), folder to spill aggregated segments to, see
+                spill.SpillWriter, defaults to SUMO_AGGREGATION_SPILL, and
+                gather (bool), to not concatenate realizations, see
+                gather.RealizationTables, and stats_mode (str), "exact" or
+                "sketch" for statistics from sketches filled while
+                fetching, see aggregations.segment_sketch
         """
         self._logger = ut.init_logging(__file__ + ".TableAggregator")
+        self._frequencies = tuple(kwargs.pop("frequencies", ()))
+        self._spill = kwargs.pop("spill", None)
+        self._gather = kwargs.pop("gather", False)
+        self._stats_mode = kwargs.pop("stats_mode", "exact")
+        self._sketch = None
         super().__init__(case_identifier, kwargs.get("env", "prod"), token)
         self._name = name
-        self.loop = asyncio.get_event_loop()
         self._iteration = iteration
+        self._tag = tag
         (
             self._object_ids,
             self._meta,
@@ -90,8 +126,8 @@ class TableAggregator(AggregationBasics):
         return self._table_index
 
     @property
-    def object_ids(self) -> tuple:
-        """Return the _object_ids attribute"""
+    def object_ids(self) -> "RealizationRegistry":
+        """Return the _object_ids attribute, registry of realization objects"""
         return self._object_ids
 
     @property
@@ -126,7 +162,7 @@ class TableAggregator(AggregationBasics):
         return tuple(segs_w_table_index)
 
     @property
-    def aggregated(self) -> pd.DataFrame:
+    def aggregated(self) -> Union["pa.Table", "RealizationTables"]:
         """Return the _aggregated attribute"""
 
         return self._aggregated
@@ -136,22 +172,48 @@ class TableAggregator(AggregationBasics):
         """Set the _aggregated attribute
 
         Args:
-            aggregated (pa.Table): aggregated results
+            aggregated (pa.Table, RealizationTables): aggregated results
         """
         self._aggregated = aggregated
 
+    @classmethod
+    async def adiscover(
+        cls,
+        case_identifier: str,
+        name: str,
+        tag: str,
+        iteration: str,
+        token: str = None,
+        **kwargs
+    ):
+        """Make aggregator without blocking the running event loop
+
+        Args: see __init__
+
+        Returns:
+            TableAggregator: the aggregator, with discovery done
+        """
+        return await asyncio.get_running_loop().run_in_executor(
+            None,
+            partial(cls, case_identifier, name, tag, iteration, token, **kwargs),
+        )
+
     @ut.timethis("aggregation")
-    def aggregate(self, columns):
+    async def aaggregate(self, columns):
         """Aggregate objects over tables per real stored in sumo"""
         self._logger.info("table_index for aggregation: %s", self.table_index)
         if (self.table_index is not None) and (len(self.table_index) > 0):
-            self.aggregated = self.loop.run_until_complete(
-                ut.aggregate_arrow(
-                    self.object_ids,
-                    self.sumo,
-                    columns,
-                    self.loop,
-                )
+            self._sketch = ut.segment_sketch(
+                list(columns), self.table_index, self._stats_mode
+            )
+            self.aggregated = await ut.aggregate_arrow(
+                self.object_ids,
+                self.sumo,
+                columns,
+                asyncio.get_running_loop(),
+                spill=self._spill,
+                gather=self._gather,
+                sketch=self._sketch,
             )
         else:
             self.aggregated = None
@@ -160,51 +222,190 @@ class TableAggregator(AggregationBasics):
             )
 
     @ut.timethis("upload")
-    def upload(self):
-        """Upload data to sumo"""
+    async def aupload(self, index: bool = True):
+        """Upload data to sumo
+
+        Args:
+            index (bool): upload index objects, only needed for one segment
+        """
         if self.aggregated is not None:
-            executor = ThreadPoolExecutor()
-            self.loop.run_until_complete(
-                ut.extract_and_upload(
+            with ThreadPoolExecutor() as executor:
+                await ut.extract_and_upload(
                     self.sumo,
                     self.uuid,
                     self.aggregated,
                     self.table_index,
                     self.base_meta,
-                    self.loop,
+                    asyncio.get_running_loop(),
                     executor,
+                    stats_mode=self._stats_mode,
+                    frequencies=self._frequencies,
+                    index=index,
+                    sketch=self._sketch,
                 )
-            )
         else:
             warnings.warn("No aggregation in place, so no upload will be done!!")
 
-    def run(self):
-        """Run aggregation and upload"""
-        for list_seg in self.columns:
-            self.aggregate(list_seg)
-            self.upload()
+    async def arun(self, cancelled: threading.Event = None):
+        """Run aggregation and upload
+
+        With memory profiling on, peaks are tracked for the table and for
+        each segment, see memory.profile. With stage profiling on, stacks
+        are sampled for the table and its stages, see profiling.table.
+        Metrics and profile are not exported, see run, so several tables
+        can run in one process and export once
+
+        Args:
+            cancelled (threading.Event, optional): when set, no more
+                                                   segments are started
+        """
+        label = f"{self.name}--{self._tag}"
+        with memory.profile(label), profiling.table(label):
+            for number, list_seg in enumerate(self.columns):
+                if cancelled is not None and cancelled.is_set():
+                    self._logger.warning(
+                        "Cancelled %s before all segments", self.name
+                    )
+                    break
+                with memory.profile(f"{label}--segment-{number}"):
+                    await self.aaggregate(list_seg)
+                    # All segments have the same index values
+                    await self.aupload(index=number == 0)
+
+    def aggregate(self, columns):
+        """Aggregate objects over tables per real stored in sumo, see aaggregate"""
+        asyncio.run(self.aaggregate(columns))
+
+    def upload(self, index: bool = True):
+        """Upload data to sumo, see aupload"""
+        asyncio.run(self.aupload(index))
+
+    def explain(self, aggfuncs="standards") -> dict:
+        """Explain what run will cost, without aggregating
+
+        Args:
+            aggfuncs (str, list, None): statistics to make
+
+        Returns:
+            dict: the report, see plan.explain_records
+        """
+        key = dispatch.table_key(self.uuid, self.name, self._tag, self.iteration)
+        records = [
+            {
+                "table": key,
+                "table_name": self.name,
+                "tag_name": self._tag,
+                "object_ids": self.object_ids,
+                "table_index": self.table_index,
+                "base_meta": self.base_meta,
+            }
+        ]
+        records += [
+            {"job": number, "table": key, "columns": list(list_seg)}
+            for number, list_seg in enumerate(self.columns)
+        ]
+        return plan.explain_records(records, aggfuncs, self._frequencies)
+
+    def run(self, cancelled: threading.Event = None):
+        """Run aggregation and upload, see arun, then export metrics and profile
+
+        See metrics.export and profiling.export
+
+        Args:
+            cancelled (threading.Event, optional): when set, no more
+                                                   segments are started
+        """
+        asyncio.run(self.arun(cancelled))
+        metrics.export()
+        profiling.export()
 
         # clean()
 
+    def estimate_cost(self) -> float:
+        """Estimate cost of run, see dispatch.estimate_cost
+
+        Returns:
+            float: estimated seconds
+        """
+        return sum(
+            dispatch.estimate_cost(
+                self.base_meta,
+                len(self.object_ids),
+                len(list_seg),
+                registry=self.object_ids,
+            )
+            for list_seg in self.columns
+        )
+
+    def estimate_memory(self) -> int:
+        """Estimate peak memory of run, see executor.estimate_job_memory
+
+        Returns:
+            int: estimated peak memory in bytes
+        """
+        return estimate_job_memory(
+            {
+                "base_meta": self.base_meta,
+                "object_ids": self.object_ids,
+                "columns": max(self.columns, key=len),
+            }
+        )
+
 
 class AggregationRunner(AggregationBasics):
     """Class for running all aggregations of tables for specific case"""
 
-    def __init__(self, uuid: str, env: str = "prod", token: str = None) -> None:
+    def __init__(
+        self,
+        uuid: str,
+        env: str = "prod",
+        token: str = None,
+        max_tables: int = 4,
+        limiter: ResourceLimiter = None,
+        **kwargs,
+    ) -> None:
         """Init of sumo env
 
         Args:
             uuid (str): the uuid of the case
             env (str, optional): name of the sumo environment for case, default prod
+            token (str, optional): authentication token
+            max_tables (int, optional): tables aggregated at the same time
+            limiter (ResourceLimiter, optional): limits on concurrent downloads,
+                                                 uploads, cpu work and memory
+                                                 for all tables, defaults to
+                                                 default_limiter()
+            kwargs: passed on to TableAggregator, e.g. frequencies
         """
         super().__init__(uuid, env, token)
         self._logger = ut.init_logging(__name__ + ".AggregationRunner")
         self._env = env
+        self._token = token
         self._uuid = uuid
+        self._max_tables = max_tables
+        self._limiter = limiter or default_limiter()
+        self._table_kwargs = kwargs
+        self._cancelled = threading.Event()
+        self._schedule = None
+        self._utilisation = None
 
-    def run(self) -> None:
-        """Run all aggregation related to case"""
+    @property
+    def cancelled(self) -> bool:
+        """Return True if run is cancelled"""
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """Cancel run, tables and segments not started are skipped"""
+        self._logger.warning("Cancelling aggregations of case %s", self.uuid)
+        self._cancelled.set()
 
+    def combinations(self) -> list:
+        """Find all combinations of iteration, name and tag to aggregate
+
+        Returns:
+            list: tuples of iteration name, table name and tag name
+        """
+        combinations = []
         iterations = ut.query_sumo_iterations(self._sumo, self.uuid)
         for iter_name in iterations:
             names_w_tags = ut.query_for_name_and_tags(self._sumo, self.uuid, iter_name)
@@ -215,14 +416,257 @@ class AggregationRunner(AggregationBasics):
                     if tag in ["summary", "gruptree"]:
                         continue
                     self._logger.info("  data.tagname: %s", tag)
-                    aggregator = TableAggregator(
-                        self._uuid,
-                        name,
-                        tag,
-                        iter_name,
-                        sumo_env=self._env,
+                    combinations.append((iter_name, name, tag))
+        return combinations
+
+    @property
+    def schedule(self) -> dict:
+        """Return schedule of last run, see schedule.lpt_schedule
+
+        The keys are tuples of iteration name, table name and tag name.
+        """
+        return self._schedule
+
+    @property
+    def utilisation(self) -> dict:
+        """Return utilisation of last run, see schedule.achieved_utilisation"""
+        return self._utilisation
+
+    def discover(self, combinations: list) -> tuple:
+        """Run discovery for tables, several at the time
+
+        Args:
+            combinations (list): tuples of iteration name, table name, tag name
+
+        Returns:
+            tuple: aggregator per combination, and reports for failed ones
+        """
+        aggregators = {}
+        failures = []
+
+        def discover_table(combination):
+            iter_name, name, tag = combination
+            return TableAggregator(
+                self._uuid,
+                name,
+                tag,
+                iter_name,
+                self._token,
+                env=self._env,
+                **self._table_kwargs,
+            )
+
+        with ThreadPoolExecutor(max_workers=self._max_tables) as executor:
+            futures = {
+                combination: executor.submit(discover_table, combination)
+                for combination in combinations
+            }
+            for combination, future in futures.items():
+                try:
+                    aggregators[combination] = future.result()
+                except Exception as error:  # pylint: disable=broad-except
+                    self._logger.exception("Discovery of %s failed", combination)
+                    iter_name, name, tag = combination
+                    failures.append(
+                        {
+                            "iteration": iter_name,
+                            "name": name,
+                            "tag": tag,
+                            "status": "failed",
+                            "error": repr(error),
+                            "seconds": 0.0,
+                        }
                     )
-                    aggregator.run()
+        return aggregators, failures
+
+    @contextmanager
+    def _reported(self, combination: tuple):
+        """Time run of table in context, errors are reported, not raised
+
+        Args:
+            combination (tuple): iteration name, table name and tag name
+
+        Yields:
+            dict: the report, status is set in context when cancelled
+        """
+        iter_name, name, tag = combination
+        report = {"iteration": iter_name, "name": name, "tag": tag, "error": None}
+        report["start"] = time()
+        start = perf_counter()
+        try:
+            yield report
+            report.setdefault("status", "cancelled" if self.cancelled else "ok")
+        except Exception as error:  # pylint: disable=broad-except
+            self._logger.exception("Aggregation of %s (%s) failed", name, tag)
+            report["status"] = "failed"
+            report["error"] = repr(error)
+        finally:
+            report["seconds"] = perf_counter() - start
+            report["end"] = report["start"] + report["seconds"]
+
+    def run_table(self, combination: tuple, aggregator) -> dict:
+        """Run aggregation of one table, errors are reported, not raised
+
+        Args:
+            combination (tuple): iteration name, table name and tag name
+            aggregator (TableAggregator): aggregator for table
+
+        Returns:
+            dict: report with status (ok, failed or cancelled), error and times
+        """
+        with self._reported(combination) as report:
+            if self.cancelled:
+                report["status"] = "cancelled"
+            else:
+                with self._limiter.memory.reserve(aggregator.estimate_memory()):
+                    asyncio.run(aggregator.arun(self._cancelled))
+        return report
+
+    async def arun_table(
+        self, combination: tuple, aggregator, semaphore: asyncio.Semaphore
+    ) -> dict:
+        """Run aggregation of one table on the running loop, see run_table
+
+        Args:
+            combination (tuple): iteration name, table name and tag name
+            aggregator (TableAggregator): aggregator for table
+            semaphore (asyncio.Semaphore): limits tables run at the same time
+
+        Returns:
+            dict: report with status (ok, failed or cancelled), error and times
+        """
+        async with semaphore:
+            with self._reported(combination) as report:
+                if self.cancelled:
+                    report["status"] = "cancelled"
+                else:
+                    async with self._limiter.memory.areserve(
+                        aggregator.estimate_memory()
+                    ):
+                        await aggregator.arun(self._cancelled)
+        return report
+
+    def _plan(self, aggregators: dict):
+        """Order tables largest estimated cost first, see schedule.lpt_schedule
+
+        Args:
+            aggregators (dict): aggregator per combination
+        """
+        self._schedule = schedule.lpt_schedule(
+            {
+                combination: aggregator.estimate_cost()
+                for combination, aggregator in aggregators.items()
+            },
+            self._max_tables,
+        )
+
+    def _summarise(self, reports: list):
+        """Find utilisation, and export metrics and profile of the run once
+
+        Args:
+            reports (list): report per table
+        """
+        intervals = [
+            (report["start"], report["end"]) for report in reports if "end" in report
+        ]
+        self._utilisation = schedule.achieved_utilisation(intervals, self._max_tables)
+        metrics.export()
+        profiling.export()
+        failed = [report for report in reports if report["status"] == "failed"]
+        self._logger.info(
+            "%s tables aggregated, %s failed, utilisation %.2f",
+            len(reports) - len(failed),
+            len(failed),
+            self._utilisation["utilisation"],
+        )
+
+    def run(self) -> list:
+        """Run all aggregation related to case, several tables at the time
+
+        Tables are started largest estimated cost first, see
+        schedule.lpt_schedule. A failing table does not stop the others. On
+        KeyboardInterrupt the run is cancelled, the tables already started
+        finish their current segment. Metrics and profile are exported once,
+        at the end.
+
+        Returns:
+            list: report per table, see run_table
+        """
+        previous = limits.set_limiter(self._limiter)
+        try:
+            aggregators, reports = self.discover(self.combinations())
+            self._plan(aggregators)
+            with ThreadPoolExecutor(max_workers=self._max_tables) as executor:
+                futures = [
+                    executor.submit(
+                        self.run_table, combination, aggregators[combination]
+                    )
+                    for combination in self._schedule["order"]
+                ]
+                try:
+                    reports += [future.result() for future in futures]
+                except KeyboardInterrupt:
+                    self.cancel()
+                    raise
+        finally:
+            limits.set_limiter(previous)
+        self._summarise(reports)
+        return reports
+
+    async def arun(self) -> list:
+        """Run all aggregation related to case on the running event loop
+
+        Discovery runs in the default executor of the loop. The tables are
+        run as coroutines on the loop, at most max_tables at the time, in
+        the order of run, each once its memory estimate fits the limiter.
+        When cancelled, the tables already started finish their current
+        segment.
+
+        Returns:
+            list: report per table, see run_table
+        """
+        loop = asyncio.get_running_loop()
+        previous = limits.set_limiter(self._limiter)
+        try:
+            combinations = await loop.run_in_executor(None, self.combinations)
+            aggregators, reports = await loop.run_in_executor(
+                None, self.discover, combinations
+            )
+            self._plan(aggregators)
+            semaphore = asyncio.Semaphore(self._max_tables)
+            try:
+                reports += await asyncio.gather(
+                    *[
+                        self.arun_table(
+                            combination, aggregators[combination], semaphore
+                        )
+                        for combination in self._schedule["order"]
+                    ]
+                )
+            except asyncio.CancelledError:
+                self.cancel()
+                raise
+        finally:
+            limits.set_limiter(previous)
+        self._summarise(reports)
+        return reports
+
+
+def default_limiter() -> ResourceLimiter:
+    """Make limiter from number of cpus and available memory
+
+    Returns:
+        ResourceLimiter: the limiter
+    """
+    import psutil  # pylint: disable=import-outside-toplevel
+
+    nr_cpus = os.cpu_count() or 1
+    return ResourceLimiter(
+        downloads=4 * nr_cpus,
+        uploads=4 * nr_cpus,
+        cpu=nr_cpus,
+        memory=int(psutil.virtual_memory().available * MEMORY_FRACTION),
+    )
 
 
 # class AggregationDispatcher(AggregationRunner):
@@ -1,14 +1,31 @@
 """Dispatches jobs to to radix"""
 import asyncio
+import bisect
+import gzip
+import hashlib
+import json
+from typing import TYPE_CHECKING
 from concurrent.futures import ThreadPoolExecutor
-from copy import deepcopy
-from sumo.wrapper import SumoClient
 import sumo.table_aggregation.utilities as ut
-from httpx import HTTPStatusError
+from sumo.table_aggregation import memory, metrics, profiling
+
+if TYPE_CHECKING:
+    from sumo.wrapper import SumoClient
+    from sumo.table_aggregation.registry import RealizationRegistry
+
+# Used when metadata does not say how many rows the tables have
+DEFAULT_ROWS = 5000
+BYTES_PER_CELL = 8
+# Virtual nodes per shard on the consistent hash ring
+SHARD_REPLICAS = 100
+# Cost model for jobs, costs are estimated seconds
+JOB_OVERHEAD = 10.0
+FETCH_BYTES_PER_SECOND = 50e6
+CELLS_PER_SECOND = 20e6
 
 
 def query_for_names_and_tags(
-    sumo: SumoClient, case_uuid: str, iter_name: str = "0"
+    sumo: "SumoClient", case_uuid: str, iter_name: str = "0"
 ):
     """Query sumo for iteration name, and corresponding combinations of names and tagnames
 
@@ -92,44 +109,234 @@ def list_of_list_segments(metadata, seg_length=250):
     return segmented_list
 
 
-def generate_dispatch_info(
-    uuid, env, iteration_name, token=None, seg_length=250
+def table_dimensions(metadata: dict) -> tuple:
+    """Get rows, columns and blob size of one realization table from metadata
+
+    Args:
+        metadata (dict): metadata for a single realization
+
+    Returns:
+        tuple: rows, number of columns and size in bytes
+    """
+    spec = metadata["data"].get("spec") or {}
+    nr_cols = spec.get("num_columns") or len(spec.get("columns", [])) or 1
+    rows = spec.get("num_rows") or DEFAULT_ROWS
+    size_bytes = (metadata.get("file") or {}).get("size_bytes")
+    if not size_bytes:
+        size_bytes = rows * nr_cols * BYTES_PER_CELL
+    return rows, nr_cols, size_bytes
+
+
+def estimate_cost(
+    metadata: dict,
+    nr_reals: int,
+    nr_columns: int,
+    registry: "RealizationRegistry" = None,
+) -> float:
+    """Estimate cost of one job, every job fetches all realization blobs
+
+    Args:
+        metadata (dict): metadata for a single realization
+        nr_reals (int): number of realizations
+        nr_columns (int): number of columns in job
+        registry (RealizationRegistry, optional): the realization objects,
+                                                  when given, blobs shared by
+                                                  realizations are counted
+                                                  once, and sizes and rows
+                                                  are taken per realization
+
+    Returns:
+        float: estimated seconds
+    """
+    rows, _, size_bytes = table_dimensions(metadata)
+    if registry is None:
+        fetch_bytes = size_bytes * nr_reals
+        total_rows = rows * nr_reals
+    else:
+        fetch_bytes = registry.fetch_bytes(default=size_bytes)
+        total_rows = registry.total_rows(default=rows)
+    return (
+        JOB_OVERHEAD
+        + fetch_bytes / FETCH_BYTES_PER_SECOND
+        + total_rows * nr_columns / CELLS_PER_SECOND
+    )
+
+
+def balanced_segment_length(
+    metadata: dict,
+    nr_reals: int,
+    target_cost: float,
+    registry: "RealizationRegistry" = None,
+) -> int:
+    """Find segment length giving jobs of even cost, close to target cost
+
+    Small tables end up in one job, large tables are split into jobs of
+    equal number of columns.
+
+    Args:
+        metadata (dict): metadata for a single realization
+        nr_reals (int): number of realizations
+        target_cost (float): target estimated seconds per job
+        registry (RealizationRegistry, optional): see estimate_cost
+
+    Returns:
+        int: the segment length
+    """
+    logger = ut.init_logging(__name__ + ".balanced_segment_length")
+    nr_cols = len(metadata["data"]["spec"]["columns"])
+    fixed_cost = estimate_cost(metadata, nr_reals, 0, registry)
+    column_cost = estimate_cost(metadata, nr_reals, 1, registry) - fixed_cost
+    # Every segment also gets the table index columns
+    nr_index = len(metadata["data"].get("table_index") or [])
+    room = target_cost - fixed_cost - nr_index * column_cost
+    if room < column_cost:
+        logger.warning(
+            "Fetching %s realizations costs %.1f, target %.1f is too low",
+            nr_reals,
+            fixed_cost,
+            target_cost,
+        )
+        max_length = 1
+    else:
+        max_length = int(room // column_cost)
+    nr_jobs = -(-nr_cols // max_length)
+    return max(1, -(-nr_cols // max(nr_jobs, 1)))
+
+
+def table_jobs(
+    metadata: dict,
+    nr_reals: int,
+    seg_length: int = 250,
+    target_cost: float = None,
+    group_segments: bool = False,
+    registry: "RealizationRegistry" = None,
+) -> list:
+    """Make job records for one table, without job number and table key
+
+    Args:
+        metadata (dict): metadata for a single realization
+        nr_reals (int): number of realizations
+        seg_length (int): length of columns per segment
+        target_cost (float, optional): target estimated seconds per job
+        group_segments (bool): put segments of table in the same job, so that
+                               blobs are fetched once, and segments processed
+                               one after the other. With target_cost set,
+                               segments are packed into jobs below target
+        registry (RealizationRegistry, optional): see estimate_cost
+
+    Returns:
+        list: job records, with columns, or segments when grouped, and
+              index, True for the job uploading the index objects
+    """
+    if target_cost is not None:
+        seg_length = balanced_segment_length(
+            metadata, nr_reals, target_cost, registry
+        )
+    segments = list_of_list_segments(metadata, seg_length)
+    if not group_segments:
+        return [
+            {
+                "columns": col_segment,
+                "cost": estimate_cost(
+                    metadata, nr_reals, len(col_segment), registry
+                ),
+                "index": number == 0,
+            }
+            for number, col_segment in enumerate(segments)
+        ]
+    groups = [[]]
+    for col_segment in segments:
+        group_cols = sum(len(segment) for segment in groups[-1]) + len(col_segment)
+        if (
+            groups[-1]
+            and target_cost is not None
+            and estimate_cost(metadata, nr_reals, group_cols, registry) > target_cost
+        ):
+            groups.append([])
+        groups[-1].append(col_segment)
+    return [
+        {
+            "segments": group,
+            "cost": estimate_cost(
+                metadata, nr_reals, sum(len(segment) for segment in group), registry
+            ),
+            "index": number == 0,
+        }
+        for number, group in enumerate(groups)
+    ]
+
+
+def job_segments(dispatch_info: dict) -> list:
+    """Get column segments to process in job
+
+    Args:
+        dispatch_info (dict): dispatch info for job
+
+    Returns:
+        list: the segments, one for jobs that are not grouped
+    """
+    return dispatch_info.get("segments") or [dispatch_info["columns"]]
+
+
+def table_key(uuid, table_name, tag_name, iteration_name):
+    """Make key that jobs in a dispatch manifest use to refer to their table
+
+    Args:
+        uuid (str): case uuid
+        table_name (str): name of table
+        tag_name (str): tagname of table
+        iteration_name (str): name of iteration
+
+    Returns:
+        str: the key
+    """
+    return ut.uuid_from_string(f"{uuid}--{table_name}--{tag_name}--{iteration_name}")
+
+
+def generate_manifest(
+    uuid,
+    env,
+    iteration_name,
+    token=None,
+    seg_length=250,
+    target_cost=None,
+    group_segments=False,
 ):
-    """Generate dispatch info for all batch jobs to run
+    """Generate records of dispatch manifest, table records come before their jobs
+
+    A table record contains what is common to all jobs for one table
+    (object_ids, base_meta and table_index), and is stored only once.
+    A job record only contains the key of its table, and its columns.
 
     Args:
         uuid (str): case uuid
         env (str): name of sumo env to read from
-        seg_length (str): length of columns to pass per batch job
+        iteration_name (str): name of iteration
+        token (str, optional): authentication token
+        seg_length (int): length of columns to pass per batch job
+        target_cost (float, optional): target estimated seconds per job, when
+                                       given seg_length is found per table
+        group_segments (bool): group segments of table in jobs, see table_jobs
 
-    Returns:
-        list: list of all table combinations
+    Yields:
+        dict: table or job record
     """
-    logger = ut.init_logging(__name__ + ".generate_dispatch_info")
-    sumo = SumoClient(env, token)
+    from httpx import HTTPStatusError  # pylint: disable=import-outside-toplevel
+    from sumo.wrapper import SumoClient  # pylint: disable=import-outside-toplevel
 
-    dispatch_info = []
+    logger = ut.init_logging(__name__ + ".generate_manifest")
+    sumo = SumoClient(env, token)
     name_and_tag = collect_names_and_tags(sumo, uuid, iteration_name)
     logger.debug("---------")
     logger.debug(name_and_tag)
     logger.debug("---------")
-    dispatch_combination = {}
-    dispatch_combination["uuid"] = uuid
-    # dispatch_combination["iter_name"] = iteration_name
-    # for iter_name, it_tables in it_name_and_tag.items():
-    #     logger.debug(iter_name)
-    #     logger.debug(it_tables)
+    job_number = 0
     for table_name, tag_names in name_and_tag.items():
         logger.debug(table_name)
         logger.debug(tag_names)
-        dispatch_combination["table_name"] = table_name
         for tag_name in tag_names:
             try:
-                (
-                    dispatch_combination["object_ids"],
-                    base_meta,
-                    dispatch_combination["table_index"],
-                ) = ut.query_for_table(
+                object_ids, base_meta, table_index = ut.query_for_table(
                     sumo, uuid, table_name, tag_name, iteration_name
                 )
             except HTTPStatusError:
@@ -139,53 +346,358 @@ def generate_dispatch_info(
                     tag_name,
                 )
                 continue
-
-            dispatch_combination["tag_name"] = tag_name
-            for col_segment in list_of_list_segments(
+            key = table_key(uuid, table_name, tag_name, iteration_name)
+            jobs = table_jobs(
                 base_meta,
+                len(object_ids),
                 seg_length,
-            ):
-                dispatch_combination["columns"] = col_segment
-                dispatch_combination["base_meta"] = deepcopy(base_meta)
-                # To avoid too large payload
-                dispatch_combination["base_meta"]["data"]["spec"]["columns"] = []
+                target_cost,
+                group_segments,
+                registry=object_ids,
+            )
+            # To avoid too large payload
+            base_meta["data"]["spec"]["columns"] = []
+            yield {
+                "table": key,
+                "uuid": uuid,
+                "table_name": table_name,
+                "tag_name": tag_name,
+                "object_ids": object_ids,
+                "table_index": table_index,
+                "base_meta": base_meta,
+            }
+            for job in jobs:
+                yield {"job": job_number, "table": key, **job}
+                job_number += 1
+
+
+def is_job(record):
+    """Check if manifest record is a job record
+
+    Args:
+        record (dict): the record
+
+    Returns:
+        bool: True if job record, False if table record
+    """
+    return "job" in record
+
+
+def resolve_job(job, table):
+    """Make dispatch info for one job from job record and its table record
 
-                dispatch_info.append(deepcopy(dispatch_combination))
+    Args:
+        job (dict): the job record
+        table (dict): the table record the job refers to
+
+    Returns:
+        dict: dispatch info as used by aggregate_and_upload
+    """
+    dispatch_info = {
+        key: value for key, value in table.items() if key != "table"
+    }
+    for field in ("columns", "segments", "cost", "index"):
+        if field in job:
+            dispatch_info[field] = job[field]
     return dispatch_info
 
 
-def aggregate_and_upload(dispatch_info, sumo):
-    """aggregate based on dispatch info
+def expand_manifest(records):
+    """Expand manifest records to dispatch info per job
+
+    Only the table records are kept in memory, dispatch infos for jobs
+    of the same table share object_ids and base_meta. Registries of
+    realization objects are given in their json form, see
+    RealizationRegistry.to_json, so dispatch infos can be sent as json.
+
+    Args:
+        records (iterable): table and job records
+
+    Raises:
+        KeyError: if job refers to table not yet seen
+
+    Yields:
+        dict: dispatch info for one job
+    """
+    tables = {}
+    for record in records:
+        if is_job(record):
+            yield resolve_job(record, tables[record["table"]])
+        else:
+            if hasattr(record.get("object_ids"), "to_json"):
+                record = {**record, "object_ids": record["object_ids"].to_json()}
+            tables[record["table"]] = record
+
+
+def _to_json(value):
+    """Convert values json does not know, for write_manifest
+
+    Args:
+        value (any): the value
+
+    Raises:
+        TypeError: if value cannot be converted
+
+    Returns:
+        any: value json knows
+    """
+    if hasattr(value, "to_json"):
+        return value.to_json()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def write_manifest(records, path):
+    """Write manifest records as gzip compressed json lines
+
+    Registries of realization objects are written in their json form.
+
+    Args:
+        records (iterable): table and job records
+        path (str): path to file to write
+
+    Returns:
+        int: number of jobs written
+    """
+    logger = ut.init_logging(__name__ + ".write_manifest")
+    nr_jobs = 0
+    with gzip.open(path, "wt", encoding="utf-8") as stream:
+        for record in records:
+            stream.write(
+                json.dumps(record, separators=(",", ":"), default=_to_json) + "\n"
+            )
+            nr_jobs += is_job(record)
+    logger.info("Written manifest with %s jobs to %s", nr_jobs, path)
+    return nr_jobs
+
+
+def read_manifest(path):
+    """Read records from manifest written with write_manifest
+
+    Args:
+        path (str): path to manifest
+
+    Yields:
+        dict: table or job record, object_ids of tables as RealizationRegistry
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.registry import as_registry
+
+    with gzip.open(path, "rt", encoding="utf-8") as stream:
+        for line in stream:
+            if line.strip():
+                record = json.loads(line)
+                if "object_ids" in record:
+                    record["object_ids"] = as_registry(record["object_ids"])
+                yield record
+
+
+def _hash(string: str) -> int:
+    """Hash string to position on consistent hash ring
+
+    Args:
+        string (str): the string to hash
+
+    Returns:
+        int: the position
+    """
+    return int(hashlib.md5(string.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class HashRing:
+    """Consistent hash ring assigning keys to shards
+
+    Each shard has many virtual nodes on the ring, a key belongs to the shard
+    of the first node after the key. When the number of shards changes from
+    N to N + 1, only about 1 / (N + 1) of the keys change shard.
+    """
+
+    def __init__(self, nr_shards: int, replicas: int = SHARD_REPLICAS):
+        """Place virtual nodes of shards on ring
+
+        Args:
+            nr_shards (int): number of shards
+            replicas (int): number of virtual nodes per shard
+
+        Raises:
+            ValueError: if number of shards is less than one
+        """
+        if nr_shards < 1:
+            raise ValueError(f"Need at least one shard, got {nr_shards}")
+        nodes = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(nr_shards)
+            for replica in range(replicas)
+        )
+        self._positions = [position for position, _ in nodes]
+        self._shards = [shard for _, shard in nodes]
+        self._nr_shards = nr_shards
+
+    @property
+    def nr_shards(self) -> int:
+        """Return number of shards"""
+        return self._nr_shards
+
+    def shard_of(self, key: str) -> int:
+        """Find shard for key
+
+        Args:
+            key (str): the key
+
+        Returns:
+            int: the shard, from 0 to nr_shards - 1
+        """
+        index = bisect.bisect(self._positions, _hash(key)) % len(self._positions)
+        return self._shards[index]
+
+
+def shard_key(table: dict) -> str:
+    """Make sharding key from table and its set of object ids
+
+    Args:
+        table (dict): table record, or dispatch info
+
+    Returns:
+        str: the key
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.registry import as_registry
+
+    object_ids = ",".join(sorted(as_registry(table["object_ids"]).values()))
+    return f"{table['table_name']}--{table['tag_name']}--{object_ids}"
+
+
+def shard_records(records, shard: int, nr_shards: int):
+    """Select the manifest records belonging to one shard
+
+    All jobs of a table go to the same shard, so blobs are fetched to one node,
+    and repeated runs with the same number of shards hit the same caches.
+
+    Args:
+        records (iterable): table and job records
+        shard (int): the shard to select, from 0 to nr_shards - 1
+        nr_shards (int): number of shards
+
+    Raises:
+        ValueError: if shard is outside range
+
+    Yields:
+        dict: table and job records of shard
+    """
+    if not 0 <= shard < nr_shards:
+        raise ValueError(f"Shard {shard} not in range 0 to {nr_shards - 1}")
+    ring = HashRing(nr_shards)
+    selected = set()
+    for record in records:
+        if is_job(record):
+            if record["table"] in selected:
+                yield record
+        elif ring.shard_of(shard_key(record)) == shard:
+            selected.add(record["table"])
+            yield record
+
+
+def generate_dispatch_info(
+    uuid,
+    env,
+    iteration_name,
+    token=None,
+    seg_length=250,
+    target_cost=None,
+    group_segments=False,
+):
+    """Generate dispatch info for all batch jobs to run
+
+    Args:
+        uuid (str): case uuid
+        env (str): name of sumo env to read from
+        seg_length (str): length of columns to pass per batch job
+        target_cost (float, optional): target estimated seconds per job,
+                                       see balanced_segment_length
+        group_segments (bool): group segments of table in jobs, see table_jobs
+
+    Returns:
+        list: list of all table combinations
+    """
+    return list(
+        expand_manifest(
+            generate_manifest(
+                uuid,
+                env,
+                iteration_name,
+                token,
+                seg_length,
+                target_cost,
+                group_segments,
+            )
+        )
+    )
+
+
+async def aaggregate_and_upload(dispatch_info, sumo):
+    """aggregate based on dispatch info, then export metrics and profile
+
+    See metrics.export and profiling.export
+
+    Segments of grouped jobs are processed one after the other, the blobs
+    are only fetched for the first, later segments read the cached blobs.
+    Index objects are only uploaded with the first segment of jobs marked
+    with index, see table_jobs
 
     Args:
         dispatch_info (dict): dictionary with all run info for one job
         sumo (SumoClient): client for given sumo environment
     """
+    logger = ut.init_logging(__name__ + ".aaggregate_and_upload")
     uuid = dispatch_info["uuid"]
     table_index = dispatch_info["table_index"]
     object_ids = dispatch_info["object_ids"]
-    columns = dispatch_info["columns"]
     base_meta = dispatch_info["base_meta"]
-    loop = asyncio.get_event_loop()
-    aggregated = None
+    index = dispatch_info.get("index", True)
+    stats_mode = dispatch_info.get("stats_mode", "exact")
+    loop = asyncio.get_running_loop()
     if (table_index is not None) and (len(table_index) > 0):
-        aggregated = loop.run_until_complete(
-            ut.aggregate_arrow(
-                object_ids,
-                sumo,
-                columns,
-                loop,
+        segments = job_segments(dispatch_info)
+        with ThreadPoolExecutor() as executor:
+            label = "--".join(
+                str(dispatch_info.get(field)) for field in ("table_name", "tag_name")
             )
-        )
-        executor = ThreadPoolExecutor()
-        loop.run_until_complete(
-            ut.extract_and_upload(
-                sumo,
-                uuid,
-                aggregated,
-                table_index,
-                base_meta,
-                loop,
-                executor,
-            )
-        )
+            for number, columns in enumerate(segments):
+                logger.debug("Segment %s of %s", number + 1, len(segments))
+                segment = f"{label}--segment-{number}"
+                with memory.profile(segment), profiling.table(label):
+                    sketch = ut.segment_sketch(columns, table_index, stats_mode)
+                    aggregated = await ut.aggregate_arrow(
+                        object_ids,
+                        sumo,
+                        columns,
+                        loop,
+                        spill=dispatch_info.get("spill"),
+                        gather=dispatch_info.get("gather", False),
+                        sketch=sketch,
+                    )
+                    await ut.extract_and_upload(
+                        sumo,
+                        uuid,
+                        aggregated,
+                        table_index,
+                        base_meta,
+                        loop,
+                        executor,
+                        stats_mode=stats_mode,
+                        frequencies=dispatch_info.get("frequencies", ()),
+                        index=index and number == 0,
+                        sketch=sketch,
+                    )
+                    del aggregated, sketch
+    metrics.export()
+    profiling.export()
+
+
+def aggregate_and_upload(dispatch_info, sumo):
+    """aggregate based on dispatch info, see aaggregate_and_upload
+
+    Args:
+        dispatch_info (dict): dictionary with all run info for one job
+        sumo (SumoClient): client for given sumo environment
+    """
+    asyncio.run(aaggregate_and_upload(dispatch_info, sumo))
@@ -0,0 +1,408 @@
+"""Runs dispatch jobs in parallel worker processes on one node"""
+import os
+import json
+import logging
+import argparse
+import traceback
+from time import perf_counter, time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from sumo.table_aggregation import dispatch, memory, metrics
+from sumo.table_aggregation.schedule import achieved_utilisation, order_dispatch_infos
+from sumo.table_aggregation.utilities.common import BLOB_CACHE, process_memory
+
+# Per realization tables, concatenated table and statistics alive at once
+MEMORY_OVERHEAD = 3
+# Fraction of available memory used when no limit is given
+MEMORY_FRACTION = 0.8
+
+_CLIENTS = {}
+
+
+def estimate_job_memory(dispatch_info: dict) -> int:
+    """Estimate peak memory of one dispatch job
+
+    Args:
+        dispatch_info (dict): dispatch info for job
+
+    Returns:
+        int: estimated peak memory in bytes
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.registry import as_registry
+
+    rows, _, _ = dispatch.table_dimensions(dispatch_info["base_meta"])
+    total_rows = as_registry(dispatch_info["object_ids"]).total_rows(default=rows)
+    # Segments of grouped jobs are processed one at the time
+    nr_cols = max(len(seg) for seg in dispatch.job_segments(dispatch_info)) + 1
+    return int(
+        total_rows * nr_cols * dispatch.BYTES_PER_CELL * MEMORY_OVERHEAD
+    )
+
+
+def run_dispatch_job(dispatch_info: dict, env: str, token: str = None):
+    """Run one dispatch job with client shared by all jobs in process
+
+    Args:
+        dispatch_info (dict): dispatch info for job
+        env (str): name of sumo environment
+        token (str, optional): authentication token
+    """
+    if env not in _CLIENTS:
+        from sumo.wrapper import SumoClient  # pylint: disable=import-outside-toplevel
+
+        _CLIENTS[env] = SumoClient(env, token)
+    dispatch.aggregate_and_upload(dispatch_info, _CLIENTS[env])
+
+
+def _init_worker(cache_dir):
+    """Point blob cache of worker to shared folder
+
+    Args:
+        cache_dir (str): the shared folder, None for current folder
+    """
+    if cache_dir is not None:
+        os.environ[BLOB_CACHE] = cache_dir
+
+
+def job_report(number: int, dispatch_info: dict) -> dict:
+    """Make report of job, before it is run
+
+    Args:
+        number (int): the job number
+        dispatch_info (dict): dispatch info for job
+
+    Returns:
+        dict: the job report, status ok until the job fails
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.registry import as_registry
+
+    return {
+        "job": number,
+        "table_name": dispatch_info.get("table_name"),
+        "tag_name": dispatch_info.get("tag_name"),
+        "columns": sum(len(seg) for seg in dispatch.job_segments(dispatch_info)),
+        "realizations": len(as_registry(dispatch_info["object_ids"])),
+        "status": "ok",
+        "error": None,
+    }
+
+
+def format_error(error: BaseException) -> str:
+    """Format exception with its traceback for report
+
+    Args:
+        error (BaseException): the exception
+
+    Returns:
+        str: the formatted exception
+    """
+    return "".join(traceback.format_exception(type(error), error, error.__traceback__))
+
+
+def lost_job_report(
+    number: int, dispatch_info: dict, error: BaseException, start: float
+) -> dict:
+    """Make report of job whose result never came back from the worker
+
+    E.g. when the worker process died, or the job could not be sent to it
+
+    Args:
+        number (int): the job number
+        dispatch_info (dict): dispatch info for job
+        error (BaseException): the exception raised for the result
+        start (float): time the job was submitted
+
+    Returns:
+        dict: the failed job report
+    """
+    report = job_report(number, dispatch_info)
+    report["status"] = "failed"
+    report["error"] = format_error(error)
+    report["start"] = start
+    report["end"] = time()
+    report["seconds"] = report["end"] - start
+    report["worker_rss"] = None
+    report["metrics"] = metrics.Metrics().to_dict()
+    report["memory"] = {}
+    return report
+
+
+def _timed_job(job, number: int, dispatch_info: dict, env: str, token: str) -> dict:
+    """Run job in worker, and report time used, failure and stage metrics
+
+    Args:
+        job (callable): function to run with dispatch_info, env and token
+        number (int): the job number
+        dispatch_info (dict): dispatch info for job
+        env (str): name of sumo environment
+        token (str): authentication token
+
+    Returns:
+        dict: the job report
+    """
+    report = job_report(number, dispatch_info)
+    metrics.METRICS.reset()
+    report["start"] = time()
+    start = perf_counter()
+    try:
+        job(dispatch_info, env, token)
+    except Exception as error:  # pylint: disable=broad-except
+        report["status"] = "failed"
+        report["error"] = format_error(error)
+    report["seconds"] = perf_counter() - start
+    report["end"] = report["start"] + report["seconds"]
+    report["worker_rss"] = process_memory()
+    report["metrics"] = metrics.METRICS.to_dict()
+    report["memory"] = memory.report()
+    return report
+
+
+class LocalExecutor:
+    """Class for running dispatch jobs in parallel processes on one node"""
+
+    def __init__(
+        self,
+        env: str = "prod",
+        token: str = None,
+        workers: int = None,
+        memory_limit: int = None,
+        cache_dir: str = None,
+        job=run_dispatch_job,
+    ):
+        """Set up executor
+
+        Args:
+            env (str, optional): name of sumo environment, default prod
+            token (str, optional): authentication token
+            workers (int, optional): number of worker processes, default nr of cpus
+            memory_limit (int, optional): bytes the running jobs are allowed
+                                          to use together, defaults to a
+                                          fraction of available memory
+            cache_dir (str, optional): folder for blobs shared by all workers,
+                                       defaults to current folder
+            job (callable): function running one job, called with
+                            dispatch_info, env and token
+        """
+        self._logger = logging.getLogger(__name__ + ".LocalExecutor")
+        self._env = env
+        self._token = token
+        self._workers = workers or os.cpu_count() or 1
+        if memory_limit is None:
+            import psutil  # pylint: disable=import-outside-toplevel
+
+            memory_limit = int(psutil.virtual_memory().available * MEMORY_FRACTION)
+        self._memory_limit = memory_limit
+        self._cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._job = job
+
+    @property
+    def workers(self) -> int:
+        """Return number of worker processes"""
+        return self._workers
+
+    @property
+    def memory_limit(self) -> int:
+        """Return memory the running jobs are allowed to use together"""
+        return self._memory_limit
+
+    def _pool(self) -> ProcessPoolExecutor:
+        """Make pool of worker processes
+
+        Returns:
+            ProcessPoolExecutor: the pool
+        """
+        return ProcessPoolExecutor(
+            max_workers=self._workers,
+            initializer=_init_worker,
+            initargs=(self._cache_dir,),
+        )
+
+    def _report(
+        self,
+        future,
+        number: int,
+        dispatch_info: dict,
+        estimate: int,
+        submitted: float,
+    ) -> dict:
+        """Get report of finished job, failed if its result did not come back
+
+        Args:
+            future (concurrent.futures.Future): the finished job
+            number (int): the job number
+            dispatch_info (dict): dispatch info for job
+            estimate (int): estimated peak memory of job
+            submitted (float): time the job was submitted
+
+        Returns:
+            dict: the job report
+        """
+        try:
+            report = future.result()
+        except Exception as error:  # pylint: disable=broad-except
+            report = lost_job_report(number, dispatch_info, error, submitted)
+        report["estimated_memory"] = estimate
+        if report["status"] != "ok":
+            self._logger.warning("Job %s failed:\n%s", number, report["error"])
+        return report
+
+    def run(self, dispatch_infos) -> dict:
+        """Run jobs, admitting new jobs only when their memory estimate fits
+
+        Jobs are started in the order given. A job estimated to need more
+        than the memory limit is run when no other jobs are running.
+        A job whose result does not come back, e.g. because a worker died,
+        is reported as failed, and when the pool is broken the jobs running
+        in it are reported as failed, and a new pool is made for the rest.
+
+        Args:
+            dispatch_infos (iterable): dispatch info per job
+
+        Returns:
+            dict: summary report with one report per job
+        """
+        start = perf_counter()
+        jobs = enumerate(dispatch_infos)
+        waiting = next(jobs, None)
+        running = {}
+        reports = []
+        pool = self._pool()
+        try:
+            while waiting is not None or running:
+                while waiting is not None and len(running) < self._workers:
+                    number, dispatch_info = waiting
+                    estimate = estimate_job_memory(dispatch_info)
+                    in_use = sum(used for _, _, used, _ in running.values())
+                    if running and in_use + estimate > self._memory_limit:
+                        break
+                    if estimate > self._memory_limit:
+                        self._logger.warning(
+                            "Job %s estimated to %s bytes, above limit %s",
+                            number,
+                            estimate,
+                            self._memory_limit,
+                        )
+                    try:
+                        future = pool.submit(
+                            _timed_job,
+                            self._job,
+                            number,
+                            dispatch_info,
+                            self._env,
+                            self._token,
+                        )
+                    except BrokenProcessPool:
+                        # The job waits for the new pool made below
+                        break
+                    running[future] = (number, dispatch_info, estimate, time())
+                    waiting = next(jobs, None)
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                # Nothing is running only if the pool was broken on submit
+                if not running or any(
+                    isinstance(future.exception(), BrokenProcessPool)
+                    for future in done
+                ):
+                    self._logger.warning("Worker pool broken, starting new pool")
+                    # All jobs of the broken pool are then done, as failed
+                    pool.shutdown(wait=True)
+                    pool = self._pool()
+                    done = list(running)
+                for future in done:
+                    reports.append(self._report(future, *running.pop(future)))
+        finally:
+            pool.shutdown(wait=True)
+
+        reports.sort(key=lambda report: report["job"])
+        failed = [report["job"] for report in reports if report["status"] != "ok"]
+        summary = {
+            "workers": self._workers,
+            "memory_limit": self._memory_limit,
+            "seconds": perf_counter() - start,
+            "job_seconds": sum(report["seconds"] for report in reports),
+            "succeeded": len(reports) - len(failed),
+            "failed": failed,
+            "utilisation": achieved_utilisation(
+                [(report["start"], report["end"]) for report in reports],
+                self._workers,
+            )["utilisation"],
+            "jobs": reports,
+        }
+        self._logger.info(
+            "%s jobs run in %.1f s, %s failed",
+            len(reports),
+            summary["seconds"],
+            len(failed),
+        )
+        return summary
+
+
+def write_report(report: dict, path: str):
+    """Write summary report from LocalExecutor.run as json
+
+    Args:
+        report (dict): the report
+        path (str): path to file to write
+    """
+    with open(path, "w", encoding="utf-8") as stream:
+        json.dump(report, stream, indent=2)
+
+
+def parse_args():
+    """Parse arguments to script
+
+    Returns:
+        argparse.Namespace: the arguments
+    """
+    parser = argparse.ArgumentParser(
+        description="Run dispatch jobs from manifest on this node"
+    )
+    parser.add_argument("manifest", type=str, help="manifest from write_manifest")
+    parser.add_argument("--env", type=str, default="prod", help="sumo environment")
+    parser.add_argument(
+        "--shard", type=int, default=0, help="shard to run, from 0 to shards - 1"
+    )
+    parser.add_argument("--shards", type=int, default=1, help="number of shards")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes")
+    parser.add_argument(
+        "--memory-limit", type=int, default=None, help="bytes for running jobs"
+    )
+    parser.add_argument("--cache-dir", type=str, default=None, help="blob cache")
+    parser.add_argument("--report", type=str, default=None, help="json report file")
+    parser.add_argument(
+        "--largest-first",
+        action="store_true",
+        help="start the most costly jobs first",
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Run the jobs of one shard of a manifest"""
+    args = parse_args()
+    records = dispatch.shard_records(
+        dispatch.read_manifest(args.manifest), args.shard, args.shards
+    )
+    executor = LocalExecutor(
+        args.env,
+        workers=args.workers,
+        memory_limit=args.memory_limit,
+        cache_dir=args.cache_dir,
+    )
+    dispatch_infos = dispatch.expand_manifest(records)
+    schedule = None
+    if args.largest_first:
+        dispatch_infos, schedule = order_dispatch_infos(
+            dispatch_infos, executor.workers
+        )
+    report = executor.run(dispatch_infos)
+    report["schedule"] = schedule
+    if args.report is not None:
+        write_report(report, args.report)
+
+
+if __name__ == "__main__":
+    main()
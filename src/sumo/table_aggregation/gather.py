@@ -0,0 +1,148 @@
+"""Per column gathering from realization tables, without concatenation
+
+The realization tables of one aggregation are kept as they were fetched.
+A table for output, e.g. index, REAL and one vector, is gathered column by
+column from the chunks of the realization tables, as chunked arrays
+sharing their buffers. Columns are released from the realization tables
+once uploaded, so memory goes down while the upload proceeds. When
+several users read the same columns, e.g. statistics and the collections,
+a column is dropped only after every user has released it.
+"""
+import threading
+from collections import Counter
+import pyarrow as pa
+
+
+class RealizationTables:
+    """Tables of the realizations of one aggregation, not concatenated"""
+
+    def __init__(self, tables: list):
+        """Keep the realization tables
+
+        Columns missing in some realizations, or null typed there, are
+        given as nulls, and columns of other type are cast, as when
+        concatenating with promotion.
+
+        Args:
+            tables (list): the tables, tables without columns are skipped
+        """
+        self._tables = [table for table in tables if table.num_columns > 0]
+        self._lock = threading.Lock()
+        self._users = 1
+        self._releases = Counter()
+        self._dropped = set()
+        self._types = {}
+        for table in self._tables:
+            for field in table.schema:
+                known = self._types.get(field.name)
+                if known is None or pa.types.is_null(known):
+                    self._types[field.name] = field.type
+
+    @property
+    def column_names(self) -> list:
+        """Return names of columns in any realization, in order of appearance"""
+        return list(self._types)
+
+    @property
+    def schema(self) -> pa.Schema:
+        """Return schema of gathered columns, see column"""
+        return pa.schema(list(self._types.items()))
+
+    @property
+    def num_rows(self) -> int:
+        """Return number of rows of all realizations"""
+        return sum(table.num_rows for table in self._tables)
+
+    @property
+    def nbytes(self) -> int:
+        """Return bytes of the columns not yet released"""
+        with self._lock:
+            return sum(table.nbytes for table in self._tables)
+
+    def column(self, name: str) -> pa.ChunkedArray:
+        """Gather one column from all realizations
+
+        Args:
+            name (str): name of column
+
+        Raises:
+            KeyError: if no realization has the column, or it is released
+
+        Returns:
+            pa.ChunkedArray: the column, one chunk or more per realization
+        """
+        column_type = self._types[name]
+        with self._lock:
+            if name in self._dropped:
+                raise KeyError(f"Column {name} is released by all users")
+            tables = list(self._tables)
+        chunks = []
+        for table in tables:
+            if name not in table.column_names:
+                chunks.append(pa.nulls(table.num_rows, column_type))
+                continue
+            column = table[name]
+            if column.type != column_type:
+                column = column.cast(column_type)
+            chunks.extend(column.chunks)
+        return pa.chunked_array(chunks, type=column_type)
+
+    def gather(self, columns: list) -> pa.Table:
+        """Gather table of some columns from all realizations
+
+        Args:
+            columns (list): names of columns
+
+        Returns:
+            pa.Table: the table
+        """
+        return pa.Table.from_arrays(
+            [self.column(name) for name in columns], names=list(columns)
+        )
+
+    def select(self, columns: list) -> pa.Table:
+        """Gather table of some columns, as pa.Table.select, see gather
+
+        Args:
+            columns (list): names of columns
+
+        Returns:
+            pa.Table: the table
+        """
+        return self.gather(columns)
+
+    def to_table(self) -> pa.Table:
+        """Gather table of all columns, see gather
+
+        Returns:
+            pa.Table: the table
+        """
+        return self.gather(self.column_names)
+
+    def share(self, users: int):
+        """Set number of users that must release a column before it is dropped
+
+        Args:
+            users (int): number of users, e.g. collections and statistics
+        """
+        with self._lock:
+            self._users = users
+
+    def release(self, columns: list):
+        """Release columns, dropped from the realization tables by the last user
+
+        The memory is freed when no gathered table uses the columns.
+
+        Args:
+            columns (list): names of columns
+        """
+        with self._lock:
+            self._releases.update(columns)
+            dropped = [
+                name for name in columns if self._releases[name] >= self._users
+            ]
+            self._dropped.update(dropped)
+            self._tables = [
+                table.drop([name for name in dropped if name in table.column_names])
+                for table in self._tables
+            ]
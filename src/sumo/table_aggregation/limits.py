@@ -0,0 +1,161 @@
+"""Global limits on resources shared by concurrent aggregations"""
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+
+
+class MemoryBudget:
+    """Bytes that can be reserved by concurrent work, blocking when used up"""
+
+    def __init__(self, limit: int = None):
+        """Set up budget
+
+        Args:
+            limit (int, optional): bytes available, None for no limit
+        """
+        self._limit = limit
+        self._reserved = 0
+        self._condition = threading.Condition()
+
+    @property
+    def reserved(self) -> int:
+        """Return bytes currently reserved"""
+        return self._reserved
+
+    def _acquire(self, nbytes: int):
+        """Wait until bytes are available, then reserve them, see reserve
+
+        Args:
+            nbytes (int): bytes to reserve
+        """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._limit is None
+                or self._reserved == 0
+                or self._reserved + nbytes <= self._limit
+            )
+            self._reserved += nbytes
+
+    def _release(self, nbytes: int):
+        """Release reserved bytes
+
+        Args:
+            nbytes (int): bytes to release
+        """
+        with self._condition:
+            self._reserved -= nbytes
+            self._condition.notify_all()
+
+    @contextmanager
+    def reserve(self, nbytes: int):
+        """Reserve bytes while in context, wait until they are available
+
+        A reservation larger than the limit is let through when nothing
+        else is reserved.
+
+        Args:
+            nbytes (int): bytes to reserve
+        """
+        self._acquire(nbytes)
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+    @asynccontextmanager
+    async def areserve(self, nbytes: int):
+        """Reserve bytes while in context, see reserve, without blocking loop
+
+        The wait is done in the default executor of the running loop. When
+        cancelled while waiting, the bytes are released once reserved.
+
+        Args:
+            nbytes (int): bytes to reserve
+        """
+        waiting = asyncio.get_running_loop().run_in_executor(
+            None, self._acquire, nbytes
+        )
+        try:
+            await asyncio.shield(waiting)
+        except asyncio.CancelledError:
+            waiting.add_done_callback(lambda _: self._release(nbytes))
+            raise
+        try:
+            yield
+        finally:
+            self._release(nbytes)
+
+
+class ResourceLimiter:
+    """Limits on concurrent downloads, uploads, cpu work and memory"""
+
+    def __init__(
+        self,
+        downloads: int = None,
+        uploads: int = None,
+        cpu: int = None,
+        memory: int = None,
+    ):
+        """Set up limits, None means no limit
+
+        Args:
+            downloads (int, optional): max concurrent blob downloads
+            uploads (int, optional): max concurrent uploads
+            cpu (int, optional): max concurrent cpu heavy tasks
+            memory (int, optional): bytes concurrent aggregations can reserve
+        """
+        limits = {"download": downloads, "upload": uploads, "cpu": cpu}
+        self._slots = {
+            name: None if limit is None else threading.BoundedSemaphore(limit)
+            for name, limit in limits.items()
+        }
+        self.memory = MemoryBudget(memory)
+
+    @contextmanager
+    def slot(self, name: str):
+        """Hold one slot of named resource while in context
+
+        Args:
+            name (str): download, upload or cpu
+        """
+        semaphore = self._slots[name]
+        if semaphore is None:
+            yield
+            return
+        with semaphore:
+            yield
+
+
+_LIMITER = ResourceLimiter()
+
+
+def set_limiter(limiter: ResourceLimiter = None) -> ResourceLimiter:
+    """Set the limiter used by all aggregations in process
+
+    Args:
+        limiter (ResourceLimiter, optional): the limiter, None for no limits
+
+    Returns:
+        ResourceLimiter: the previous limiter
+    """
+    global _LIMITER  # pylint: disable=global-statement
+    previous = _LIMITER
+    _LIMITER = limiter or ResourceLimiter()
+    return previous
+
+
+def get_limiter() -> ResourceLimiter:
+    """Return the limiter used by all aggregations in process"""
+    return _LIMITER
+
+
+def slot(name: str):
+    """Hold one slot of named resource in the process limiter
+
+    Args:
+        name (str): download, upload or cpu
+
+    Returns:
+        contextmanager: the slot
+    """
+    return _LIMITER.slot(name)
@@ -0,0 +1,517 @@
+"""Dense layout of ensemble vectors
+
+An EnsembleMatrix holds each vector of a table as a 2-D array with one row
+per index value (e.g. the union of all dates of all realizations) and one
+column per realization, with NaN where a realization has no value. It is made
+from a long format table (index columns, REAL, vectors) or directly from the
+per realization tables by aligning their index values to the sorted union.
+Statistics, resampling and comparisons are then plain numpy operations along
+an axis, and the long format is only made again for upload.
+"""
+import logging
+from typing import Callable, List, Mapping, Tuple
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# numpy datetime unit for the supported resampling frequencies
+FREQUENCIES = {"monthly": "M", "yearly": "Y"}
+# Cumulative eclipse mnemonics, without leading F/G/W/C/R and trailing H
+TOTAL_MNEMONICS = set(
+    (
+        "OPT GPT WPT LPT VPT NPT CPT GIT WIT OIT LIT VIT NIT CIT OPTF OPTS GPTF "
+        + "GPTS OVPT OVIT GVPT GVIT WVPT WVIT WGPT WGIT MWT GMT SGT GST FGT GCT "
+        + "GIMT EGT EXGT"
+    ).split()
+)
+
+
+def _encode_keys(column: pa.ChunkedArray) -> Tuple[np.ndarray, pa.Array]:
+    """Encode column as sorted integer codes
+
+    Args:
+        column (pa.ChunkedArray): the column to encode
+
+    Returns:
+        tuple: codes per row (-1 for nulls), and the sorted unique values
+    """
+    encoded = pc.dictionary_encode(column.combine_chunks())
+    dictionary = encoded.dictionary
+    order = np.asarray(pc.array_sort_indices(dictionary))
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+    indices = encoded.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+    codes = np.where(indices < 0, -1, rank[np.maximum(indices, 0)])
+    return codes, dictionary.take(pa.array(order))
+
+
+def group_rows(table: pa.Table, table_index: List[str]) -> Tuple[np.ndarray, pa.Table]:
+    """Group rows of table by the values of the index columns
+
+    Args:
+        table (pa.Table): the table to group
+        table_index (list): the columns to group over
+
+    Returns:
+        tuple: group number per row (-1 when a key is null),
+               and table with the unique index values in sorted order
+    """
+    row_codes = np.zeros(table.num_rows, dtype=np.int64)
+    valid = np.ones(table.num_rows, dtype=bool)
+    for name in table_index:
+        codes, uniques = _encode_keys(table[name])
+        valid &= codes >= 0
+        row_codes = row_codes * len(uniques) + codes
+    groups, first_rows, group_codes = np.unique(
+        row_codes[valid], return_index=True, return_inverse=True
+    )
+    codes = np.full(table.num_rows, -1, dtype=np.int64)
+    codes[valid] = group_codes.reshape(-1)
+    keys = table.select(table_index).take(
+        pa.array(np.flatnonzero(valid)[first_rows])
+    )
+    logging.getLogger(__name__ + ".group_rows").debug(
+        "%s rows in %s groups", table.num_rows, len(groups)
+    )
+    return codes, keys
+
+
+def block_layout(codes: np.ndarray, nr_groups: int) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Find position of each row in block of shape (groups, slots)
+
+    Args:
+        codes (np.ndarray): group number per row, -1 for rows to skip
+        nr_groups (int): number of groups
+
+    Returns:
+        tuple: rows to use, slot per row used, and number of slots
+    """
+    rows = np.flatnonzero(codes >= 0)
+    rows = rows[np.argsort(codes[rows], kind="stable")]
+    counts = np.bincount(codes[rows], minlength=nr_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    slots = np.arange(len(rows)) - starts[codes[rows]]
+    return rows, slots, int(counts.max(initial=0))
+
+
+def table_layout(table: pa.Table, table_index: List[str]) -> Tuple[tuple, pa.Table, np.ndarray]:
+    """Find row and column in matrix for each row of long format table
+
+    Columns are realizations, when a realization has several rows for
+    one index value the columns are just slots, and there are no realizations
+
+    Args:
+        table (pa.Table): table in long format
+        table_index (list): the index columns
+
+    Returns:
+        tuple: layout (rows to use, row in matrix, column in matrix,
+               number of rows, number of columns), the index values
+               and the realizations (None if columns are slots)
+    """
+    logger = logging.getLogger(__name__ + ".table_layout")
+    codes, keys = group_rows(table, table_index)
+    if "REAL" in table.column_names:
+        real_codes, reals = _encode_keys(table["REAL"])
+        rows = np.flatnonzero((codes >= 0) & (real_codes >= 0))
+        cells = codes[rows] * len(reals) + real_codes[rows]
+        if len(np.unique(cells)) == len(rows):
+            layout = (rows, codes[rows], real_codes[rows], keys.num_rows, len(reals))
+            return layout, keys, reals.to_numpy(zero_copy_only=False)
+        logger.warning("Several rows per index value and realization, no REAL axis")
+    rows, slots, nr_slots = block_layout(codes, keys.num_rows)
+    return (rows, codes[rows], slots, keys.num_rows, nr_slots), keys, None
+
+
+def is_numeric(data_type: pa.DataType) -> bool:
+    """Return True if statistics can be made on data type"""
+    return (
+        pa.types.is_integer(data_type)
+        or pa.types.is_floating(data_type)
+        or pa.types.is_decimal(data_type)
+    )
+
+
+def to_float(column: pa.ChunkedArray) -> np.ndarray:
+    """Return column as float64 numpy array with NaN for nulls"""
+    return np.asarray(
+        column.cast(pa.float64()).to_numpy(zero_copy_only=False), dtype=np.float64
+    )
+
+
+def value_dtype(types: List[pa.DataType]) -> type:
+    """Return numpy type to hold values of arrow types, float32 when possible
+
+    Args:
+        types (list): arrow types
+
+    Returns:
+        type: np.float32 or np.float64
+    """
+    small = all(
+        pa.types.is_float32(data_type)
+        or pa.types.is_float16(data_type)
+        or (pa.types.is_integer(data_type) and data_type.bit_width <= 16)
+        for data_type in types
+    )
+    return np.float32 if small else np.float64
+
+
+def numeric_vectors(
+    table: pa.Table, table_index: List[str], columns: List[str] = None
+) -> List[str]:
+    """Return the columns statistics can be made for
+
+    Args:
+        table (pa.Table): the table
+        table_index (list): the index columns
+        columns (list, optional): columns to check, defaults to all
+                                  columns that are not index or REAL
+
+    Returns:
+        list: names of numeric columns
+    """
+    logger = logging.getLogger(__name__ + ".numeric_vectors")
+    if columns is None:
+        columns = [
+            name for name in table.column_names if name not in table_index + ["REAL"]
+        ]
+    vectors = []
+    for col_name in columns:
+        if is_numeric(table.schema.field(col_name).type):
+            vectors.append(col_name)
+        else:
+            logger.warning("Cannot make statistics on column %s", col_name)
+    return vectors
+
+
+class EnsembleMatrix:
+
+    """Vectors as dense arrays of shape (index values, realizations)"""
+
+    def __init__(
+        self,
+        keys: pa.Table,
+        reals: np.ndarray,
+        vectors: List[str],
+        values: np.ndarray,
+        present: np.ndarray = None,
+        types: List[pa.DataType] = None,
+    ):
+        """Set up matrix
+
+        Args:
+            keys (pa.Table): the index values, one row per row in matrix
+            reals (np.ndarray): realization per column, None if no realizations
+            vectors (list): names of vectors
+            values (np.ndarray): shape (vectors, index values, realizations)
+            present (np.ndarray, optional): shape (index values, realizations),
+                                            True where realization has index
+                                            value, defaults to all present
+            types (list, optional): arrow type per vector, defaults to float32
+        """
+        self._keys = keys
+        self._reals = reals
+        self._vectors = list(vectors)
+        self._values = values
+        if present is None:
+            present = np.ones(values.shape[1:], dtype=bool)
+        self._present = present
+        self._types = list(types) if types else [pa.float32()] * len(self._vectors)
+
+    @property
+    def keys(self) -> pa.Table:
+        """Return _keys attribute"""
+        return self._keys
+
+    @property
+    def reals(self) -> np.ndarray:
+        """Return _reals attribute"""
+        return self._reals
+
+    @property
+    def vectors(self) -> List[str]:
+        """Return _vectors attribute"""
+        return self._vectors
+
+    @property
+    def values(self) -> np.ndarray:
+        """Return _values attribute, shape (vectors, index values, realizations)"""
+        return self._values
+
+    @property
+    def present(self) -> np.ndarray:
+        """Return _present attribute"""
+        return self._present
+
+    @property
+    def types(self) -> List[pa.DataType]:
+        """Return _types attribute"""
+        return self._types
+
+    @property
+    def table_index(self) -> List[str]:
+        """Return names of index columns"""
+        return self._keys.column_names
+
+    def __getitem__(self, vector: str) -> np.ndarray:
+        """Return matrix of one vector
+
+        Args:
+            vector (str): name of vector
+
+        Returns:
+            np.ndarray: shape (index values, realizations)
+        """
+        return self._values[self._vectors.index(vector)]
+
+    @classmethod
+    def from_table(
+        cls,
+        table: pa.Table,
+        table_index: List[str],
+        vectors: List[str] = None,
+        layout: tuple = None,
+    ) -> "EnsembleMatrix":
+        """Make matrix from long format table
+
+        Args:
+            table (pa.Table): table with index columns, REAL and vectors
+            table_index (list): the index columns
+            vectors (list, optional): vectors to include, defaults to all numeric
+            layout (tuple, optional): results of table_layout, if already made
+
+        Returns:
+            EnsembleMatrix: the matrix
+        """
+        vectors = numeric_vectors(table, table_index, vectors)
+        if layout is None:
+            layout = table_layout(table, table_index)
+        (rows, matrix_rows, matrix_columns, nr_rows, nr_columns), keys, reals = layout
+        types = [table.schema.field(name).type for name in vectors]
+        values = np.full(
+            (len(vectors), nr_rows, nr_columns), np.nan, value_dtype(types)
+        )
+        for number, col_name in enumerate(vectors):
+            values[number, matrix_rows, matrix_columns] = to_float(table[col_name])[rows]
+        present = np.zeros((nr_rows, nr_columns), dtype=bool)
+        present[matrix_rows, matrix_columns] = True
+        return cls(keys, reals, vectors, values, present, types)
+
+    @classmethod
+    def from_realizations(
+        cls,
+        tables: Mapping[int, pa.Table],
+        table_index: List[str],
+        vectors: List[str] = None,
+    ) -> "EnsembleMatrix":
+        """Make matrix from per realization tables, aligned on union of index
+
+        Args:
+            tables (dict): realization number as key, table as value
+            table_index (list): the index columns
+            vectors (list, optional): vectors to include, defaults to all
+                                      numeric columns of the first table
+
+        Returns:
+            EnsembleMatrix: the matrix
+        """
+        logger = logging.getLogger(__name__ + ".EnsembleMatrix.from_realizations")
+        tables = {real: table for real, table in tables.items() if table.num_rows}
+        reals = np.array(sorted(tables), dtype=np.int64)
+        first = tables[reals[0]]
+        if vectors is None:
+            vectors = numeric_vectors(first, table_index)
+        keys, positions = align_index(
+            [tables[real].select(table_index) for real in reals], table_index
+        )
+        types = [
+            first.schema.field(name).type if name in first.column_names else pa.float32()
+            for name in vectors
+        ]
+        values = np.full(
+            (len(vectors), keys.num_rows, len(reals)), np.nan, value_dtype(types)
+        )
+        present = np.zeros((keys.num_rows, len(reals)), dtype=bool)
+        for column, real in enumerate(reals):
+            table = tables[real]
+            rows = positions[column] >= 0
+            if len(np.unique(positions[column][rows])) < rows.sum():
+                logger.warning("Real %s has repeated index values, last is used", real)
+            present[positions[column][rows], column] = True
+            for number, col_name in enumerate(vectors):
+                if col_name not in table.column_names:
+                    continue
+                values[number, positions[column][rows], column] = to_float(
+                    table[col_name]
+                )[rows]
+        return cls(keys, reals, vectors, values, present, types)
+
+    def reindex(self, keys: pa.Table = None, reals: np.ndarray = None) -> "EnsembleMatrix":
+        """Return matrix on other index values and realizations, NaN where new
+
+        Args:
+            keys (pa.Table, optional): index values, defaults to existing
+            reals (np.ndarray, optional): realizations, defaults to existing
+
+        Returns:
+            EnsembleMatrix: the reindexed matrix
+        """
+        if self._reals is None:
+            raise ValueError("Cannot reindex matrix without realizations")
+        keys = self._keys if keys is None else keys
+        reals = self._reals if reals is None else np.asarray(reals)
+        own_keys = align_index(
+            [keys, self._keys.cast(keys.schema)], keys.column_names, sort=False
+        )[1][1]
+        real_positions = np.searchsorted(reals, self._reals)
+        real_positions[real_positions >= len(reals)] = 0
+        found = reals[real_positions] == self._reals
+        values = np.full(
+            (len(self._vectors), keys.num_rows, len(reals)), np.nan, self._values.dtype
+        )
+        present = np.zeros((keys.num_rows, len(reals)), dtype=bool)
+        rows = own_keys >= 0
+        target = np.ix_(own_keys[rows], real_positions[found])
+        values[(slice(None),) + target] = self._values[:, rows][:, :, found]
+        present[target] = self._present[rows][:, found]
+        return EnsembleMatrix(keys, reals, self._vectors, values, present, self._types)
+
+    def to_table(self, vector: str) -> pa.Table:
+        """Return one vector in long format, only where realizations have values
+
+        Args:
+            vector (str): name of vector
+
+        Returns:
+            pa.Table: table with index columns, REAL and vector
+        """
+        key_rows, columns = np.nonzero(self._present)
+        number = self._vectors.index(vector)
+        table = self._keys.take(pa.array(key_rows))
+        reals = self._reals if self._reals is not None else np.arange(self._values.shape[2])
+        table = table.append_column("REAL", pa.array(reals[columns].astype(np.int16)))
+        values = pa.array(self._values[number][key_rows, columns], from_pandas=True)
+        return table.append_column(vector, values.cast(self._types[number]))
+
+    def resample(
+        self, frequency: str, cumulative: Callable[[str], bool] = None
+    ) -> "EnsembleMatrix":
+        """Return matrix resampled to coarser dates
+
+        Cumulative vectors get the last value in each period, the others the
+        average over the period. Periods are labelled with their first day.
+
+        Args:
+            frequency (str): one of the keys in FREQUENCIES
+            cumulative (Callable, optional): tells if vector is cumulative,
+                                             defaults to is_cumulative
+
+        Raises:
+            ValueError: if frequency is unknown, or index is not one date column
+
+        Returns:
+            EnsembleMatrix: the resampled matrix
+        """
+        if frequency not in FREQUENCIES:
+            raise ValueError(f"Frequency must be one of {list(FREQUENCIES)}")
+        if len(self.table_index) != 1 or not pa.types.is_timestamp(
+            self._keys.schema.field(0).type
+        ):
+            raise ValueError(f"Cannot resample on index {self.table_index}")
+        cumulative = cumulative or is_cumulative
+        dates = self._keys.column(0).to_numpy()
+        periods = dates.astype(f"datetime64[{FREQUENCIES[frequency]}]")
+        starts = np.flatnonzero(np.concatenate(([True], periods[1:] != periods[:-1])))
+        date_type = self._keys.schema.field(0).type
+        keys = pa.table(
+            {
+                self.table_index[0]: pa.array(
+                    periods[starts].astype(dates.dtype), type=date_type
+                )
+            }
+        )
+        valid = ~np.isnan(self._values)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            averages = np.add.reduceat(
+                np.where(valid, self._values, 0), starts, axis=1
+            ) / np.add.reduceat(valid, starts, axis=1)
+        rows = np.arange(len(dates))[np.newaxis, :, np.newaxis]
+        last = np.maximum.reduceat(np.where(valid, rows, -1), starts, axis=1)
+        lasts = np.take_along_axis(self._values, np.maximum(last, 0), axis=1)
+        lasts[last < 0] = np.nan
+        totals = np.array([cumulative(name) for name in self._vectors], dtype=bool)
+        values = np.where(totals[:, np.newaxis, np.newaxis], lasts, averages)
+        present = np.logical_or.reduceat(self._present, starts, axis=0)
+        return EnsembleMatrix(
+            keys,
+            self._reals,
+            self._vectors,
+            values.astype(self._values.dtype),
+            present,
+            self._types,
+        )
+
+
+def is_cumulative(vector: str) -> bool:
+    """Tell if eclipse summary vector is cumulative (a total)
+
+    The mnemonic minus its first letter (F, G, W, C, R, ...) and
+    an ending H for history is checked against TOTAL_MNEMONICS
+
+    Args:
+        vector (str): name of vector, e.g. FOPT or WOPTH:OP_1
+
+    Returns:
+        bool: True if vector is a total
+    """
+    mnemonic = vector.split(":")[0][1:]
+    if mnemonic.endswith("H"):
+        mnemonic = mnemonic[:-1]
+    return mnemonic in TOTAL_MNEMONICS
+
+
+def align_index(
+    index_tables: List[pa.Table], table_index: List[str], sort: bool = True
+) -> Tuple[pa.Table, List[np.ndarray]]:
+    """Align index values of several tables to the union of them
+
+    A single numeric or temporal index column is merged through numpy
+    (np.unique and searchsorted), other indexes are grouped through arrow
+
+    Args:
+        index_tables (list): tables with the index columns
+        table_index (list): the index columns
+        sort (bool, optional): if False the first table is the union
+                               and is kept in its order. Defaults to True.
+
+    Returns:
+        tuple: union of index values, position in union per row per table
+    """
+    lengths = [table.num_rows for table in index_tables]
+    bounds = np.cumsum([0] + lengths)
+    first_type = index_tables[0].schema.field(table_index[0]).type
+    mergeable = len(table_index) == 1 and (
+        pa.types.is_temporal(first_type) or is_numeric(first_type)
+    )
+    if mergeable and sort:
+        arrays = [
+            table[table_index[0]].cast(first_type).to_numpy() for table in index_tables
+        ]
+        union = np.unique(np.concatenate(arrays))
+        positions = [np.searchsorted(union, array) for array in arrays]
+        keys = pa.table({table_index[0]: pa.array(union, type=first_type)})
+        return keys, positions
+    combined = pa.concat_tables(
+        [table.cast(index_tables[0].schema) for table in index_tables]
+    )
+    codes, keys = group_rows(combined, table_index)
+    if not sort:
+        # union is the first table, map the sorted groups back to its rows
+        first_codes = codes[: lengths[0]]
+        inverse = np.full(keys.num_rows, -1, dtype=np.int64)
+        inverse[first_codes[first_codes >= 0]] = np.flatnonzero(first_codes >= 0)
+        codes = np.where(codes >= 0, inverse[np.maximum(codes, 0)], -1)
+        keys = index_tables[0]
+    positions = [codes[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+    return keys, positions
@@ -0,0 +1,240 @@
+"""Peak memory profiling of aggregation stages, tables and segments"""
+import os
+import json
+import logging
+import threading
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# Environment variable turning on profiling, value is sampling interval in
+# seconds, or 1/true/yes for the default interval
+PROFILE_MEMORY = "SUMO_AGGREGATION_MEMORY"
+DEFAULT_INTERVAL = 0.05
+
+
+def _sample() -> tuple:
+    """Read resident memory of process and bytes allocated by arrow
+
+    Returns:
+        tuple: rss and arrow bytes
+    """
+    import psutil  # pylint: disable=import-outside-toplevel
+    import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+    return psutil.Process(os.getpid()).memory_info().rss, pa.total_allocated_bytes()
+
+
+class MemoryProfiler:
+    """Samples memory in background thread, and keeps peaks per label
+
+    A label is active while its profile context is open, every sample
+    taken meanwhile counts towards its peak. Labels can be stages
+    (e.g. concat), tables or segments, and be open in several threads.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, top_allocators: int = 0):
+        """Set up profiler, sampling starts with the first open label
+
+        Args:
+            interval (float): seconds between samples
+            top_allocators (int): number of top allocating source lines
+                                  to report per label from tracemalloc,
+                                  0 to not use tracemalloc
+        """
+        self._interval = interval
+        self._top_allocators = top_allocators
+        self._lock = threading.Lock()
+        self._active = {}
+        self._results = {}
+        self._stop = threading.Event()
+        self._thread = None
+        if top_allocators and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _update(self, rss: int, arrow: int):
+        """Add sample to all active labels
+
+        Args:
+            rss (int): resident memory
+            arrow (int): bytes allocated by arrow
+        """
+        with self._lock:
+            for record in self._active.values():
+                record["peak_rss"] = max(record["peak_rss"], rss)
+                record["peak_arrow"] = max(record["peak_arrow"], arrow)
+
+    def _run(self):
+        """Take samples until stopped"""
+        while not self._stop.wait(self._interval):
+            self._update(*_sample())
+
+    def _ensure_sampler(self):
+        """Start background sampler if not running"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="memory-sampler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop background sampler"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @contextmanager
+    def profile(self, label: str):
+        """Track peak memory while in context
+
+        Args:
+            label (str): name of stage, table or segment
+        """
+        rss, arrow = _sample()
+        record = {
+            "start_rss": rss,
+            "peak_rss": rss,
+            "start_arrow": arrow,
+            "peak_arrow": arrow,
+        }
+        snapshot = tracemalloc.take_snapshot() if self._top_allocators else None
+        key = (label, threading.get_ident(), id(record))
+        with self._lock:
+            self._active[key] = record
+        self._ensure_sampler()
+        try:
+            yield
+        finally:
+            self._update(*_sample())
+            with self._lock:
+                del self._active[key]
+            top = []
+            if snapshot is not None:
+                stats = tracemalloc.take_snapshot().compare_to(snapshot, "lineno")
+                top = [
+                    {"line": str(stat.traceback[0]), "size_diff": stat.size_diff}
+                    for stat in stats[: self._top_allocators]
+                ]
+            self._add_result(label, record, top)
+
+    def _add_result(self, label: str, record: dict, top: list):
+        """Merge peaks of one closed profile into results for label
+
+        Args:
+            label (str): the label
+            record (dict): peaks of the closed profile
+            top (list): top allocators of the closed profile
+        """
+        with self._lock:
+            result = self._results.setdefault(
+                label,
+                {"count": 0, "peak_rss": 0, "peak_rss_increase": 0, "peak_arrow": 0},
+            )
+            result["count"] += 1
+            result["peak_rss"] = max(result["peak_rss"], record["peak_rss"])
+            result["peak_rss_increase"] = max(
+                result["peak_rss_increase"], record["peak_rss"] - record["start_rss"]
+            )
+            result["peak_arrow"] = max(result["peak_arrow"], record["peak_arrow"])
+            if top:
+                result["top_allocators"] = top
+
+    def report(self) -> dict:
+        """Return peaks per label, and arrow memory pool stats
+
+        Returns:
+            dict: labels and pool
+        """
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+
+        pool = pa.default_memory_pool()
+        with self._lock:
+            labels = {label: dict(result) for label, result in self._results.items()}
+        return {
+            "labels": labels,
+            "arrow_pool": {
+                "backend": pool.backend_name,
+                "bytes_allocated": pool.bytes_allocated(),
+                "max_memory": pool.max_memory(),
+            },
+        }
+
+    def export(self, path: str):
+        """Write report as json
+
+        Args:
+            path (str): path to file
+        """
+        with open(path, "w", encoding="utf-8") as stream:
+            json.dump(self.report(), stream, indent=2)
+
+
+_PROFILER = None
+
+
+def enable(interval: float = DEFAULT_INTERVAL, top_allocators: int = 0):
+    """Turn on memory profiling in process
+
+    Args:
+        interval (float): seconds between samples
+        top_allocators (int): top allocating source lines per label, 0 for none
+
+    Returns:
+        MemoryProfiler: the profiler
+    """
+    global _PROFILER  # pylint: disable=global-statement
+    disable()
+    _PROFILER = MemoryProfiler(interval, top_allocators)
+    logging.getLogger(__name__ + ".enable").info(
+        "Memory profiling every %s s", interval
+    )
+    return _PROFILER
+
+
+def disable():
+    """Turn off memory profiling in process"""
+    global _PROFILER  # pylint: disable=global-statement
+    if _PROFILER is not None:
+        _PROFILER.stop()
+    _PROFILER = None
+
+
+def get_profiler():
+    """Return profiler of process, None when profiling is off
+
+    Returns:
+        MemoryProfiler: the profiler
+    """
+    return _PROFILER
+
+
+def profile(label: str):
+    """Track peak memory of label while in context, nothing when profiling is off
+
+    Args:
+        label (str): name of stage, table or segment
+
+    Returns:
+        contextmanager: the context
+    """
+    if _PROFILER is None:
+        return nullcontext()
+    return _PROFILER.profile(label)
+
+
+def report() -> dict:
+    """Return report of process profiler, see MemoryProfiler.report
+
+    Returns:
+        dict: the report, None when profiling is off
+    """
+    if _PROFILER is None:
+        return None
+    return _PROFILER.report()
+
+
+_SETTING = os.environ.get(PROFILE_MEMORY, "").lower()
+if _SETTING in ("1", "true", "yes"):
+    enable()
+elif _SETTING:
+    enable(float(_SETTING))
@@ -0,0 +1,253 @@
+"""Per-stage performance metrics, exported as Prometheus textfile or json"""
+import os
+import json
+import logging
+import threading
+from time import perf_counter
+from contextlib import contextmanager
+
+# Environment variable with path to export metrics to, .prom gives
+# Prometheus textfile format, anything else json. The process id is added
+# to the file name, see process_path
+METRICS_PATH = "SUMO_AGGREGATION_METRICS"
+STAGES = (
+    "discovery",
+    "download",
+    "decode",
+    "concat",
+    "spill",
+    "statistics",
+    "serialize",
+    "metadata_post",
+    "blob_upload",
+)
+# Upper bounds of latency histogram buckets in seconds
+BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float("inf"))
+PREFIX = "sumo_aggregation"
+
+
+def process_path(path: str) -> str:
+    """Return path with process id added to file name, e.g. metrics-12.prom
+
+    Worker processes then export to files of their own, each with the
+    totals of all jobs run in the process
+
+    Args:
+        path (str): the path
+
+    Returns:
+        str: the path for this process
+    """
+    root, suffix = os.path.splitext(str(path))
+    return f"{root}-{os.getpid()}{suffix}"
+
+
+class Sample:
+    """Bytes and objects recorded for one measured piece of work"""
+
+    __slots__ = ("bytes_in", "bytes_out", "objects")
+
+    def __init__(self):
+        """Start with nothing recorded"""
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.objects = 0
+
+
+class Metrics:
+    """Thread safe collection of per-stage durations, bytes and counters"""
+
+    def __init__(self):
+        """Start with empty metrics"""
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Remove everything recorded"""
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+
+    def _stage(self, name: str) -> dict:
+        """Get recorded values of stage, make them if missing
+
+        Args:
+            name (str): the stage
+
+        Returns:
+            dict: the recorded values
+        """
+        if name not in self._stages:
+            self._stages[name] = {
+                "count": 0,
+                "seconds": 0.0,
+                "max_seconds": 0.0,
+                "buckets": [0] * len(BUCKETS),
+                "bytes_in": 0,
+                "bytes_out": 0,
+                "objects": 0,
+            }
+        return self._stages[name]
+
+    def observe(self, name: str, seconds: float, sample: Sample = None):
+        """Record one piece of work in stage
+
+        Args:
+            name (str): the stage
+            seconds (float): time used
+            sample (Sample, optional): bytes and objects
+        """
+        with self._lock:
+            stage = self._stage(name)
+            stage["count"] += 1
+            stage["seconds"] += seconds
+            stage["max_seconds"] = max(stage["max_seconds"], seconds)
+            for number, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    stage["buckets"][number] += 1
+                    break
+            if sample is not None:
+                stage["bytes_in"] += sample.bytes_in
+                stage["bytes_out"] += sample.bytes_out
+                stage["objects"] += sample.objects
+
+    @contextmanager
+    def measure(self, name: str):
+        """Time work in context as one piece of work in stage
+
+        Args:
+            name (str): the stage
+
+        Yields:
+            Sample: for recording bytes and objects
+        """
+        sample = Sample()
+        start = perf_counter()
+        try:
+            yield sample
+        finally:
+            self.observe(name, perf_counter() - start, sample)
+
+    def count(self, name: str, value: int = 1):
+        """Increase counter, e.g. cache_hits, cache_misses or retries
+
+        Args:
+            name (str): name of counter
+            value (int): increase
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def to_dict(self) -> dict:
+        """Return copy of everything recorded
+
+        Returns:
+            dict: stages and counters
+        """
+        with self._lock:
+            stages = {
+                name: dict(stage, buckets=list(stage["buckets"]))
+                for name, stage in self._stages.items()
+            }
+            return {"stages": stages, "counters": dict(self._counters)}
+
+    def to_prometheus(self) -> str:
+        """Return everything recorded in Prometheus text format
+
+        Returns:
+            str: the text
+        """
+        recorded = self.to_dict()
+        pid = f'pid="{os.getpid()}"'
+        lines = [f"# TYPE {PREFIX}_stage_seconds histogram"]
+        for name, stage in recorded["stages"].items():
+            labels = f'stage="{name}",{pid}'
+            cumulative = 0
+            for bound, bucket in zip(BUCKETS, stage["buckets"]):
+                cumulative += bucket
+                label = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(
+                    f'{PREFIX}_stage_seconds_bucket{{{labels},le="{label}"}}'
+                    f" {cumulative}"
+                )
+            lines.append(f"{PREFIX}_stage_seconds_sum{{{labels}}} {stage['seconds']}")
+            lines.append(f"{PREFIX}_stage_seconds_count{{{labels}}} {stage['count']}")
+        for total in ("bytes_in", "bytes_out", "objects"):
+            lines.append(f"# TYPE {PREFIX}_stage_{total}_total counter")
+            for name, stage in recorded["stages"].items():
+                lines.append(
+                    f'{PREFIX}_stage_{total}_total{{stage="{name}",{pid}}} '
+                    f"{stage[total]}"
+                )
+        for name, value in recorded["counters"].items():
+            lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+            lines.append(f"{PREFIX}_{name}_total{{{pid}}} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, path: str = None):
+        """Write metrics to file, Prometheus textfile if suffix is .prom else json
+
+        Series are labelled with the process id, so files of several
+        processes can be scraped together
+
+        Args:
+            path (str, optional): path to file, defaults to environment
+                                  variable SUMO_AGGREGATION_METRICS with the
+                                  process id added, see process_path,
+                                  nothing is written if neither is set
+
+        Returns:
+            str: the path written to, None if nothing written
+        """
+        if not path:
+            path = os.environ.get(METRICS_PATH)
+            if not path:
+                return None
+            path = process_path(path)
+        # Write to temporary file first, scrapers must never see half a file
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as stream:
+            if str(path).endswith(".prom"):
+                stream.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), stream, indent=2)
+        os.replace(tmp_path, path)
+        logging.getLogger(__name__ + ".export").info("Metrics written to %s", path)
+        return path
+
+
+METRICS = Metrics()
+
+
+def measure(name: str):
+    """Time work in context as one piece of work in stage of process metrics
+
+    Args:
+        name (str): the stage, see STAGES
+
+    Returns:
+        contextmanager: yields Sample for recording bytes and objects
+    """
+    return METRICS.measure(name)
+
+
+def count(name: str, value: int = 1):
+    """Increase counter of process metrics
+
+    Args:
+        name (str): name of counter
+        value (int): increase
+    """
+    METRICS.count(name, value)
+
+
+def export(path: str = None):
+    """Export process metrics, see Metrics.export
+
+    Args:
+        path (str, optional): path to file
+
+    Returns:
+        str: the path written to, None if nothing written
+    """
+    return METRICS.export(path)
@@ -0,0 +1,221 @@
+"""Explains what an aggregation will cost, without running it"""
+import os
+import json
+from sumo.table_aggregation import dispatch
+from sumo.table_aggregation.executor import estimate_job_memory
+from sumo.table_aggregation.utilities import BLOB_CACHE
+
+# Columns that are neither index nor vectors
+NOT_VECTORS = ("REAL", "YEARS", "SECONDS", "ENSEMBLE")
+
+
+def read_footer(object_id: str):
+    """Read parquet footer of blob in blob cache
+
+    Args:
+        object_id (str): sumo object id
+
+    Returns:
+        pq.FileMetaData: the footer, None if blob is not cached
+    """
+    file_path = os.path.join(os.environ.get(BLOB_CACHE, ""), f"{object_id}.parquet")
+    if not os.path.isfile(file_path):
+        return None
+    import pyarrow.parquet as pq  # pylint: disable=import-outside-toplevel
+
+    return pq.read_metadata(file_path)
+
+
+def explain_segment(
+    columns: list,
+    table_index: list,
+    rows: int,
+    nr_reals: int,
+    nr_aggfuncs: int,
+    nr_frequencies: int = 0,
+    index: bool = True,
+) -> dict:
+    """Estimate results of aggregating one segment of columns
+
+    Args:
+        columns (list): columns in segment, including table index
+        table_index (list): the table index
+        rows (int): rows per realization
+        nr_reals (int): number of realizations
+        nr_aggfuncs (int): number of statistics per vector
+        nr_frequencies (int): number of resampling frequencies
+        index (bool): segment uploads the index objects of the table
+
+    Returns:
+        dict: columns, cells, output objects and upload bytes
+    """
+    table_index = table_index or []
+    nr_index = len(table_index) if index else 0
+    nr_vectors = len(
+        [col for col in columns if col not in table_index and col not in NOT_VECTORS]
+    )
+    collection_cells = rows * nr_reals * (len(table_index) + 2)
+    stat_cells = rows * (len(table_index) + 1)
+    objects = nr_index + nr_vectors * (1 + nr_aggfuncs)
+    upload_cells = (
+        nr_index * collection_cells
+        + nr_vectors * collection_cells
+        + nr_vectors * nr_aggfuncs * stat_cells
+    )
+    # Resampled results are counted as large as the full ones
+    objects += nr_frequencies * nr_vectors * (1 + nr_aggfuncs)
+    upload_cells += nr_frequencies * nr_vectors * (collection_cells + stat_cells)
+    return {
+        "columns": len(columns),
+        "vectors": nr_vectors,
+        "cells": rows * nr_reals * len(columns),
+        "output_objects": objects,
+        "upload_bytes": upload_cells * dispatch.BYTES_PER_CELL,
+    }
+
+
+def explain_records(records, aggfuncs="standards", frequencies=()) -> dict:
+    """Explain cost of manifest records
+
+    Rows are read from parquet footers of blobs already in the blob cache,
+    otherwise taken from the registry of realization objects, or from the
+    discovery metadata. Blobs shared by realizations are downloaded once.
+
+    Args:
+        records (iterable): table and job records, see dispatch.generate_manifest
+        aggfuncs (str, list, None): statistics to make, None for no statistics
+        frequencies (tuple): resampling frequencies
+
+    Returns:
+        dict: report per table and job, with totals
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.stats import check_aggfuncs
+
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.registry import as_registry
+
+    nr_aggfuncs = 0 if aggfuncs is None else len(check_aggfuncs(aggfuncs))
+    tables = {}
+    for record in records:
+        if not dispatch.is_job(record):
+            metadata = record["base_meta"]
+            registry = as_registry(record["object_ids"])
+            rows, nr_cols, blob_bytes = dispatch.table_dimensions(metadata)
+            rows = registry.max_rows(default=rows)
+            nr_cols = registry.max_columns(default=nr_cols)
+            footer = None
+            if len(registry):
+                footer = read_footer(registry.object_ids[0])
+            if footer is not None:
+                rows, nr_cols = footer.num_rows, footer.num_columns
+            tables[record["table"]] = {
+                "table_name": record["table_name"],
+                "tag_name": record["tag_name"],
+                "table_index": record["table_index"],
+                "realizations": len(registry),
+                "unique_blobs": registry.nr_unique,
+                "rows": rows,
+                "columns": nr_cols,
+                "blob_bytes": blob_bytes,
+                "download_bytes": registry.fetch_bytes(default=blob_bytes),
+                "rows_from": "footer" if footer is not None else "metadata",
+                "jobs": [],
+                "record": record,
+            }
+            continue
+        table = tables[record["table"]]
+        dispatch_info = dispatch.resolve_job(record, table["record"])
+        segments = [
+            explain_segment(
+                columns,
+                table["table_index"],
+                table["rows"],
+                table["realizations"],
+                nr_aggfuncs,
+                len(frequencies),
+                index=dispatch_info.get("index", True) and number == 0,
+            )
+            for number, columns in enumerate(dispatch.job_segments(dispatch_info))
+        ]
+        table["jobs"].append(
+            {
+                "job": record["job"],
+                "cost": record.get("cost"),
+                "download_bytes": table["download_bytes"],
+                "peak_memory": estimate_job_memory(dispatch_info),
+                "output_objects": sum(seg["output_objects"] for seg in segments),
+                "upload_bytes": sum(seg["upload_bytes"] for seg in segments),
+                "segments": segments,
+            }
+        )
+    report = {"tables": []}
+    for table in tables.values():
+        del table["record"]
+        report["tables"].append(table)
+    jobs = [job for table in report["tables"] for job in table["jobs"]]
+    report["totals"] = {
+        "tables": len(report["tables"]),
+        "jobs": len(jobs),
+        "download_bytes": sum(job["download_bytes"] for job in jobs),
+        "peak_memory": max((job["peak_memory"] for job in jobs), default=0),
+        "output_objects": sum(job["output_objects"] for job in jobs),
+        "upload_bytes": sum(job["upload_bytes"] for job in jobs),
+        "cost": sum(job["cost"] or 0 for job in jobs),
+    }
+    return report
+
+
+def explain(
+    uuid,
+    env,
+    iteration_name,
+    token=None,
+    seg_length=250,
+    target_cost=None,
+    group_segments=False,
+    aggfuncs="standards",
+    frequencies=(),
+) -> dict:
+    """Explain what running dispatch for iteration of case will cost
+
+    Only discovery queries are run against sumo, nothing is aggregated
+
+    Args:
+        uuid (str): case uuid
+        env (str): name of sumo env to read from
+        iteration_name (str): name of iteration
+        token (str, optional): authentication token
+        seg_length (int): length of columns to pass per batch job
+        target_cost (float, optional): target estimated seconds per job
+        group_segments (bool): group segments of table in jobs
+        aggfuncs (str, list, None): statistics to make, None for no statistics
+        frequencies (tuple): resampling frequencies
+
+    Returns:
+        dict: the report, see explain_records
+    """
+    return explain_records(
+        dispatch.generate_manifest(
+            uuid,
+            env,
+            iteration_name,
+            token,
+            seg_length,
+            target_cost,
+            group_segments,
+        ),
+        aggfuncs,
+        frequencies,
+    )
+
+
+def write_plan(report: dict, path: str):
+    """Write report from explain as json
+
+    Args:
+        report (dict): the report
+        path (str): path to file to write
+    """
+    with open(path, "w", encoding="utf-8") as stream:
+        json.dump(report, stream, indent=2)
@@ -0,0 +1,413 @@
+"""Opt-in sampling profiler of aggregation stages, with flamegraph output
+
+When turned on, the hot stages (aggregate_arrow, extract_and_upload and
+make_stat_aggregations) are wrapped, and stacks of the threads working for
+a stage or table are sampled while it is running. Work handed to other
+threads is followed when wrapped with carried, as call_parallel does.
+Output is a collapsed-stack file, as read by flamegraph.pl and speedscope,
+and a top-N summary per label. When off, nothing is wrapped, so there is
+no overhead.
+"""
+import os
+import sys
+import json
+import asyncio
+import logging
+import threading
+import importlib
+import contextvars
+from functools import wraps
+from collections import Counter
+from contextlib import ExitStack, contextmanager, nullcontext
+
+# Environment variable turning on profiling, value is folder to write to
+PROFILE_STAGES = "SUMO_AGGREGATION_PROFILE"
+DEFAULT_INTERVAL = 0.01
+DEFAULT_TOP = 20
+# Stages that are wrapped when profiling is on: module, function
+HOOKS = (
+    ("sumo.table_aggregation.utilities.fetch", "aggregate_arrow"),
+    ("sumo.table_aggregation.utilities.upload", "extract_and_upload"),
+    ("sumo.table_aggregation.utilities.aggregations", "make_stat_aggregations"),
+)
+# Frames of threads waiting for work, left out so the profile shows work
+IDLE = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+}
+
+_TABLE = contextvars.ContextVar("profiled_table", default=None)
+# Labels open in the current context, see carried
+_LABELS = contextvars.ContextVar("profiled_labels", default=())
+
+
+class StageProfiler:
+    """Samples stacks of threads, and counts them per active label
+
+    A label is active while its profile context is open. Labels can be
+    tables, or stages within tables, and be open in several threads. A
+    sample of a thread counts towards the labels open in that thread, so
+    tables run at the same time in other threads are kept apart. Samples of
+    a thread running coroutines of several tables, i.e. the event loop,
+    count towards all of them.
+    """
+
+    def __init__(self, interval: float = DEFAULT_INTERVAL, top: int = DEFAULT_TOP):
+        """Set up profiler, sampling starts with the first open label
+
+        Args:
+            interval (float): seconds between samples
+            top (int): number of functions in summary per label
+        """
+        self._interval = interval
+        self._top = top
+        self._lock = threading.Lock()
+        self._active = {}
+        self._stacks = {}
+        self._frame_names = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _frame_name(self, code) -> str:
+        """Make name of frame, cached per code object
+
+        Args:
+            code (types.CodeType): code of the frame
+
+        Returns:
+            str: function with file and line
+        """
+        name = self._frame_names.get(code)
+        if name is None:
+            name = (
+                f"{code.co_name} "
+                f"({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+            self._frame_names[code] = name
+        return name
+
+    def _collect(self, idents: set) -> dict:
+        """Take one sample of the stacks of threads
+
+        Args:
+            idents (set): identifiers of the threads to sample
+
+        Returns:
+            dict: thread identifier as key, stack as tuple of frame names,
+                  outermost first, as value, threads waiting are left out
+        """
+        stacks = {}
+        for ident, frame in sys._current_frames().items():  # pylint: disable=W0212
+            if ident not in idents:
+                continue
+            leaf = frame.f_code
+            if (os.path.basename(leaf.co_filename), leaf.co_name) in IDLE:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            stacks[ident] = tuple(reversed(stack))
+        return stacks
+
+    def _run(self):
+        """Take samples until stopped"""
+        while not self._stop.wait(self._interval):
+            with self._lock:
+                threads = {label: set(idents) for label, idents in self._active.items()}
+            if not threads:
+                continue
+            stacks = self._collect(set().union(*threads.values()))
+            with self._lock:
+                for label, idents in threads.items():
+                    self._stacks.setdefault(label, Counter()).update(
+                        stacks[ident] for ident in idents if ident in stacks
+                    )
+
+    def _ensure_sampler(self):
+        """Start background sampler if not running"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="stage-sampler", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """Stop background sampler"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    @contextmanager
+    def profile(self, label: str):
+        """Sample stacks of this thread for label while in context
+
+        Args:
+            label (str): name of table or stage
+        """
+        ident = threading.get_ident()
+        with self._lock:
+            self._active.setdefault(label, Counter())[ident] += 1
+        self._ensure_sampler()
+        token = _LABELS.set(_LABELS.get() + (label,))
+        try:
+            yield
+        finally:
+            _LABELS.reset(token)
+            with self._lock:
+                idents = self._active[label]
+                idents[ident] -= 1
+                if idents[ident] <= 0:
+                    del idents[ident]
+                if not idents:
+                    del self._active[label]
+
+    def collapsed(self) -> str:
+        """Return samples as collapsed stacks, with label as outermost frames
+
+        Returns:
+            str: one line per stack, frames separated by ; then the count
+        """
+        with self._lock:
+            stacks = {label: Counter(counts) for label, counts in self._stacks.items()}
+        lines = []
+        for label, counts in sorted(stacks.items()):
+            for stack, count in counts.most_common():
+                lines.append(";".join(label.split("/") + list(stack)) + f" {count}")
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def report(self) -> dict:
+        """Return hottest functions per label
+
+        Self time counts samples where the function was running, total time
+        also samples where it was waiting for functions it called.
+
+        Returns:
+            dict: per label samples, seconds summed over threads and top
+                  functions
+        """
+        with self._lock:
+            stacks = {label: Counter(counts) for label, counts in self._stacks.items()}
+        results = {}
+        for label, counts in sorted(stacks.items()):
+            own = Counter()
+            total = Counter()
+            for stack, count in counts.items():
+                own[stack[-1]] += count
+                for name in set(stack):
+                    total[name] += count
+            nr_samples = sum(counts.values())
+            results[label] = {
+                "samples": nr_samples,
+                "seconds": nr_samples * self._interval,
+                "top": [
+                    {
+                        "function": name,
+                        "self_seconds": count * self._interval,
+                        "total_seconds": total[name] * self._interval,
+                    }
+                    for name, count in own.most_common(self._top)
+                ],
+            }
+        return results
+
+    def export(self, folder: str) -> list:
+        """Write collapsed stacks and top functions, named by process id
+
+        Worker processes can export to the same folder without overwriting
+        each other, flamegraph.pl takes the folded files of all of them.
+
+        Args:
+            folder (str): the folder to write to, made if missing
+
+        Returns:
+            list: paths written to
+        """
+        os.makedirs(folder, exist_ok=True)
+        folded_path = os.path.join(folder, f"profile-{os.getpid()}.folded")
+        top_path = os.path.join(folder, f"profile-top-{os.getpid()}.json")
+        with open(folded_path, "w", encoding="utf-8") as stream:
+            stream.write(self.collapsed())
+        with open(top_path, "w", encoding="utf-8") as stream:
+            json.dump(self.report(), stream, indent=2)
+        return [folded_path, top_path]
+
+
+def profiled(func, stage: str):
+    """Wrap function so it is profiled as stage of the current table
+
+    Args:
+        func (callable): function or coroutine function
+        stage (str): name of stage
+
+    Returns:
+        callable: the wrapped function
+    """
+
+    def label():
+        table = _TABLE.get()
+        return stage if table is None else f"{table}/{stage}"
+
+    if asyncio.iscoroutinefunction(func):
+
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            with profile(label()):
+                return await func(*args, **kwargs)
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with profile(label()):
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+def carried(func):
+    """Wrap function so it is profiled under the labels open where wrapped
+
+    For work handed to other threads, e.g. executors, which do not run
+    in the context of the caller.
+
+    Args:
+        func (callable): the function
+
+    Returns:
+        callable: the wrapped function, func itself when nothing is profiled
+    """
+    labels = _LABELS.get()
+    profiler = _PROFILER
+    if profiler is None or not labels:
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with ExitStack() as stack:
+            for label in labels:
+                stack.enter_context(profiler.profile(label))
+            return func(*args, **kwargs)
+
+    return wrapper
+
+
+_PROFILER = None
+_FOLDER = None
+_ORIGINALS = {}
+
+
+def enable(folder: str, interval: float = DEFAULT_INTERVAL, top: int = DEFAULT_TOP):
+    """Turn on profiling in process, wrapping the functions in HOOKS
+
+    Args:
+        folder (str): folder to export to
+        interval (float): seconds between samples
+        top (int): number of functions in summary per label
+
+    Returns:
+        StageProfiler: the profiler
+    """
+    global _PROFILER, _FOLDER  # pylint: disable=global-statement
+    disable()
+    _PROFILER = StageProfiler(interval, top)
+    _FOLDER = folder
+    for module_name, name in HOOKS:
+        module = importlib.import_module(module_name)
+        original = getattr(module, name)
+        _ORIGINALS[(module_name, name)] = original
+        setattr(module, name, profiled(original, name))
+    logging.getLogger(__name__ + ".enable").info(
+        "Profiling every %s s to %s", interval, folder
+    )
+    return _PROFILER
+
+
+def disable():
+    """Turn off profiling in process, restoring the functions in HOOKS"""
+    global _PROFILER, _FOLDER  # pylint: disable=global-statement
+    for (module_name, name), original in _ORIGINALS.items():
+        setattr(importlib.import_module(module_name), name, original)
+    _ORIGINALS.clear()
+    if _PROFILER is not None:
+        _PROFILER.stop()
+    _PROFILER = None
+    _FOLDER = None
+
+
+def get_profiler():
+    """Return profiler of process, None when profiling is off
+
+    Returns:
+        StageProfiler: the profiler
+    """
+    return _PROFILER
+
+
+def profile(label: str):
+    """Sample stacks for label while in context, nothing when profiling is off
+
+    Args:
+        label (str): name of table or stage
+
+    Returns:
+        contextmanager: the context
+    """
+    if _PROFILER is None:
+        return nullcontext()
+    return _PROFILER.profile(label)
+
+
+@contextmanager
+def _table_context(label: str):
+    """Profile table, and make it the table of stages started in context
+
+    Args:
+        label (str): name of table
+    """
+    token = _TABLE.set(label)
+    try:
+        with _PROFILER.profile(label):
+            yield
+    finally:
+        _TABLE.reset(token)
+
+
+def table(label: str):
+    """Profile table while in context, nothing when profiling is off
+
+    Stages started in the context are labelled <table>/<stage>
+
+    Args:
+        label (str): name of table
+
+    Returns:
+        contextmanager: the context
+    """
+    if _PROFILER is None:
+        return nullcontext()
+    return _table_context(label)
+
+
+def export(folder: str = None):
+    """Export profile of process, see StageProfiler.export
+
+    Args:
+        folder (str, optional): folder to write to, defaults to the one
+                                given when enabled
+
+    Returns:
+        list: paths written to, None when profiling is off
+    """
+    if _PROFILER is None:
+        return None
+    paths = _PROFILER.export(folder or _FOLDER)
+    logging.getLogger(__name__ + ".export").info("Profile written to %s", paths)
+    return paths
+
+
+if os.environ.get(PROFILE_STAGES):
+    enable(os.environ[PROFILE_STAGES])
@@ -0,0 +1,410 @@
+"""Columnar registry of the realization objects of one table
+
+A RealizationRegistry holds one row per realization, with real id, object id,
+checksum, blob size, rows and columns as numpy arrays sorted by real id.
+Lookups, deduplication by checksum and sums used for planning are vectorized.
+It is also a read only mapping from real id to object id, so code written for
+the former dict of object ids works unchanged.
+"""
+from collections.abc import Mapping
+from typing import Iterable, List, Tuple
+import numpy as np
+
+# Fields of the registry, also the keys of its json form
+FIELDS = ("reals", "object_ids", "checksums", "size_bytes", "rows", "columns")
+# Value of the integer fields when metadata does not give it
+UNKNOWN = 0
+
+
+def _get(source: dict, path: str):
+    """Get value of dotted path in metadata
+
+    Args:
+        source (dict): the metadata
+        path (str): the path, e.g. file.size_bytes
+
+    Returns:
+        any: the value, None if missing
+    """
+    value = source
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+
+def _counts(values, size: int) -> np.ndarray:
+    """Make integer array, with UNKNOWN where no value is given
+
+    Args:
+        values (iterable, None): the values, None as value or for all unknown
+        size (int): length of array
+
+    Returns:
+        np.ndarray: the array
+    """
+    if values is None:
+        return np.full(size, UNKNOWN, dtype=np.int64)
+    return np.array(
+        [UNKNOWN if value is None else value for value in values], dtype=np.int64
+    )
+
+
+class RealizationRegistry(Mapping):
+    """Realization objects of one table, one row per realization"""
+
+    # Source fields searched for, see from_hits
+    SOURCE_FIELDS = (
+        "fmu.realization.id",
+        "file.checksum_md5",
+        "file.size_bytes",
+        "_sumo.blob_size",
+        "data.spec.num_rows",
+        "data.spec.num_columns",
+    )
+
+    def __init__(
+        self,
+        reals: Iterable[int],
+        object_ids: Iterable[str],
+        checksums: Iterable[str] = None,
+        size_bytes: Iterable[int] = None,
+        rows: Iterable[int] = None,
+        columns: Iterable[int] = None,
+    ):
+        """Make registry from one value per realization in each field
+
+        When a realization is given more than once, the last one is kept,
+        as when the object ids were collected in a dict.
+
+        Args:
+            reals (iterable): realization ids
+            object_ids (iterable): sumo object ids
+            checksums (iterable, optional): md5 checksums of blobs, None if unknown
+            size_bytes (iterable, optional): sizes of blobs
+            rows (iterable, optional): number of rows in tables
+            columns (iterable, optional): number of columns in tables
+
+        Raises:
+            ValueError: if fields differ in length
+        """
+        reals = np.array(list(reals), dtype=np.int64)
+        size = len(reals)
+        fields = {
+            "object_ids": np.array(list(object_ids), dtype=object),
+            "checksums": np.array(
+                [None] * size if checksums is None else list(checksums), dtype=object
+            ),
+            "size_bytes": _counts(size_bytes, size),
+            "rows": _counts(rows, size),
+            "columns": _counts(columns, size),
+        }
+        for name, values in fields.items():
+            if len(values) != size:
+                raise ValueError(f"{name} has {len(values)} values, not {size}")
+        # Unique of reversed reals finds the last of each, sorted by real
+        _, last = np.unique(reals[::-1], return_index=True)
+        keep = size - 1 - last
+        self._reals = reals[keep]
+        self._fields = {name: values[keep] for name, values in fields.items()}
+        for values in [self._reals, *self._fields.values()]:
+            values.setflags(write=False)
+
+    @classmethod
+    def from_hits(cls, hits: list, nr_columns: int = None) -> "RealizationRegistry":
+        """Make registry from search hits of realization objects
+
+        The column names are not searched for, they are many, and only
+        their number is needed
+
+        Args:
+            hits (list): hits with _id and _source, the source having
+                         (some of) the fields in SOURCE_FIELDS
+            nr_columns (int, optional): number of columns of objects whose
+                                        source does not give it
+
+        Returns:
+            RealizationRegistry: the registry
+        """
+        sources = [hit["_source"] for hit in hits]
+        columns = [
+            _get(source, "data.spec.num_columns") or nr_columns for source in sources
+        ]
+        return cls(
+            [_get(source, "fmu.realization.id") for source in sources],
+            [hit["_id"] for hit in hits],
+            [_get(source, "file.checksum_md5") for source in sources],
+            [
+                _get(source, "file.size_bytes") or _get(source, "_sumo.blob_size")
+                for source in sources
+            ],
+            [_get(source, "data.spec.num_rows") for source in sources],
+            columns,
+        )
+
+    @classmethod
+    def from_json(cls, value) -> "RealizationRegistry":
+        """Make registry from json form, or from mapping of real to object id
+
+        Args:
+            value (dict): see to_json, or real id (maybe as str) to object id
+
+        Returns:
+            RealizationRegistry: the registry
+        """
+        if isinstance(value, cls):
+            return value
+        if "object_ids" in value and "reals" in value:
+            return cls(*(value.get(name) for name in FIELDS))
+        return cls([int(real) for real in value.keys()], list(value.values()))
+
+    def to_json(self) -> dict:
+        """Return registry as lists per field, for json
+
+        Returns:
+            dict: list per field
+        """
+        return {name: getattr(self, name).tolist() for name in FIELDS}
+
+    def __getitem__(self, real) -> str:
+        """Get object id of realization
+
+        Args:
+            real (int): realization id
+
+        Raises:
+            KeyError: if realization is not in registry
+
+        Returns:
+            str: the object id
+        """
+        try:
+            return self.lookup([int(real)])[0]
+        except (KeyError, ValueError, TypeError):
+            raise KeyError(real) from None
+
+    def __iter__(self):
+        """Iterate over realization ids"""
+        return iter(self._reals.tolist())
+
+    def __len__(self) -> int:
+        """Return number of realizations"""
+        return len(self._reals)
+
+    def __repr__(self) -> str:
+        """Show size of registry"""
+        return (
+            f"{self.__class__.__name__}({len(self)} realizations,"
+            f" {self.nr_unique} unique objects)"
+        )
+
+    def __eq__(self, other) -> bool:
+        """Compare with registry field by field, or with mapping as mapping"""
+        if isinstance(other, RealizationRegistry):
+            return all(
+                np.array_equal(getattr(self, name), getattr(other, name))
+                for name in FIELDS
+            )
+        return Mapping.__eq__(self, other)
+
+    __hash__ = None
+
+    @property
+    def reals(self) -> np.ndarray:
+        """Return realization ids, sorted"""
+        return self._reals
+
+    @property
+    def object_ids(self) -> np.ndarray:
+        """Return object ids"""
+        return self._fields["object_ids"]
+
+    @property
+    def checksums(self) -> np.ndarray:
+        """Return md5 checksums of blobs, None where unknown"""
+        return self._fields["checksums"]
+
+    @property
+    def size_bytes(self) -> np.ndarray:
+        """Return sizes of blobs, UNKNOWN where unknown"""
+        return self._fields["size_bytes"]
+
+    @property
+    def rows(self) -> np.ndarray:
+        """Return number of rows of tables, UNKNOWN where unknown"""
+        return self._fields["rows"]
+
+    @property
+    def columns(self) -> np.ndarray:
+        """Return number of columns of tables, UNKNOWN where unknown"""
+        return self._fields["columns"]
+
+    def positions(self, reals: Iterable[int]) -> np.ndarray:
+        """Find positions of realizations in registry
+
+        Args:
+            reals (iterable): realization ids
+
+        Raises:
+            KeyError: if any realization is not in registry
+
+        Returns:
+            np.ndarray: positions
+        """
+        reals = np.asarray(list(reals), dtype=np.int64)
+        positions = np.searchsorted(self._reals, reals)
+        found = positions < len(self._reals)
+        found[found] = self._reals[positions[found]] == reals[found]
+        if not found.all():
+            raise KeyError(reals[~found].tolist())
+        return positions
+
+    def lookup(self, reals: Iterable[int]) -> np.ndarray:
+        """Get object ids of realizations
+
+        Args:
+            reals (iterable): realization ids
+
+        Returns:
+            np.ndarray: object ids
+        """
+        return self.object_ids[self.positions(reals)]
+
+    def select(self, selection) -> "RealizationRegistry":
+        """Make registry with some of the realizations
+
+        Args:
+            selection (np.ndarray, iterable): boolean mask over the registry,
+                                              or realization ids
+
+        Returns:
+            RealizationRegistry: the selected realizations
+        """
+        selection = np.asarray(selection)
+        if selection.dtype != bool:
+            selection = self.positions(selection)
+        return RealizationRegistry(
+            self._reals[selection],
+            *(self._fields[name][selection] for name in FIELDS[1:]),
+        )
+
+    def merge(self, other: "RealizationRegistry") -> "RealizationRegistry":
+        """Make registry with the realizations of both registries
+
+        Args:
+            other (RealizationRegistry): the other registry, its realizations
+                                         replace equal ones in this one
+
+        Returns:
+            RealizationRegistry: the merged registry
+        """
+        return RealizationRegistry(
+            np.concatenate([self._reals, other.reals]),
+            *(
+                np.concatenate([self._fields[name], getattr(other, name)])
+                for name in FIELDS[1:]
+            ),
+        )
+
+    def canonical(self) -> np.ndarray:
+        """Find, for each realization, the first realization with equal blob
+
+        Blobs are equal when their checksums are, realizations with
+        unknown checksum are only equal to themselves.
+
+        Returns:
+            np.ndarray: position of first realization with equal blob
+        """
+        canonical = np.arange(len(self._reals))
+        known = np.flatnonzero(self.checksums != None)  # noqa: E711
+        if len(known):
+            _, first, inverse = np.unique(
+                self.checksums[known].astype(str),
+                return_index=True,
+                return_inverse=True,
+            )
+            canonical[known] = known[first[inverse.ravel()]]
+        return canonical
+
+    @property
+    def nr_unique(self) -> int:
+        """Return number of distinct blobs"""
+        return len(np.unique(self.canonical()))
+
+    def fetch_groups(self) -> List[Tuple[str, str, np.ndarray]]:
+        """Plan fetching, one fetch per distinct blob
+
+        Returns:
+            list: tuples of object id and realization to fetch, and all
+                  realization ids with that blob
+        """
+        canonical = self.canonical()
+        groups = []
+        for position in np.unique(canonical):
+            groups.append(
+                (
+                    self.object_ids[position],
+                    int(self._reals[position]),
+                    self._reals[canonical == position],
+                )
+            )
+        return groups
+
+    def fetch_bytes(self, default: int = UNKNOWN) -> int:
+        """Sum sizes of the distinct blobs
+
+        Args:
+            default (int): size used where unknown
+
+        Returns:
+            int: bytes to fetch
+        """
+        unique = np.unique(self.canonical())
+        sizes = self.size_bytes[unique]
+        return int(np.where(sizes == UNKNOWN, default, sizes).sum())
+
+    def total_rows(self, default: int = UNKNOWN) -> int:
+        """Sum rows of all realizations
+
+        Args:
+            default (int): rows used where unknown
+
+        Returns:
+            int: rows in aggregated table
+        """
+        return int(np.where(self.rows == UNKNOWN, default, self.rows).sum())
+
+    def max_rows(self, default: int = UNKNOWN) -> int:
+        """Find most rows of one realization
+
+        Args:
+            default (int): returned if no rows are known
+
+        Returns:
+            int: the rows
+        """
+        return int(self.rows.max()) if len(self) and self.rows.max() else default
+
+    def max_columns(self, default: int = UNKNOWN) -> int:
+        """Find most columns of one realization
+
+        Args:
+            default (int): returned if no columns are known
+
+        Returns:
+            int: the columns
+        """
+        return int(self.columns.max()) if len(self) and self.columns.max() else default
+
+
+def as_registry(object_ids) -> RealizationRegistry:
+    """Make registry from registry, json form or mapping of real to object id
+
+    Args:
+        object_ids (RealizationRegistry, dict): the realization objects
+
+    Returns:
+        RealizationRegistry: the registry
+    """
+    return RealizationRegistry.from_json(object_ids)
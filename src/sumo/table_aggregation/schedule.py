@@ -0,0 +1,82 @@
+"""Orders aggregation work to keep the makespan short"""
+import heapq
+from sumo.table_aggregation import dispatch
+
+
+def lpt_schedule(costs: dict, nr_workers: int) -> dict:
+    """Make longest processing time first schedule
+
+    Work is started largest first, each piece going to the worker that is
+    free first, so the small pieces at the end fill the gaps.
+
+    Args:
+        costs (dict): estimated cost per key of work
+        nr_workers (int): number of workers running at the same time
+
+    Returns:
+        dict: order of keys, keys per worker, predicted makespan and utilisation
+    """
+    order = sorted(costs, key=lambda key: costs[key], reverse=True)
+    loads = [(0.0, worker) for worker in range(max(nr_workers, 1))]
+    workers = [[] for _ in loads]
+    for key in order:
+        load, worker = heapq.heappop(loads)
+        workers[worker].append(key)
+        heapq.heappush(loads, (load + costs[key], worker))
+    makespan = max(load for load, _ in loads)
+    total = sum(costs.values())
+    return {
+        "order": order,
+        "workers": workers,
+        "predicted_makespan": makespan,
+        "predicted_utilisation": total / (makespan * len(workers)) if makespan else 1.0,
+    }
+
+
+def order_dispatch_infos(dispatch_infos, nr_workers: int) -> tuple:
+    """Order dispatch jobs largest first
+
+    Args:
+        dispatch_infos (iterable): dispatch info per job
+        nr_workers (int): number of workers running at the same time
+
+    Returns:
+        tuple: ordered dispatch infos, and schedule, see lpt_schedule
+    """
+    # pylint: disable-next=import-outside-toplevel
+    from sumo.table_aggregation.registry import as_registry
+
+    dispatch_infos = list(dispatch_infos)
+    costs = {}
+    for number, dispatch_info in enumerate(dispatch_infos):
+        cost = dispatch_info.get("cost")
+        if cost is None:
+            cost = dispatch.estimate_cost(
+                dispatch_info["base_meta"],
+                len(as_registry(dispatch_info["object_ids"])),
+                sum(len(seg) for seg in dispatch.job_segments(dispatch_info)),
+            )
+        costs[number] = cost
+    schedule = lpt_schedule(costs, nr_workers)
+    return [dispatch_infos[number] for number in schedule["order"]], schedule
+
+
+def achieved_utilisation(intervals: list, nr_workers: int) -> dict:
+    """Find how busy the workers were during a run
+
+    Args:
+        intervals (list): start and end time of each piece of work
+        nr_workers (int): number of workers running at the same time
+
+    Returns:
+        dict: makespan, busy time summed over work, and utilisation
+    """
+    if not intervals:
+        return {"makespan": 0.0, "busy": 0.0, "utilisation": 0.0}
+    makespan = max(end for _, end in intervals) - min(start for start, _ in intervals)
+    busy = sum(end - start for start, end in intervals)
+    return {
+        "makespan": makespan,
+        "busy": busy,
+        "utilisation": busy / (makespan * nr_workers) if makespan else 1.0,
+    }
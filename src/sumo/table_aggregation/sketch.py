@@ -0,0 +1,605 @@
+"""Streaming, mergeable quantile sketches for very large ensembles
+
+QuantileSketch is a KLL sketch (Karnin, Lang, Liberty 2016) kept for many
+cells at the same time. Every realization adds exactly one value per cell
+(NaN when the cell is missing in that realization), so all cells share the
+same compaction schedule, and the buffers of every level are numpy arrays of
+shape cell_shape + (level size,). Missing values sort as +inf and carry
+no weight when quantiles are read, so they do not bias the results.
+
+Error bound: with k retained items per level the normalised rank error is
+below about 2.296 / k**0.9723 with 99 % confidence (the bound established for
+KLL sketches in Apache DataSketches), i.e. about 1.3 % for the default
+k = 200. The returned quantile is an observed value whose rank is within
+that fraction of the number of realizations from the asked for rank.
+
+Memory: the levels hold at most about k / (1 - 2 / 3) = 3k values per cell,
+plus MIN_WIDTH values per doubling of the number of realizations, so memory is
+independent of the number of realizations.
+
+EnsembleSketch combines the quantile sketch with exact running count, mean,
+variance, min and max per cell, and grows its index axis as realizations with
+new index values (e.g. dates) stream in. Realization tables can be added as
+they are fetched, see sketch_realizations, and sketches of groups of
+realizations merged into the sketch of the aggregation.
+"""
+import json
+import logging
+import threading
+from io import BytesIO
+from typing import Dict, Iterable, List, Tuple, Union
+import numpy as np
+import pyarrow as pa
+from sumo.table_aggregation.matrix import group_rows, is_numeric, to_float
+from sumo.table_aggregation.stats import (
+    QUANTILE_PATTERN,
+    SIMPLE_STATS,
+    check_aggfuncs,
+    quantile_of,
+    statistics_tables,
+)
+
+DEFAULT_K = 200
+MIN_WIDTH = 8
+SHRINK = 2 / 3
+
+
+def normalised_rank_error(k: int = DEFAULT_K) -> float:
+    """Return upper bound of rank error, as fraction of nr of values
+
+    Args:
+        k (int, optional): size parameter of sketch. Defaults to DEFAULT_K.
+
+    Returns:
+        float: bound valid with 99 % confidence
+    """
+    return 2.296 / k**0.9723
+
+
+class QuantileSketch:
+
+    """KLL quantile sketch for an array of cells"""
+
+    def __init__(self, cell_shape: Union[int, tuple], k: int = DEFAULT_K, seed=None):
+        """Make empty sketch
+
+        Args:
+            cell_shape (int, tuple): shape of the array of cells
+            k (int, optional): size parameter, larger is more accurate
+            seed (int, optional): seed for the random compactions
+        """
+        if isinstance(cell_shape, int):
+            cell_shape = (cell_shape,)
+        if k < MIN_WIDTH:
+            raise ValueError(f"k must be at least {MIN_WIDTH}, is {k}")
+        self._cell_shape = tuple(cell_shape)
+        self._k = k
+        self._count = 0
+        self._levels = [self._empty()]
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def cell_shape(self) -> tuple:
+        """Return _cell_shape attribute"""
+        return self._cell_shape
+
+    @property
+    def k(self) -> int:
+        """Return _k attribute"""
+        return self._k
+
+    @property
+    def count(self) -> int:
+        """Return number of values added per cell"""
+        return self._count
+
+    @property
+    def retained(self) -> int:
+        """Return number of values kept per cell"""
+        return sum(level.shape[-1] for level in self._levels)
+
+    def _empty(self, size=0) -> np.ndarray:
+        """Return empty level buffer"""
+        return np.empty(self._cell_shape + (size,), dtype=np.float32)
+
+    def _capacity(self, level: int) -> int:
+        """Return capacity of level, the top level has capacity k"""
+        depth = len(self._levels) - level - 1
+        return max(MIN_WIDTH, int(np.ceil(self._k * SHRINK**depth)))
+
+    def _compress(self):
+        """Compact every level that is at or above its capacity"""
+        level = 0
+        while level < len(self._levels):
+            buffer = self._levels[level]
+            if buffer.shape[-1] >= self._capacity(level):
+                if level + 1 == len(self._levels):
+                    self._levels.append(self._empty())
+                ordered = np.sort(buffer, axis=-1)
+                odd = ordered.shape[-1] % 2
+                promoted = ordered[..., odd + self._rng.integers(2) :: 2]
+                self._levels[level] = ordered[..., :odd]
+                self._levels[level + 1] = np.concatenate(
+                    (self._levels[level + 1], promoted), axis=-1
+                )
+            level += 1
+
+    def update(self, values: np.ndarray):
+        """Add values to sketch
+
+        Args:
+            values (np.ndarray): shape cell_shape for one value per cell,
+                                 or cell_shape + (n,) for n values per cell
+        """
+        values = np.asarray(values, dtype=np.float32)
+        if values.shape == self._cell_shape:
+            values = values[..., np.newaxis]
+        if values.shape[:-1] != self._cell_shape:
+            raise ValueError(
+                f"Values of shape {values.shape} do not fit cells {self._cell_shape}"
+            )
+        self._levels[0] = np.concatenate((self._levels[0], values), axis=-1)
+        self._count += values.shape[-1]
+        self._compress()
+
+    def merge(self, other: "QuantileSketch"):
+        """Merge other sketch into this one
+
+        Args:
+            other (QuantileSketch): sketch with same cell shape and k
+
+        Raises:
+            ValueError: if sketches are not compatible
+        """
+        if other.cell_shape != self._cell_shape or other.k != self._k:
+            raise ValueError(
+                "Can only merge sketches with same cell shape and k, "
+                + f"{other.cell_shape, other.k} vs {self._cell_shape, self._k}"
+            )
+        while len(self._levels) < len(other._levels):
+            self._levels.append(self._empty())
+        for level, buffer in enumerate(other._levels):
+            self._levels[level] = np.concatenate(
+                (self._levels[level], buffer), axis=-1
+            )
+        self._count += other.count
+        self._compress()
+
+    def reindex(self, positions: np.ndarray, size: int, axis: int = 0):
+        """Move cells along axis, new cells are missing in all values so far
+
+        Args:
+            positions (np.ndarray): new position of each existing cell
+            size (int): new length of axis
+            axis (int, optional): the axis to reindex. Defaults to 0.
+        """
+        shape = list(self._cell_shape)
+        shape[axis] = size
+        for level, buffer in enumerate(self._levels):
+            moved = np.full(tuple(shape) + buffer.shape[-1:], np.nan, np.float32)
+            index = [slice(None)] * buffer.ndim
+            index[axis] = positions
+            moved[tuple(index)] = buffer
+            self._levels[level] = moved
+        self._cell_shape = tuple(shape)
+
+    def quantiles(self, quantiles: Iterable[float]) -> List[np.ndarray]:
+        """Return estimated quantiles per cell
+
+        Args:
+            quantiles (iterable): quantiles between 0 and 1
+
+        Returns:
+            list: array of shape cell_shape per quantile, NaN for empty cells
+        """
+        values = np.concatenate(self._levels, axis=-1)
+        if values.shape[-1] == 0:
+            return [np.full(self._cell_shape, np.nan) for _ in quantiles]
+        weights = np.concatenate(
+            [
+                np.full(buffer.shape[-1], 2**level, dtype=np.float64)
+                for level, buffer in enumerate(self._levels)
+            ]
+        )
+        order = np.argsort(values, axis=-1)
+        ordered = np.take_along_axis(values, order, axis=-1)
+        cumulative = np.cumsum(np.where(np.isnan(ordered), 0, weights[order]), axis=-1)
+        total = cumulative[..., -1:]
+        results = []
+        for quantile in quantiles:
+            position = (cumulative < quantile * total).sum(axis=-1, keepdims=True)
+            position = np.minimum(position, values.shape[-1] - 1)
+            result = np.take_along_axis(ordered, position, axis=-1)[..., 0]
+            results.append(np.where(total[..., 0] > 0, result, np.nan))
+        return results
+
+    def to_bytes(self, metadata: dict = None) -> bytes:
+        """Serialize sketch as arrow ipc stream, one record batch per level
+
+        Args:
+            metadata (dict, optional): extra schema metadata to store
+
+        Returns:
+            bytes: the serialized sketch
+        """
+        state = {
+            "k": self._k,
+            "count": self._count,
+            "cell_shape": self._cell_shape,
+            "sizes": [buffer.shape[-1] for buffer in self._levels],
+        }
+        schema_meta = {"sketch": json.dumps(state)}
+        schema_meta.update(metadata or {})
+        schema = pa.schema([("values", pa.float32())], metadata=schema_meta)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, schema) as writer:
+            for buffer in self._levels:
+                writer.write_batch(
+                    pa.record_batch([pa.array(buffer.reshape(-1))], schema=schema)
+                )
+        return sink.getvalue().to_pybytes()
+
+    @classmethod
+    def from_reader(cls, reader, seed=None) -> "QuantileSketch":
+        """Make sketch from arrow ipc stream reader
+
+        Args:
+            reader (pa.ipc.RecordBatchStreamReader): reader of serialized sketch
+            seed (int, optional): seed for further compactions
+
+        Returns:
+            QuantileSketch: the sketch
+        """
+        state = json.loads(reader.schema.metadata[b"sketch"])
+        sketch = cls(tuple(state["cell_shape"]), state["k"], seed)
+        sketch._count = state["count"]
+        sketch._levels = [
+            batch.column(0).to_numpy().reshape(sketch.cell_shape + (size,))
+            for batch, size in zip(reader, state["sizes"])
+        ]
+        return sketch
+
+    @classmethod
+    def from_bytes(cls, byte_string: bytes, seed=None) -> "QuantileSketch":
+        """Make sketch from result of to_bytes
+
+        Args:
+            byte_string (bytes): the serialized sketch
+            seed (int, optional): seed for further compactions
+
+        Returns:
+            QuantileSketch: the sketch
+        """
+        return cls.from_reader(pa.ipc.open_stream(byte_string), seed)
+
+
+class EnsembleSketch:
+
+    """Streaming statistics for all vectors and index values of a table"""
+
+    def __init__(self, table_index: List[str], vectors: List[str], k: int = DEFAULT_K):
+        """Make empty ensemble sketch
+
+        Args:
+            table_index (list): the index columns
+            vectors (list): names of the vectors to make statistics for
+            k (int, optional): size parameter of quantile sketch
+        """
+        self._table_index = list(table_index)
+        self._vectors = list(vectors)
+        self._keys = None
+        self._types = {}
+        self._moments = np.zeros((5, len(self._vectors), 0))
+        self._sketch = QuantileSketch((len(self._vectors), 0), k)
+        self._lock = threading.Lock()
+        self._logger = logging.getLogger(__name__ + ".EnsembleSketch")
+
+    @property
+    def table_index(self) -> list:
+        """Return _table_index attribute"""
+        return self._table_index
+
+    @property
+    def vectors(self) -> list:
+        """Return _vectors attribute"""
+        return self._vectors
+
+    @property
+    def k(self) -> int:
+        """Return size parameter of quantile sketch"""
+        return self._sketch.k
+
+    @property
+    def keys(self) -> pa.Table:
+        """Return table with index values, in sorted order"""
+        return self._keys
+
+    @property
+    def nr_realizations(self) -> int:
+        """Return number of realizations added"""
+        return self._sketch.count
+
+    def _expand_keys(self, keys: pa.Table) -> np.ndarray:
+        """Add new index values, return position of each row in keys
+
+        Args:
+            keys (pa.Table): index values
+
+        Returns:
+            np.ndarray: position of each row in the updated keys
+        """
+        if self._keys is None:
+            self._keys = keys.slice(0, 0)
+        combined = pa.concat_tables([self._keys, keys.cast(self._keys.schema)])
+        codes, union = group_rows(combined, self._table_index)
+        old_rows = self._keys.num_rows
+        if union.num_rows > old_rows:
+            self._reindex(self._vector_positions(self._vectors), codes[:old_rows], union)
+        return codes[old_rows:]
+
+    def _vector_positions(self, vectors: List[str]) -> np.ndarray:
+        """Return position of vectors in _vectors"""
+        return np.array([self._vectors.index(name) for name in vectors], dtype=int)
+
+    def _reindex(self, vector_positions, key_positions, keys: pa.Table, vectors=None):
+        """Move data to new positions, new cells are empty
+
+        Args:
+            vector_positions (np.ndarray): new positions of existing vectors
+            key_positions (np.ndarray): new positions of existing index values
+            keys (pa.Table): the new index values
+            vectors (list, optional): the new vectors, defaults to existing
+        """
+        vectors = self._vectors if vectors is None else vectors
+        moments = np.zeros((5, len(vectors), keys.num_rows))
+        moments[3:] = np.nan
+        moments[:, vector_positions[:, np.newaxis], key_positions] = self._moments
+        self._sketch.reindex(vector_positions, len(vectors), axis=0)
+        self._sketch.reindex(key_positions, keys.num_rows, axis=1)
+        self._moments = moments
+        self._keys = keys
+        self._vectors = list(vectors)
+
+    def add_realization(self, table: pa.Table):
+        """Add one realization, can be called from several threads
+
+        Vectors missing in the table, or not numeric there, are missing
+        values for this realization.
+
+        Args:
+            table (pa.Table): table for one realization, index and vectors
+        """
+        with self._lock:
+            positions = self._expand_keys(table.select(self._table_index))
+            values = np.full((len(self._vectors), self._keys.num_rows), np.nan)
+            rows = positions >= 0
+            for number, col_name in enumerate(self._vectors):
+                if col_name not in table.column_names:
+                    self._logger.debug("%s missing in realization", col_name)
+                    continue
+                column_type = table.schema.field(col_name).type
+                if is_numeric(column_type):
+                    self._types.setdefault(col_name, column_type)
+                if is_numeric(column_type) or pa.types.is_null(column_type):
+                    values[number, positions[rows]] = to_float(table[col_name])[rows]
+            self._add_moments(values)
+            self._sketch.update(values)
+
+    def _add_moments(self, values: np.ndarray):
+        """Update count, mean, sum of squared deviations, min and max"""
+        count, mean, m2, low, high = self._moments
+        valid = ~np.isnan(values)
+        new_count = count + valid
+        delta = np.where(valid, values - mean, 0)
+        mean += np.divide(delta, new_count, out=np.zeros_like(delta), where=valid)
+        m2 += delta * np.where(valid, values - mean, 0)
+        self._moments[0] = new_count
+        self._moments[3] = np.fmin(low, values)
+        self._moments[4] = np.fmax(high, values)
+
+    def merge(self, other: "EnsembleSketch"):
+        """Merge other ensemble sketch into this one
+
+        Sketches of other realizations, other index values and other vectors
+        can be merged, cells are combined where they overlap. Can be called
+        from several threads, other must not change while merged.
+
+        Args:
+            other (EnsembleSketch): sketch made with same table index and k
+        """
+        if other.table_index != self._table_index:
+            raise ValueError(f"Table index differ {other.table_index}")
+        if other.keys is None:
+            return
+        with self._lock:
+            self._merge(other)
+
+    def _merge(self, other: "EnsembleSketch"):
+        """Merge other ensemble sketch into this one, see merge
+
+        Args:
+            other (EnsembleSketch): sketch made with same table index and k
+        """
+        vectors = self._vectors + [
+            name for name in other.vectors if name not in self._vectors
+        ]
+        positions = self._expand_keys(other.keys)
+        if len(vectors) > len(self._vectors):
+            self._reindex(
+                np.arange(len(self._vectors)),
+                np.arange(self._keys.num_rows),
+                self._keys,
+                vectors,
+            )
+        for name, column_type in other._types.items():
+            self._types.setdefault(name, column_type)
+        other_sketch = QuantileSketch.from_bytes(other._sketch.to_bytes())
+        other_sketch.reindex(self._vector_positions(other.vectors), len(vectors), 0)
+        other_sketch.reindex(positions, self._keys.num_rows, 1)
+        other_moments = np.zeros_like(self._moments)
+        other_moments[3:] = np.nan
+        other_moments[
+            :, self._vector_positions(other.vectors)[:, np.newaxis], positions
+        ] = other._moments
+        self._combine_moments(other_moments)
+        self._sketch.merge(other_sketch)
+
+    def _combine_moments(self, other: np.ndarray):
+        """Combine moments with those of other (Chan et al.)"""
+        count, mean, m2, low, high = self._moments
+        o_count, o_mean, o_m2, o_low, o_high = other
+        total = count + o_count
+        delta = o_mean - mean
+        with np.errstate(invalid="ignore", divide="ignore"):
+            share = np.where(total > 0, o_count / total, 0)
+        self._moments = np.stack(
+            (
+                total,
+                mean + delta * share,
+                m2 + o_m2 + delta**2 * count * share,
+                np.fmin(low, o_low),
+                np.fmax(high, o_high),
+            )
+        )
+
+    def statistics(self, aggfuncs: Union[str, Iterable[str]] = "standards") -> Dict[str, pa.Table]:
+        """Return statistics, on same form as stats.compute_statistics
+
+        mean, std, min and max are exact, percentiles are from the sketch,
+        other kernels are not available. Results have the type of the
+        vector when floating, else float64, see stats.statistics_tables
+
+        Args:
+            aggfuncs (str, iterable): names of statistics
+
+        Returns:
+            dict: name of statistic as key, table with index columns
+                  and one column per vector as value
+        """
+        aggfuncs = check_aggfuncs(aggfuncs)
+        for aggname in aggfuncs:
+            if aggname not in SIMPLE_STATS and not QUANTILE_PATTERN.match(aggname):
+                raise ValueError(f"{aggname} cannot be made from sketches")
+        count, mean, m2, low, high = self._moments
+        with np.errstate(invalid="ignore", divide="ignore"):
+            simple = {
+                "mean": np.where(count > 0, mean, np.nan),
+                "std": np.where(count > 0, np.sqrt(m2 / (count - 1)), np.nan),
+                "min": low,
+                "max": high,
+            }
+        percentiles = [name for name in aggfuncs if name not in SIMPLE_STATS]
+        quantiles = dict(
+            zip(
+                percentiles,
+                self._sketch.quantiles(quantile_of(name) for name in percentiles),
+            )
+        )
+        types = [self._types.get(name, pa.float64()) for name in self._vectors]
+        return statistics_tables(
+            self._keys,
+            self._vectors,
+            types,
+            {
+                aggname: simple[aggname] if aggname in simple else quantiles[aggname]
+                for aggname in aggfuncs
+            },
+        )
+
+    def to_bytes(self) -> bytes:
+        """Serialize ensemble sketch as arrow ipc stream
+
+        Returns:
+            bytes: the serialized sketch
+        """
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, self._keys.schema) as writer:
+            writer.write_table(self._keys)
+        moments = BytesIO()
+        np.save(moments, self._moments)
+        return self._sketch.to_bytes(
+            {
+                "table_index": json.dumps(self._table_index),
+                "vectors": json.dumps(self._vectors),
+                "keys": sink.getvalue().to_pybytes(),
+                "types": pa.schema(list(self._types.items())).serialize().to_pybytes(),
+                "moments": moments.getvalue(),
+            }
+        )
+
+    @classmethod
+    def from_bytes(cls, byte_string: bytes) -> "EnsembleSketch":
+        """Make ensemble sketch from result of to_bytes
+
+        Args:
+            byte_string (bytes): the serialized sketch
+
+        Returns:
+            EnsembleSketch: the sketch
+        """
+        reader = pa.ipc.open_stream(byte_string)
+        metadata = reader.schema.metadata
+        ensemble = cls(
+            json.loads(metadata[b"table_index"]), json.loads(metadata[b"vectors"])
+        )
+        ensemble._keys = pa.ipc.open_stream(metadata[b"keys"]).read_all()
+        types = pa.ipc.read_schema(pa.py_buffer(metadata[b"types"]))
+        ensemble._types = {field.name: field.type for field in types}
+        ensemble._moments = np.load(BytesIO(metadata[b"moments"]))
+        ensemble._sketch = QuantileSketch.from_reader(reader)
+        return ensemble
+
+
+def sketch_realizations(
+    tables: Iterable[pa.Table],
+    table_index: List[str],
+    vectors: List[str],
+    k: int = DEFAULT_K,
+) -> EnsembleSketch:
+    """Stream tables of one realization each through a sketch
+
+    Tables without rows, e.g. from failed fetches, are skipped
+
+    Args:
+        tables (iterable): the realization tables, index columns and vectors
+        table_index (list): the index columns
+        vectors (list): names of the vectors to make statistics for
+        k (int, optional): size parameter of quantile sketch
+
+    Returns:
+        EnsembleSketch: the sketch
+    """
+    ensemble = EnsembleSketch(table_index, vectors, k)
+    for table in tables:
+        if table.num_rows > 0:
+            ensemble.add_realization(table)
+    return ensemble
+
+
+def sketch_table(
+    table: pa.Table, table_index: List[str], vectors: List[str], k: int = DEFAULT_K
+) -> EnsembleSketch:
+    """Stream the realizations of an aggregated table through a sketch
+
+    Args:
+        table (pa.Table): table in long format (index columns, REAL, vectors)
+        table_index (list): the index columns
+        vectors (list): names of the vectors to make statistics for
+        k (int, optional): size parameter of quantile sketch
+
+    Returns:
+        EnsembleSketch: the sketch
+    """
+    vectors = [name for name in vectors if is_numeric(table.schema.field(name).type)]
+    codes, reals = group_rows(table, ["REAL"])
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(reals.num_rows + 1))
+    return sketch_realizations(
+        (
+            table.take(pa.array(order[start:stop]))
+            for start, stop in zip(bounds[:-1], bounds[1:])
+        ),
+        table_index,
+        vectors,
+        k,
+    )
@@ -0,0 +1,186 @@
+"""Spilling of aggregated tables to memory mapped Arrow IPC files
+
+With spilling on, realization tables are written to a local Arrow IPC file
+as they arrive, and the aggregated table is read back memory mapped. Its
+columns then live in the OS page cache, not in process memory, so tables
+larger than memory can be aggregated, and extraction only pages in the
+columns it selects.
+"""
+import os
+import logging
+import tempfile
+import pyarrow as pa
+
+# Environment variable with folder for spill files, spilling is off if not set
+SPILL_FOLDER = "SUMO_AGGREGATION_SPILL"
+# Number of tables kept in memory while waiting for types of null columns
+MAX_PENDING = 4
+# Type of columns that are null in all tables seen when the file is started
+NULL_TYPE = pa.float32()
+
+
+def spill_folder(folder: str = None) -> str:
+    """Find folder to spill aggregated tables to
+
+    Args:
+        folder (str, optional): the folder, if not given read from
+                                environment variable SUMO_AGGREGATION_SPILL
+
+    Returns:
+        str: the folder, None when spilling is off
+    """
+    return folder or os.environ.get(SPILL_FOLDER) or None
+
+
+class SpillWriter:
+    """Writes tables of one aggregation to an Arrow IPC file, then maps it
+
+    The file has one schema, but realizations may miss columns, which then
+    are null typed. Tables are therefore kept in memory until every column
+    has been seen with a type, or MAX_PENDING tables are kept, the file is
+    started with the unified schema, columns still null typed as NULL_TYPE,
+    and all later tables are cast to it.
+    """
+
+    def __init__(self, folder: str, label: str = "aggregated"):
+        """Make file to spill to
+
+        Args:
+            folder (str): folder for the file, made if missing
+            label (str): start of file name
+        """
+        os.makedirs(folder, exist_ok=True)
+        handle, self._path = tempfile.mkstemp(
+            prefix=f"{label}-", suffix=".arrow", dir=folder
+        )
+        os.close(handle)
+        self._logger = logging.getLogger(__name__ + ".SpillWriter")
+        self._pending = []
+        self._schema = None
+        self._writer = None
+        self._rows = 0
+        self._bytes = 0
+
+    @property
+    def path(self) -> str:
+        """Return path of spill file"""
+        return self._path
+
+    @property
+    def rows(self) -> int:
+        """Return number of rows written"""
+        return self._rows
+
+    @property
+    def nbytes(self) -> int:
+        """Return bytes of tables written"""
+        return self._bytes
+
+    def write(self, table: pa.Table):
+        """Add table of one realization
+
+        Args:
+            table (pa.Table): the table, tables without columns are skipped
+        """
+        if table.num_columns == 0:
+            return
+        if self._writer is not None:
+            self._write(table)
+            return
+        self._pending.append(table)
+        schema = pa.unify_schemas([pending.schema for pending in self._pending])
+        typed = not any(pa.types.is_null(field.type) for field in schema)
+        if typed or len(self._pending) >= MAX_PENDING:
+            self._start(schema)
+
+    def _start(self, schema: pa.Schema):
+        """Start file with schema, and write the tables kept until now
+
+        Args:
+            schema (pa.Schema): schema of file, null typed fields are
+                                given NULL_TYPE
+        """
+        nulls = [field.name for field in schema if pa.types.is_null(field.type)]
+        if nulls:
+            self._logger.debug("Spilling null columns %s as %s", nulls, NULL_TYPE)
+        self._schema = pa.schema(
+            [
+                field.with_type(NULL_TYPE) if field.name in nulls else field
+                for field in schema
+            ]
+        )
+        self._writer = pa.ipc.new_file(self._path, self._schema)
+        pending, self._pending = self._pending, []
+        for table in pending:
+            self._write(table)
+
+    def _conform(self, table: pa.Table) -> pa.Table:
+        """Order and cast columns of table as in schema of file
+
+        Args:
+            table (pa.Table): the table
+
+        Returns:
+            pa.Table: the table with schema of file
+        """
+        columns = []
+        for field in self._schema:
+            if field.name not in table.column_names:
+                columns.append(pa.nulls(table.num_rows, field.type))
+                continue
+            column = table[field.name]
+            if column.type != field.type:
+                column = column.cast(field.type)
+            columns.append(column)
+        return pa.Table.from_arrays(columns, schema=self._schema)
+
+    def _write(self, table: pa.Table):
+        """Write table to file
+
+        Args:
+            table (pa.Table): the table
+        """
+        self._writer.write_table(self._conform(table))
+        self._rows += table.num_rows
+        self._bytes += table.nbytes
+
+    def close(self) -> pa.Table:
+        """Finish file, and read it back memory mapped
+
+        The file is removed once mapped, its pages stay readable until the
+        table is released.
+
+        Returns:
+            pa.Table: the aggregated table, empty if nothing was written
+        """
+        if self._writer is None and self._pending:
+            self._start(pa.unify_schemas([table.schema for table in self._pending]))
+        if self._writer is None:
+            aggregated = pa.table([])
+        else:
+            self._writer.close()
+            self._writer = None
+            with pa.memory_map(self._path) as source:
+                aggregated = pa.ipc.open_file(source).read_all()
+        self._remove()
+        self._logger.debug("Spilled %s rows to %s", self._rows, self._path)
+        return aggregated
+
+    def discard(self):
+        """Close file without reading it back, and remove it, e.g. on errors
+
+        Does nothing when the file is already closed and removed
+        """
+        self._pending = []
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if os.path.exists(self._path):
+            self._remove()
+
+    def _remove(self):
+        """Remove spill file, mapped tables stay readable"""
+        try:
+            os.remove(self._path)
+        except OSError:
+            self._logger.warning("Could not remove spill file %s", self._path)
@@ -0,0 +1,561 @@
+"""Vectorized ensemble statistics for aggregated tables
+
+The vectors of a table are laid out as an EnsembleMatrix, i.e. arrays of
+shape (index values, realizations) with NaN where there are no values, and
+every statistic is a kernel run along the realization axis, for
+VECTORS_PER_BLOCK vectors at the time. The matrix of a long format table is
+made one block at the time too, see reduce_table, so peak memory does not
+grow with the number of vectors. Kernels are looked up by name,
+see register_kernel for adding new ones. Quantiles share one sort with min
+and max.
+
+With several processes the table is written once as an arrow ipc file, which
+the workers memory map, so only names of vectors and statistics are sent to
+the workers, and only the results are sent back.
+"""
+import os
+import re
+import logging
+import tempfile
+import warnings
+from functools import cached_property
+from multiprocessing import get_context
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+import numpy as np
+import pyarrow as pa
+from sumo.table_aggregation.matrix import EnsembleMatrix, numeric_vectors, table_layout
+
+STANDARD_STATS = ("mean", "min", "max", "std", "p10", "p90")
+SIMPLE_STATS = ("mean", "min", "max", "std")
+QUANTILE_PATTERN = re.compile(r"^p(\d{1,2}(\.\d+)?)$")
+EXCEEDANCE_PATTERN = re.compile(r"^exceed_(-?\d+(\.\d+)?)$")
+# Registered aggregation kernels, see register_kernel
+KERNELS = {}
+# Number of vectors reduced at the time, limits peak memory
+VECTORS_PER_BLOCK = 64
+# Folder for tables shared with worker processes, in memory on linux
+SHARED_FOLDER = "/dev/shm"
+# Tables attached in this process, see attach_table
+_ATTACHED = {}
+
+
+def quantile_of(aggname: str) -> float:
+    """Return quantile for a percentile name, i.e. p10 gives 0.1
+
+    Args:
+        aggname (str): name of statistic, on form pNN
+
+    Raises:
+        ValueError: if name is not a percentile name
+
+    Returns:
+        float: the quantile
+    """
+    match = QUANTILE_PATTERN.match(aggname)
+    if match is None:
+        raise ValueError(f"{aggname} is not a valid percentile name (pNN)")
+    return float(match.group(1)) / 100
+
+
+class Block:
+
+    """Values of vectors along realizations, with shared intermediate results
+
+    Kernels get a Block, values has shape (..., index values, realizations)
+    with NaN where there is no value. The other attributes are made when
+    first asked for, and then shared between all kernels run on the block.
+    """
+
+    def __init__(self, values: np.ndarray):
+        """Set values
+
+        Args:
+            values (np.ndarray): the values, realizations on last axis
+        """
+        self.values = values
+
+    @cached_property
+    def valid(self) -> np.ndarray:
+        """Return True where there are values"""
+        return ~np.isnan(self.values)
+
+    @cached_property
+    def counts(self) -> np.ndarray:
+        """Return number of values along realizations"""
+        return self.valid.sum(axis=-1)
+
+    @cached_property
+    def sorted(self) -> np.ndarray:
+        """Return values sorted along realizations, NaNs at the end"""
+        return np.sort(self.values, axis=-1)
+
+    @cached_property
+    def mean(self) -> np.ndarray:
+        """Return mean along realizations"""
+        return np.where(self.valid, self.values, 0).sum(axis=-1) / self.counts
+
+
+def register_kernel(name: str, kernel: Callable = None):
+    """Register aggregation kernel, as function or as decorator
+
+    A kernel takes a Block and returns an array of shape
+    block.values.shape[:-1]. The name is used as fmu.aggregation.operation
+    for the uploaded results.
+
+    Args:
+        name (str): name of statistic
+        kernel (Callable, optional): the kernel, if not used as decorator
+
+    Returns:
+        Callable: the kernel, or decorator registering the kernel
+    """
+
+    def decorator(func):
+        KERNELS[name] = func
+        return func
+
+    if kernel is None:
+        return decorator
+    return decorator(kernel)
+
+
+def quantile_kernel(quantile: float) -> Callable:
+    """Return kernel for quantile, linear interpolation as np.percentile
+
+    Args:
+        quantile (float): quantile between 0 and 1
+
+    Returns:
+        Callable: the kernel
+    """
+
+    def kernel(block: Block) -> np.ndarray:
+        position = quantile * np.maximum(block.counts - 1, 0)
+        lower = np.floor(position).astype(np.int64)[..., np.newaxis]
+        upper = np.ceil(position).astype(np.int64)[..., np.newaxis]
+        low = np.take_along_axis(block.sorted, lower, axis=-1)[..., 0]
+        high = np.take_along_axis(block.sorted, upper, axis=-1)[..., 0]
+        return low + (high - low) * (position - lower[..., 0])
+
+    return kernel
+
+
+def exceedance_kernel(threshold: float) -> Callable:
+    """Return kernel for probability of values above threshold
+
+    Args:
+        threshold (float): the threshold
+
+    Returns:
+        Callable: the kernel
+    """
+
+    def kernel(block: Block) -> np.ndarray:
+        return (block.values > threshold).sum(axis=-1) / block.counts
+
+    return kernel
+
+
+def get_kernel(aggname: str) -> Callable:
+    """Return kernel for name of statistic
+
+    Registered kernels first, then percentiles as pNN,
+    and probability of exceeding a threshold as exceed_<threshold>
+
+    Args:
+        aggname (str): name of statistic
+
+    Raises:
+        ValueError: if there is no kernel for name
+
+    Returns:
+        Callable: the kernel
+    """
+    if aggname in KERNELS:
+        return KERNELS[aggname]
+    if QUANTILE_PATTERN.match(aggname):
+        return quantile_kernel(quantile_of(aggname))
+    match = EXCEEDANCE_PATTERN.match(aggname)
+    if match:
+        return exceedance_kernel(float(match.group(1)))
+    raise ValueError(
+        f"No kernel for {aggname}, registered kernels are {sorted(KERNELS)}, "
+        + "and percentiles (pNN) and exceedance probabilities (exceed_<threshold>)"
+    )
+
+
+@register_kernel("mean")
+def mean_kernel(block: Block) -> np.ndarray:
+    """Return mean"""
+    return block.mean
+
+
+@register_kernel("std")
+def std_kernel(block: Block) -> np.ndarray:
+    """Return sample standard deviation"""
+    deviation = np.where(block.valid, block.values - block.mean[..., np.newaxis], 0)
+    return np.sqrt((deviation**2).sum(axis=-1) / (block.counts - 1))
+
+
+@register_kernel("min")
+def min_kernel(block: Block) -> np.ndarray:
+    """Return minimum"""
+    return block.sorted[..., 0]
+
+
+@register_kernel("max")
+def max_kernel(block: Block) -> np.ndarray:
+    """Return maximum"""
+    last = np.maximum(block.counts - 1, 0)[..., np.newaxis]
+    return np.take_along_axis(block.sorted, last, axis=-1)[..., 0]
+
+
+def check_aggfuncs(aggfuncs: Union[str, Iterable[str]]) -> Tuple[str, ...]:
+    """Validate names of statistics
+
+    Args:
+        aggfuncs (str, iterable): "standards" or names of statistics
+
+    Raises:
+        ValueError: if any of the names have no kernel
+
+    Returns:
+        tuple: the names of the statistics
+    """
+    if aggfuncs == "standards":
+        return STANDARD_STATS
+    if isinstance(aggfuncs, str):
+        aggfuncs = (aggfuncs,)
+    aggfuncs = tuple(aggfuncs)
+    for aggname in aggfuncs:
+        get_kernel(aggname)
+    return aggfuncs
+
+
+def reduce_block(
+    values: np.ndarray, aggfuncs: Tuple[str, ...], kernels: Dict[str, Callable] = None
+) -> Dict[str, np.ndarray]:
+    """Run kernels along the last axis of values
+
+    Args:
+        values (np.ndarray): values, NaN where there is no value
+        aggfuncs (tuple): names of statistics
+        kernels (dict, optional): kernels to use before the registered ones
+
+    Raises:
+        ValueError: if a kernel returns results of wrong shape
+
+    Returns:
+        dict: name of statistic as key, results as value, NaN where no values
+    """
+    kernels = kernels or {}
+    block = Block(values)
+    results = {}
+    with warnings.catch_warnings(), np.errstate(invalid="ignore", divide="ignore"):
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for aggname in aggfuncs:
+            kernel = kernels[aggname] if aggname in kernels else get_kernel(aggname)
+            result = np.asarray(kernel(block))
+            if result.shape != values.shape[:-1]:
+                raise ValueError(
+                    f"Kernel {aggname} returned shape {result.shape}, "
+                    + f"should be {values.shape[:-1]}"
+                )
+            results[aggname] = np.where(block.counts == 0, np.nan, result)
+    return results
+
+
+def reduce_matrix(
+    matrix: EnsembleMatrix,
+    aggfuncs: Tuple[str, ...],
+    kernels: Dict[str, Callable] = None,
+) -> Dict[str, np.ndarray]:
+    """Make statistics along the realization axis of matrix
+
+    Args:
+        matrix (EnsembleMatrix): the vectors
+        aggfuncs (tuple): names of statistics
+        kernels (dict, optional): kernels to use before the registered ones
+
+    Returns:
+        dict: name of statistic as key, array of shape
+              (vectors, index values) as value
+    """
+    results = {
+        aggname: np.empty(matrix.values.shape[:2]) for aggname in aggfuncs
+    }
+    for start in range(0, len(matrix.vectors), VECTORS_PER_BLOCK):
+        block = matrix.values[start : start + VECTORS_PER_BLOCK].astype(np.float64)
+        for aggname, stat in reduce_block(block, aggfuncs, kernels).items():
+            results[aggname][start : start + VECTORS_PER_BLOCK] = stat
+    return results
+
+
+def reduce_table(
+    table: pa.Table,
+    table_index: List[str],
+    vectors: List[str],
+    aggfuncs: Tuple[str, ...],
+    kernels: Dict[str, Callable] = None,
+    layout: tuple = None,
+    release: Callable = None,
+) -> Dict[str, np.ndarray]:
+    """Make statistics for vectors of long format table, one block at the time
+
+    The matrix of each block of VECTORS_PER_BLOCK vectors is made from the
+    columns of those vectors only, and reduced before the next is made, so
+    a memory mapped table is only paged in a block of columns at the time.
+
+    Args:
+        table (pa.Table, RealizationTables): table in long format
+                                             (index columns, REAL, vectors)
+        table_index (list): the columns to group over
+        vectors (list): the numeric vectors to make statistics for
+        aggfuncs (tuple): names of statistics
+        kernels (dict, optional): kernels to use before the registered ones
+        layout (tuple, optional): results of table_layout, if already made
+        release (Callable, optional): called with the vectors of each block
+                                      once its matrix is made, e.g.
+                                      RealizationTables.release
+
+    Returns:
+        dict: name of statistic as key, array of shape
+              (vectors, index values) as value
+    """
+    if layout is None:
+        layout = table_layout(table.select(table_index + ["REAL"]), table_index)
+    nr_rows = layout[0][3]
+    results = {aggname: np.empty((len(vectors), nr_rows)) for aggname in aggfuncs}
+    for start in range(0, len(vectors), VECTORS_PER_BLOCK):
+        block = vectors[start : start + VECTORS_PER_BLOCK]
+        matrix = EnsembleMatrix.from_table(
+            table.select(block), table_index, block, layout
+        )
+        values = matrix.values.astype(np.float64, copy=False)
+        del matrix
+        if release is not None:
+            release(block)
+        for aggname, stat in reduce_block(values, aggfuncs, kernels).items():
+            results[aggname][start : start + len(block)] = stat
+    return results
+
+
+def statistics_tables(
+    keys: pa.Table,
+    vectors: List[str],
+    types: List[pa.DataType],
+    results: Dict[str, np.ndarray],
+) -> Dict[str, pa.Table]:
+    """Make tables from results of reduce_matrix
+
+    Args:
+        keys (pa.Table): the index values
+        vectors (list): names of the vectors
+        types (list): arrow type of each vector
+        results (dict): name of statistic as key, array as value
+
+    Returns:
+        dict: name of statistic as key, table with index columns
+              and one column per vector as value
+    """
+    stats = {}
+    for aggname, values in results.items():
+        arrays = list(keys.columns)
+        for source_type, row in zip(types, values):
+            out_type = source_type if pa.types.is_floating(source_type) else pa.float64()
+            arrays.append(pa.array(row, from_pandas=True).cast(out_type))
+        stats[aggname] = pa.Table.from_arrays(arrays, names=keys.column_names + vectors)
+    return stats
+
+
+def matrix_statistics(
+    matrix: EnsembleMatrix, aggfuncs: Union[str, Iterable[str]] = "standards"
+) -> Dict[str, pa.Table]:
+    """Make statistics for all vectors in matrix
+
+    Args:
+        matrix (EnsembleMatrix): the vectors
+        aggfuncs (str, iterable): names of statistics, defaults to "standards"
+
+    Returns:
+        dict: see statistics_tables
+    """
+    aggfuncs = check_aggfuncs(aggfuncs)
+    return statistics_tables(
+        matrix.keys, matrix.vectors, matrix.types, reduce_matrix(matrix, aggfuncs)
+    )
+
+
+def compute_statistics(
+    table: pa.Table,
+    table_index: List[str],
+    columns: List[str] = None,
+    aggfuncs: Union[str, Iterable[str]] = "standards",
+    processes: int = None,
+    release: Callable = None,
+) -> Dict[str, pa.Table]:
+    """Make statistics for all vectors in long format table
+
+    Args:
+        table (pa.Table, RealizationTables): table in long format
+                                             (index columns, REAL, vectors)
+        table_index (list): the columns to group over
+        columns (list, optional): vectors to make statistics for,
+                                  defaults to all numeric non index columns
+        aggfuncs (str, iterable): names of statistics, mean, min, max,
+                                  std (sample) and percentiles as pNN,
+                                  defaults to "standards"
+        processes (int, optional): number of worker processes, the table is
+                                   then shared with the workers through a
+                                   memory mapped file. Defaults to None,
+                                   i.e. run in this process
+        release (Callable, optional): called with vectors no longer needed,
+                                      see reduce_table
+
+    Returns:
+        dict: name of statistic as key, table with index columns
+              and one column per vector as value
+    """
+    logger = logging.getLogger(__name__ + ".compute_statistics")
+    aggfuncs = check_aggfuncs(aggfuncs)
+    vectors = numeric_vectors(table, table_index, columns)
+    types = [table.schema.field(name).type for name in vectors]
+    layout = table_layout(table.select(table_index + ["REAL"]), table_index)
+    keys = layout[1]
+    if processes is not None and processes > 1:
+        results = shared_statistics(table, table_index, vectors, aggfuncs, processes)
+        if release is not None:
+            release(vectors)
+    else:
+        results = reduce_table(
+            table, table_index, vectors, aggfuncs, layout=layout, release=release
+        )
+    logger.debug("%s vectors, %s index values", len(vectors), keys.num_rows)
+    return statistics_tables(keys, vectors, types, results)
+
+
+def publish_table(table: pa.Table) -> str:
+    """Write table as arrow ipc file to be memory mapped by other processes
+
+    The file is put in /dev/shm when available, so it stays in memory
+
+    Args:
+        table (pa.Table): the table to publish
+
+    Returns:
+        str: path to file, the caller is responsible for deleting it
+    """
+    folder = SHARED_FOLDER if os.path.isdir(SHARED_FOLDER) else None
+    file_descriptor, path = tempfile.mkstemp(suffix=".arrow", dir=folder)
+    os.close(file_descriptor)
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    return path
+
+
+def attach_table(path: str, table_index: List[str]) -> Tuple[pa.Table, tuple]:
+    """Memory map published table, zero copy, with its layout
+
+    The results are kept per process, so each worker lays out the table once
+
+    Args:
+        path (str): path to published table
+        table_index (list): the columns to group over
+
+    Returns:
+        tuple: the table and its layout, see matrix.table_layout
+    """
+    key = (path, tuple(table_index))
+    if key not in _ATTACHED:
+        _ATTACHED.clear()
+        table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        _ATTACHED[key] = (table, table_layout(table, table_index))
+    return _ATTACHED[key]
+
+
+def _shared_task(
+    path: str, table_index: List[str], vectors: List[str], aggfuncs, kernels
+):
+    """Make statistics for vectors in published table, run by workers
+
+    Args:
+        path (str): path to published table
+        table_index (list): the columns to group over
+        vectors (list): the vectors to make statistics for
+        aggfuncs (tuple): names of statistics
+        kernels (dict): registered kernels, the workers do not share registry
+
+    Returns:
+        dict: see reduce_matrix
+    """
+    table, layout = attach_table(path, table_index)
+    return reduce_table(table, table_index, vectors, aggfuncs, kernels, layout)
+
+
+def shared_statistics(
+    table: pa.Table,
+    table_index: List[str],
+    vectors: List[str],
+    aggfuncs: Tuple[str, ...],
+    processes: int,
+) -> Dict[str, np.ndarray]:
+    """Make statistics in worker processes attached to a published table
+
+    The table is written once, the tasks only contain the path, the names
+    of the vectors and the statistics, and references to registered kernels
+
+    Args:
+        table (pa.Table): table in long format
+        table_index (list): the columns to group over
+        vectors (list): the vectors to make statistics for
+        aggfuncs (tuple): names of statistics
+        processes (int): number of worker processes
+
+    Returns:
+        dict: see reduce_matrix
+    """
+    logger = logging.getLogger(__name__ + ".shared_statistics")
+    path = publish_table(table.select(table_index + ["REAL"] + vectors))
+    kernels = {name: KERNELS[name] for name in aggfuncs if name in KERNELS}
+    tasks = [
+        (
+            path,
+            table_index,
+            vectors[start : start + VECTORS_PER_BLOCK],
+            aggfuncs,
+            kernels,
+        )
+        for start in range(0, len(vectors), VECTORS_PER_BLOCK)
+    ]
+    logger.debug("%s tasks to %s processes, table in %s", len(tasks), processes, path)
+    try:
+        with get_context("spawn").Pool(processes) as pool:
+            task_results = pool.starmap(_shared_task, tasks)
+    finally:
+        os.remove(path)
+    return {
+        aggname: np.concatenate([results[aggname] for results in task_results])
+        for aggname in aggfuncs
+    }
+
+
+def split_statistics(
+    stats: Dict[str, pa.Table], table_index: List[str]
+) -> List[Tuple[str, pa.Table]]:
+    """Split tables of statistics into one table per statistic and vector
+
+    Args:
+        stats (dict): results from compute_statistics
+        table_index (list): the index columns
+
+    Returns:
+        list: tuples of name of statistic, and table with index and one vector
+    """
+    split = []
+    for aggname, table in stats.items():
+        for col_name in table.column_names:
+            if col_name in table_index:
+                continue
+            split.append((aggname, table.select(table_index + [col_name])))
+    return split
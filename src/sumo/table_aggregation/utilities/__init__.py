@@ -0,0 +1,107 @@
+"""Utils for table aggregation
+
+The utilities are split into submodules, loaded on first use of one of their
+names, so importing this package does not import pandas, pyarrow or the sumo
+wrapper. Names are looked up in the submodule on every access, so functions
+replaced there (see profiling) are seen through this package too.
+"""
+import importlib
+
+_SUBMODULES = {
+    "common": (
+        "BLOB_CACHE",
+        "process_memory",
+        "memcount",
+        "timethis",
+        "split_list",
+        "init_logging",
+        "md5sum",
+        "uuid_from_string",
+        "call_parallel",
+    ),
+    "query": (
+        "get_expiry_time",
+        "find_env",
+        "check_or_refresh_token",
+        "return_uuid",
+        "query_for_sumo_id",
+        "get_buckets",
+        "query_sumo_iterations",
+        "query_for_name_and_tags",
+        "query_for_table",
+    ),
+    "metadata": (
+        "convert_metadata",
+        "MetadataSet",
+        "split_results_and_meta",
+        "get_blob_ids_w_metadata",
+    ),
+    "fetch": (
+        "DOWNLOAD_RETRIES",
+        "read_available_columns",
+        "download",
+        "get_object",
+        "blob_to_table",
+        "reconstruct_table",
+        "with_realization",
+        "realization_tables",
+        "merge_sketch",
+        "fetch_tables",
+        "aggregate_arrow",
+    ),
+    "aggregations": (
+        "STATS_MODES",
+        "segment_sketch",
+        "make_stat_aggregations",
+        "make_resampled_aggregations",
+    ),
+    "upload": (
+        "prepare_object_launch",
+        "table_to_bytes",
+        "cast_correctly",
+        "upload_table",
+        "upload_collection",
+        "upload_stats",
+        "upload_statistics",
+        "upload_resampled",
+        "extract_and_upload",
+        "index_key",
+        "forget_uploaded_indexes",
+        "upload_index",
+        "realization_index",
+        "generate_table_index_values",
+    ),
+}
+_LOCATIONS = {
+    name: submodule for submodule, names in _SUBMODULES.items() for name in names
+}
+
+__all__ = sorted(_LOCATIONS)
+
+
+def __getattr__(name: str):
+    """Get name from the submodule defining it, importing it if needed
+
+    Args:
+        name (str): the name
+
+    Raises:
+        AttributeError: if no submodule defines the name
+
+    Returns:
+        any: the object
+    """
+    try:
+        submodule = _LOCATIONS[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    return getattr(importlib.import_module(f"{__name__}.{submodule}"), name)
+
+
+def __dir__() -> list:
+    """List names of the package, also the ones not loaded yet
+
+    Returns:
+        list: the names
+    """
+    return sorted(set(globals()) | set(_LOCATIONS))
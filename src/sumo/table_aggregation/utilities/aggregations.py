@@ -0,0 +1,229 @@
+"""Statistics and resampling of aggregated tables"""
+from typing import Callable, Union
+import pyarrow as pa
+from sumo.table_aggregation import limits, memory, metrics
+from sumo.table_aggregation.matrix import EnsembleMatrix, numeric_vectors, table_layout
+from sumo.table_aggregation.stats import (
+    VECTORS_PER_BLOCK,
+    compute_statistics,
+    matrix_statistics,
+    split_statistics,
+)
+from sumo.table_aggregation.sketch import EnsembleSketch, sketch_table
+from sumo.table_aggregation.utilities.common import init_logging, timethis
+
+STATS_MODES = ("exact", "sketch")
+
+
+def _keep(columns: list):
+    """Keep columns, release callback used when none is given
+
+    Args:
+        columns (list): names of columns
+    """
+
+
+def segment_sketch(columns: list, table_index: list, mode: str = "exact"):
+    """Make empty sketch for the vectors of a segment, filled while fetching
+
+    Args:
+        columns (list): the columns of the segment
+        table_index (list): the table index
+        mode (str): statistics mode, see make_stat_aggregations
+
+    Raises:
+        ValueError: if mode is not supported
+
+    Returns:
+        EnsembleSketch: the sketch, None unless mode is "sketch"
+    """
+    if mode not in STATS_MODES:
+        raise ValueError(f"Statistics mode must be exact or sketch, not {mode}")
+    if mode != "sketch":
+        return None
+    unneccessaries = ["YEARS", "SECONDS", "ENSEMBLE"]
+    vectors = [
+        col_name
+        for col_name in columns
+        if col_name not in table_index + ["REAL"] + unneccessaries
+    ]
+    return EnsembleSketch(table_index, vectors)
+
+
+@timethis("statistics")
+def make_stat_aggregations(
+    table: pa.Table,
+    table_index: Union[list, str],
+    aggfuncs: Union[str, list] = "standards",
+    mode: str = "exact",
+    processes: int = None,
+    sketch: EnsembleSketch = None,
+    release: Callable = None,
+):
+    """Make statistical aggregations for all vectors in table
+
+    Args:
+        table (pa.Table, RealizationTables): aggregated table
+                                             (table index, REAL, and vectors)
+        table_index (list): data to aggregate over
+        aggfuncs (str, list): names of statistics, i.e. kernels in
+                              stats.KERNELS, pNN or exceed_<threshold>,
+                              defaults to "standards"
+        mode (str): "exact", or "sketch" for approximate percentiles
+                    from streaming quantile sketches, defaults to "exact"
+        processes (int): number of processes for exact statistics, the table
+                         is shared through memory, defaults to None (one)
+        sketch (EnsembleSketch): sketch filled while fetching, see
+                                 segment_sketch, used in sketch mode instead
+                                 of streaming the table through a new one
+        release (Callable): called once with every vector when no longer
+                            needed, e.g. RealizationTables.release
+
+    Raises:
+        ValueError: if the aggfuncs are not supported
+
+    Returns:
+        list: tuples of name of statistic and table with index and one vector
+    """
+    logger = init_logging(__name__ + ".make_stat_aggregations")
+    release = release or _keep
+    if isinstance(table_index, str):
+        table_index = [table_index]
+    unneccessaries = ["YEARS", "SECONDS", "ENSEMBLE"]
+    columns = [
+        col_name
+        for col_name in table.column_names
+        if col_name not in table_index + ["REAL"] + unneccessaries
+    ]
+    logger.debug("Calculating %s statistics on %s vectors", mode, len(columns))
+    if mode not in STATS_MODES:
+        raise ValueError(f"Statistics mode must be exact or sketch, not {mode}")
+    vectors = numeric_vectors(table, table_index, columns)
+    release([col_name for col_name in columns if col_name not in vectors])
+    if mode == "sketch" and sketch is not None:
+        release(vectors)
+        if sketch.keys is None:
+            logger.warning("Nothing was sketched, no statistics")
+            return []
+        vectors = [name for name in vectors if name in sketch.vectors]
+        stats = {
+            aggname: stat_table.select(table_index + vectors)
+            for aggname, stat_table in sketch.statistics(aggfuncs).items()
+        }
+        return split_statistics(stats, table_index)
+    with limits.slot("cpu"), memory.profile("statistics"):
+        with metrics.measure("statistics") as sample:
+            sample.bytes_in = table.nbytes
+            if mode == "exact":
+                stats = compute_statistics(
+                    table, table_index, vectors, aggfuncs, processes, release
+                )
+            else:
+                streamed = sketch_table(
+                    table.select(table_index + ["REAL"] + vectors),
+                    table_index,
+                    vectors,
+                )
+                release(vectors)
+                stats = streamed.statistics(aggfuncs)
+    return split_statistics(stats, table_index)
+
+
+@timethis("resampling")
+def make_resampled_aggregations(
+    table: pa.Table,
+    table_index: list,
+    frequencies: tuple,
+    aggfuncs: Union[str, list, None] = "standards",
+    release: Callable = None,
+) -> list:
+    """Make collections and statistics at coarser dates
+
+    Args:
+        table (pa.Table, RealizationTables): aggregated table
+                                             (DATE, REAL, and vectors)
+        table_index (list): the table index, only ["DATE"] can be resampled,
+                            dates are resampled as timestamps, tables with
+                            DATE of other types, e.g. strings, are skipped
+        frequencies (tuple): frequencies, see matrix.FREQUENCIES
+        aggfuncs (str, list, None): statistics to make, None for no statistics
+        release (Callable): called once with every vector when no longer
+                            needed, e.g. RealizationTables.release
+
+    Returns:
+        list: tuples of operation, table with index and one vector, frequency
+    """
+    logger = init_logging(__name__ + ".make_resampled_aggregations")
+    release = release or _keep
+    unneccessaries = ["YEARS", "SECONDS", "ENSEMBLE"]
+    columns = [
+        col_name
+        for col_name in table.column_names
+        if col_name not in table_index + ["REAL"] + unneccessaries
+    ]
+    if table_index != ["DATE"]:
+        logger.warning("Cannot resample table with index %s", table_index)
+        release(columns)
+        return []
+    index_table = table.select(table_index + ["REAL"])
+    date_type = index_table.schema.field("DATE").type
+    if pa.types.is_date(date_type):
+        logger.debug("Resampling DATE of type %s as timestamps", date_type)
+        index_table = index_table.set_column(
+            0, "DATE", index_table["DATE"].cast(pa.timestamp("ms"))
+        )
+    elif not pa.types.is_timestamp(date_type):
+        logger.warning("Cannot resample DATE of type %s", date_type)
+        release(columns)
+        return []
+    with limits.slot("cpu"):
+        return _resample(table, index_table, columns, frequencies, aggfuncs, release)
+
+
+def _resample(
+    table: pa.Table,
+    index_table: pa.Table,
+    columns: list,
+    frequencies: tuple,
+    aggfuncs: Union[str, list, None],
+    release: Callable,
+) -> list:
+    """Make resampled collections and statistics, see make_resampled_aggregations
+
+    The vectors are resampled VECTORS_PER_BLOCK at the time, each block
+    is released once its matrix is made
+
+    Args:
+        table (pa.Table, RealizationTables): aggregated table
+        index_table (pa.Table): DATE as timestamps, and REAL
+        columns (list): the vectors to resample
+        frequencies (tuple): frequencies, see matrix.FREQUENCIES
+        aggfuncs (str, list, None): statistics to make, None for no statistics
+        release (Callable): called with the vectors of each block
+
+    Returns:
+        list: tuples of operation, table with index and one vector, frequency
+    """
+    logger = init_logging(__name__ + "._resample")
+    table_index = ["DATE"]
+    layout = table_layout(index_table, table_index)
+    resampled_input = []
+    for start in range(0, len(columns), VECTORS_PER_BLOCK):
+        block = columns[start : start + VECTORS_PER_BLOCK]
+        ensemble = EnsembleMatrix.from_table(
+            table.select(block), table_index, block, layout
+        )
+        release(block)
+        for frequency in frequencies:
+            resampled = ensemble.resample(frequency)
+            logger.debug("%s: %s dates", frequency, resampled.keys.num_rows)
+            for vector in resampled.vectors:
+                resampled_input.append(
+                    ("collection", resampled.to_table(vector), frequency)
+                )
+            if aggfuncs is not None:
+                for aggname, stat_table in split_statistics(
+                    matrix_statistics(resampled, aggfuncs), table_index
+                ):
+                    resampled_input.append((aggname, stat_table, frequency))
+    return resampled_input
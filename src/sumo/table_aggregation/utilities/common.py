@@ -0,0 +1,137 @@
+"""Logging, timing, hashing and event loop helpers shared by the utilities"""
+import os
+import asyncio
+import hashlib
+import logging
+import time
+import uuid
+from sumo.table_aggregation import memory, profiling
+
+# Environment variable with folder for cached blobs, current folder if not set
+BLOB_CACHE = "SUMO_AGGREGATION_CACHE"
+
+
+def process_memory():
+    """Fetch memory usage"""
+    import psutil  # pylint: disable=import-outside-toplevel
+
+    process = psutil.Process(os.getpid())
+    mem_info = process.memory_info()
+    return mem_info.rss
+
+
+def memcount(label: str = None):
+    """Decorate function to track its peak memory, see memory.profile
+
+    Args:
+        label (str, optional): label in memory report, defaults to function name
+    """
+
+    def decorator(func):
+        name = label or func.__name__
+
+        def wrapper(*args, **kwargs):
+            with memory.profile(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def timethis(label):
+    """Decorate functions to time them
+
+    Args:
+        label (str): name to shown when decorating
+    """
+
+    def decorator(func):
+        logger = init_logging(__name__ + ".timer")
+
+        if asyncio.iscoroutinefunction(func):
+
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                result = await func(*args, **kwargs)
+                stop = time.perf_counter()
+                logger.info("--> Timex (%s): %s s", label, round(stop - start, 2))
+                return result
+
+            return async_wrapper
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            stop = time.perf_counter()
+            logger.info("--> Timex (%s): %s s", label, round(stop - start, 2))
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def split_list(list_to_split: list, size: int) -> list:
+    """Split list into segments
+
+    Args:
+        list_to_split (list): the list to split
+        size (int): the size of each sublist
+
+    Returns:
+        list: the list of lists
+    """
+    list_list = []
+    while len(list_to_split) > size:
+        piece = list_to_split[:size]
+        list_list.append(piece)
+        list_to_split = list_to_split[size:]
+    list_list.append(list_to_split)
+    return list_list
+
+
+def init_logging(name: str) -> logging.Logger:
+    """Init logging null handler
+    args:
+    name (str): name of logger
+    returns (logging.Logger): an initialized logger
+    """
+    logger = logging.getLogger(name)
+    return logger
+
+
+def md5sum(bytes_string: bytes) -> str:
+    """Make checksum from bytestring
+    args:
+    bytes_string (bytes): byte string
+    returns (str): checksum
+    """
+    logger = init_logging(__name__ + ".md5sum")
+    hash_md5 = hashlib.md5()
+    hash_md5.update(bytes_string)
+    checksum = hash_md5.hexdigest()
+    logger.debug("Checksum %s", checksum)
+
+    return checksum
+
+
+def uuid_from_string(string: str) -> str:
+    """Generate uuid from string
+
+    Args:
+        string (str): string to generate from
+
+    Returns:
+        str: uuid which is hash of md5
+    """
+    return str(uuid.UUID(hashlib.md5(string.encode("utf-8")).hexdigest()))
+
+
+async def call_parallel(loop, executor, func, *args):
+    """Execute blocking function in an event loop
+
+    The function is profiled under the labels of the caller, see
+    profiling.carried
+    """
+    return await loop.run_in_executor(executor, profiling.carried(func), *args)
@@ -0,0 +1,414 @@
+"""Fetching, decoding and caching of realization blobs, and concatenation"""
+import os
+import time
+import asyncio
+from typing import Union
+from io import BytesIO
+import numpy as np
+import pyarrow as pa
+from pyarrow import feather
+import pyarrow.parquet as pq
+from httpx import HTTPStatusError, TransportError
+from sumo.wrapper import SumoClient
+from sumo.table_aggregation import limits, memory, metrics
+from sumo.table_aggregation.gather import RealizationTables
+from sumo.table_aggregation.registry import RealizationRegistry, as_registry
+from sumo.table_aggregation.sketch import EnsembleSketch, sketch_realizations
+from sumo.table_aggregation.spill import SpillWriter, spill_folder
+from sumo.table_aggregation.utilities.common import (
+    BLOB_CACHE,
+    call_parallel,
+    init_logging,
+    memcount,
+)
+
+DOWNLOAD_RETRIES = 3
+# First bytes of the binary formats, anything else is read as csv
+PARQUET_MAGIC = b"PAR1"
+FEATHER_MAGICS = (b"ARROW1", b"FEA1")
+
+
+def read_available_columns(file_path, cols_to_read):
+    """Read parquet table with available columns
+
+    Args:
+        file_path (str): path to file to read
+        cols_to_read (set): unique columns to try to read
+
+    Returns:
+        pa.Table: read table
+    """
+    logger = init_logging(__name__ + ".read_available_columns")
+    # Stolen from https://issues.apache.org/jira/browse/ARROW-11473
+    len_asked_for = len(cols_to_read)
+    try:
+        meta = pq.read_metadata(file_path) # reads only the metadata
+        logger.debug("Wanting to retrieve %s columns", )
+        # Get the column names from the schema
+        table_columns = meta.schema.names
+        logger.debug("table contains %s columns", len(table_columns))
+        # Do an intersection with the names you want to read
+        available_columns = list(set(cols_to_read) & set(table_columns))
+        len_retrieved = len(available_columns)
+        try:
+            table = pq.read_table(file_path, columns=available_columns)
+            logger.warning("Got %s columns less than asked for", len_asked_for - len_retrieved)
+        except pa.lib.ArrowInvalid:
+            table = pa.table([])
+            logger.error("file %s is empty", file_path)
+    except pa.lib.ArrowInvalid:
+        table = pa.table([])
+        logger.error("Table with name %s is completely empty", file_path)
+    return table
+
+
+def _get_blob(sumo: SumoClient, query: str):
+    """Get blob from sumo once, measured as download
+
+    Args:
+        sumo (SumoClient): client to a given environment
+        query (str): path to the blob
+
+    Returns:
+        httpx.Response: the response with the blob
+    """
+    with metrics.measure("download") as sample:
+        blob = sumo.get(query)
+        sample.bytes_in = len(blob.content)
+        sample.objects = 1
+    return blob
+
+
+def download(sumo: SumoClient, query: str, retries: int = DOWNLOAD_RETRIES):
+    """Get blob from sumo, retrying on network errors
+
+    Args:
+        sumo (SumoClient): client to a given environment
+        query (str): path to the blob
+        retries (int): number of retries before giving up
+
+    Raises:
+        httpx.TransportError: if the last try fails
+
+    Returns:
+        httpx.Response: the response with the blob
+    """
+    logger = init_logging(__name__ + ".download")
+    for attempt in range(retries):
+        try:
+            return _get_blob(sumo, query)
+        except TransportError:
+            metrics.count("retries")
+            logger.warning("Retrying %s (%s of %s)", query, attempt + 1, retries)
+            time.sleep(2**attempt)
+    return _get_blob(sumo, query)
+
+
+def get_object(object_id: str, cols_to_read: list, sumo: SumoClient) -> pa.Table:
+    """fetche sumo object as pa.Table
+
+    Args:
+        object_id (str): sumo object id
+        sumo (SumoClient): client to a given environment
+
+    Returns:
+        pa.Table: the object as pyarrow
+    """
+    logger = init_logging(__name__ + ".get_object")
+    query = f"/objects('{object_id}')/blob"
+    file_path = os.path.join(os.environ.get(BLOB_CACHE, ""), f"{object_id}.parquet")
+
+    if not os.path.isfile(file_path):
+        metrics.count("cache_misses")
+        with limits.slot("download"):
+            blob = download(sumo, query)
+
+        with metrics.measure("decode") as sample:
+            sample.bytes_in = len(blob.content)
+            table = blob_to_table(BytesIO(blob.content))
+            sample.objects = 1
+        # Write to temporary file first, the cache can be shared between processes
+        tmp_path = f"{file_path}.{os.getpid()}.tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, file_path)
+        logger.debug("Written object to file %s", file_path)
+    else:
+        metrics.count("cache_hits")
+    try:
+        table = pq.read_table(file_path, columns=list(cols_to_read))
+        logger.debug("Table is read as should be!")
+    except (pa.lib.ArrowInvalid, KeyError):
+
+        table = read_available_columns(file_path, cols_to_read)
+
+    return table
+
+
+def blob_to_table(blob_object) -> pa.Table:
+    """Read stored blob into arrow table
+
+    Args:
+        blob_object (BytesIO): the object to convert, parquet, feather or csv
+
+    Returns:
+        pa.Table: the results stored as pyarrow table
+    """
+    logger = init_logging(__name__ + ".blob_to_table")
+    # Format is found from the first bytes, so pandas is only loaded for csv
+    head = blob_object.read(6)
+    blob_object.seek(0)
+    if head.startswith(PARQUET_MAGIC):
+        fformat = "parquet"
+        table = pq.read_table(blob_object)
+    elif head.startswith(FEATHER_MAGICS):
+        fformat = "feather"
+        table = feather.read_table(blob_object)
+    else:
+        import pandas as pd  # pylint: disable=import-outside-toplevel
+
+        frame = pd.read_csv(blob_object)
+        logger.debug(
+            "Extracting from pandas dataframe with these columns %s", frame.columns
+        )
+        try:
+            table = pa.Table.from_pandas(frame)
+        except KeyError:
+            table = pa.table([])
+        fformat = "csv"
+
+    logger.debug("Reading table read from %s as arrow", fformat)
+    return table
+
+
+@memcount()
+def reconstruct_table(
+    object_id: str, real_nr: str, sumo: SumoClient, required: list
+) -> pa.Table:
+    """Reconstruct pa.Table from sumo object id
+
+    Args:
+        object_id (str): the object to fetch
+        real_nr (str): the real nr of the object
+        sumo (SumoClient): initialized sumo client
+        required (list): list of columns that need to be in table
+
+
+    Returns:
+        pa.Table: The table
+    """
+    logger = init_logging(__name__ + ".reconstruct_table")
+    logger.debug("Real %s", real_nr)
+    try:
+        real_table = get_object(object_id, required, sumo)
+        rows = real_table.shape[0]
+
+        logger.debug(
+            "Table contains the following columns: %s (real: %s)",
+            real_table.column_names,
+            real_nr,
+        )
+        real_table = real_table.add_column(
+            0, "REAL", pa.array([np.int16(real_nr)] * rows)
+        )
+        missing = [
+            col_name for col_name in required if col_name not in real_table.column_names
+        ]
+        if len(missing):
+            logger.info("Real: %s, missing these columns %s", real_nr, missing)
+
+        for miss in missing:
+            real_table = real_table.add_column(0, miss, pa.array([None] * rows))
+        logger.debug("Table created %s", type(real_table))
+
+    except HTTPStatusError:
+        real_table = pa.table([])
+        logger.error("Could not read table in real %s (object id: %s)", real_nr, object_id)
+    logger.info("Reconnstructed table, size is %s", real_table.nbytes)
+    return real_table
+
+
+def with_realization(real_table: pa.Table, real_nr: int) -> pa.Table:
+    """Make table of other realization sharing the same blob
+
+    Only the REAL column is new, the other columns share buffers with
+    the given table.
+
+    Args:
+        real_table (pa.Table): table as made by reconstruct_table
+        real_nr (int): the other realization
+
+    Returns:
+        pa.Table: the table, or the given one if it has no REAL column
+    """
+    if "REAL" not in real_table.column_names:
+        return real_table
+    return real_table.set_column(
+        real_table.column_names.index("REAL"),
+        "REAL",
+        pa.array(np.full(real_table.num_rows, real_nr, dtype=np.int16)),
+    )
+
+
+def realization_tables(real_table: pa.Table, group: tuple) -> list:
+    """Make tables of all realizations sharing one fetched blob
+
+    Args:
+        real_table (pa.Table): table of the fetched realization
+        group (tuple): object id, fetched realization and all realizations,
+                       see RealizationRegistry.fetch_groups
+
+    Returns:
+        list: the fetched table, then tables of the other realizations
+    """
+    _, real_nr, reals = group
+    return [real_table] + [
+        with_realization(real_table, other)
+        for other in reals.tolist()
+        if other != real_nr
+    ]
+
+
+def merge_sketch(sketch: EnsembleSketch, tables: list):
+    """Sketch tables of one group of realizations, and merge into sketch
+
+    Args:
+        sketch (EnsembleSketch): the sketch of the aggregation
+        tables (list): the tables, see realization_tables
+    """
+    with metrics.measure("statistics") as sample:
+        sketch.merge(
+            sketch_realizations(tables, sketch.table_index, sketch.vectors, sketch.k)
+        )
+        sample.bytes_in = sum(table.nbytes for table in tables)
+        sample.objects = len(tables)
+
+
+async def _fetch_group(
+    group: tuple, sumo: SumoClient, required, loop, sketch: EnsembleSketch = None
+) -> list:
+    """Fetch table of one group of realizations sharing a blob
+
+    Args:
+        group (tuple): see realization_tables
+        sumo (SumoClient): initialized sumo client
+        required (list): list of columns that need to be in table
+        loop (asyncio.event_loop)
+        sketch (EnsembleSketch, optional): sketch to add the tables to
+
+    Returns:
+        list: the tables, see realization_tables
+    """
+    object_id, real_nr, _ = group
+    real_table = await call_parallel(
+        loop, None, reconstruct_table, object_id, real_nr, sumo, required
+    )
+    tables = realization_tables(real_table, group)
+    if sketch is not None:
+        await call_parallel(loop, None, merge_sketch, sketch, tables)
+    return tables
+
+
+async def fetch_tables(
+    object_ids: RealizationRegistry,
+    sumo: SumoClient,
+    required,
+    loop,
+    sketch: EnsembleSketch = None,
+) -> list:
+    """Fetch tables of all realizations, each blob once
+
+    Args:
+        object_ids (RealizationRegistry, dict): the realization objects,
+                                                or real nr to object id
+        sumo (SumoClient): initialized sumo client
+        required (list): list of columns that need to be in table
+        loop (asyncio.event_loop)
+        sketch (EnsembleSketch, optional): sketch to add tables to as
+                                           they arrive, see merge_sketch
+
+    Returns:
+        list: tables, in order of realization
+    """
+    groups = as_registry(object_ids).fetch_groups()
+    fetched = await asyncio.gather(
+        *[_fetch_group(group, sumo, required, loop, sketch) for group in groups]
+    )
+    tables = [table for group in fetched for table in group]
+    if len(tables) > len(groups):
+        metrics.count("duplicate_blobs", len(tables) - len(groups))
+    return tables
+
+
+async def aggregate_arrow(
+    object_ids: RealizationRegistry,
+    sumo: SumoClient,
+    required,
+    loop,
+    spill: str = None,
+    gather: bool = False,
+    sketch: EnsembleSketch = None,
+) -> Union[pa.Table, RealizationTables]:
+    """Aggregate the individual objects into one large pyarrow table
+
+    Realizations with equal blobs, by checksum, are fetched once, and the
+    table is repeated for the others with their realization number.
+    With spilling on, see spill.SpillWriter, tables are written to a local
+    Arrow IPC file as they arrive, in order of arrival, and the result is
+    memory mapped from it instead of concatenated in memory. If a fetch
+    fails, the other fetches are cancelled and the spill file removed.
+    Otherwise, with gather, the tables are not concatenated, and output tables are
+    gathered from them, see gather.RealizationTables. With a sketch, the
+    tables of each blob are sketched as they arrive, and merged into it,
+    so statistics in sketch mode need no pass over the aggregated table.
+    args:
+    object_ids (RealizationRegistry, dict): the realization objects,
+                                            or real nr to object id
+    sumo (SumoClient): initialized sumo client
+    required (list): list of columns that need to be in table
+    loop (asyncio.event_loop)
+    spill (str, optional): folder to spill to, see spill.spill_folder
+    gather (bool): keep realization tables apart, when not spilling
+    sketch (EnsembleSketch, optional): sketch to add the tables to
+    returns: pa.Table, RealizationTables: the aggregated results
+    """
+    logger = init_logging(__name__ + ".aggregate_arrow")
+    logger.info("Ready for action!")
+    folder = spill_folder(spill)
+    if folder is None:
+        tables = await fetch_tables(object_ids, sumo, required, loop, sketch)
+        if gather:
+            return RealizationTables(tables)
+        with metrics.measure("concat") as sample, memory.profile("concat"):
+            aggregated = pa.concat_tables(tables, promote_options="default")
+            sample.objects = len(tables)
+            sample.bytes_out = aggregated.nbytes
+        return aggregated
+    groups = as_registry(object_ids).fetch_groups()
+    fetches = [
+        asyncio.ensure_future(_fetch_group(group, sumo, required, loop, sketch))
+        for group in groups
+    ]
+    writer = SpillWriter(folder)
+    nr_tables = 0
+    try:
+        for fetch in asyncio.as_completed(fetches):
+            group = await fetch
+            with metrics.measure("spill") as sample:
+                for real_table in group:
+                    await call_parallel(loop, None, writer.write, real_table)
+                sample.objects = len(group)
+                sample.bytes_in = sum(real_table.nbytes for real_table in group)
+            nr_tables += len(group)
+        if nr_tables > len(groups):
+            metrics.count("duplicate_blobs", nr_tables - len(groups))
+        with metrics.measure("concat") as sample, memory.profile("concat"):
+            aggregated = await call_parallel(loop, None, writer.close)
+            sample.objects = nr_tables
+            sample.bytes_out = aggregated.nbytes
+    finally:
+        outstanding = [fetch for fetch in fetches if not fetch.done()]
+        for fetch in outstanding:
+            fetch.cancel()
+        await asyncio.gather(*outstanding, return_exceptions=True)
+        writer.discard()
+    return aggregated
@@ -0,0 +1,240 @@
+"""Metadata for aggregated objects, made from metadata of realizations"""
+from sumo.table_aggregation.registry import RealizationRegistry
+from sumo.table_aggregation.utilities.common import init_logging
+
+
+def convert_metadata(
+    single_metadata: dict,
+    real_ids: list,
+    table_index,
+    operation: str = "collection",
+):
+    """Make metadata for the aggregated data from single metadata
+    args:
+    single_metadata (dict): one single metadata dict
+    real_ids (list): list of realization numbers, needed for metadata
+    operation (str): what type of operation the aggregation performs
+    returns agg_metadata (dict): metadata dict that can be further used for aggregation
+    """
+    logger = init_logging(__name__ + ".convert_metadata")
+
+    agg_metadata = single_metadata.copy()
+    try:
+        del agg_metadata["_sumo"]
+    except KeyError:
+        logger.debug("Nothing to delete at _sumo")
+
+    # fmu.realization shall not be present
+    try:
+        del agg_metadata["fmu"]["realization"]
+    except KeyError:
+        logger.debug("No realization part to delete")
+    outside_index = False
+    try:
+        outside_index = len(table_index) > 0
+    except TypeError:
+        outside_index = table_index is not None
+    if outside_index:
+        agg_metadata["data"]["table_index"] = table_index
+    else:
+        try:
+            table_index = agg_metadata["data"]["table_index"]
+        except KeyError:
+            logger.warning(
+                "No table index set, will produce no results",
+            )
+            agg_metadata["data"]["table_index"] = None
+
+    # Adding specific aggregation ones
+    agg_metadata["fmu"]["aggregation"] = agg_metadata["fmu"].get("aggregation", {})
+    agg_metadata["fmu"]["aggregation"]["operation"] = operation
+    agg_metadata["fmu"]["aggregation"]["realization_ids"] = list(real_ids)
+    agg_metadata["fmu"]["context"]["stage"] = "iteration"
+    # Since no file on disk, trying without paths
+    agg_metadata["file"]["absolute_path"] = ""
+    logger.info("The table index will be %s", agg_metadata["data"]["table_index"])
+
+    return agg_metadata
+
+
+class MetadataSet:
+
+    """Class for arrangement of input to aggregation"""
+
+    def __init__(self, table_index=None):
+        """Sets _parameter_dict to empty dict"""
+        self._parameter_dict = {}
+        self._registry = RealizationRegistry([], [])
+        self._uuids = set()
+        self._table_index = table_index
+        self._base_meta = {}
+        self._columns = ()
+        self._logger = init_logging(__name__ + ".MetadataSet")
+
+    @property
+    def parameter_dict(self) -> dict:
+        """Return _parameter_dict attribute"""
+        return self._parameter_dict
+
+    @property
+    def registry(self) -> RealizationRegistry:
+        """Return registry of the realization objects"""
+        return self._registry
+
+    @registry.setter
+    def registry(self, registry: RealizationRegistry):
+        self._registry = registry
+
+    @property
+    def real_ids(self) -> tuple:
+        """Return realization ids, sorted"""
+        return tuple(self._registry.reals.tolist())
+
+    @property
+    def uuids(self) -> list:
+        """Return _uuid attribute"""
+        return self._uuids
+
+    @property
+    def table_index(self):
+        """Return attribute _table_index
+
+        Returns:
+            list: the table index
+        """
+        return self._table_index
+
+    @property
+    def base_meta(self):
+        """Return attribute _base_meta
+
+        Returns:
+            dict: metadata to be used as basis for all aggregated objects
+        """
+        return self._base_meta
+
+    @property
+    def agg_columns(self):
+        """Return columns representing all realizations
+
+        Returns:
+            list: list of all columns in specific table
+        """
+        return self._columns
+
+    @agg_columns.setter
+    def agg_columns(self, columns):
+        self._columns = columns
+
+    def resolve_col_conflicts(self, columns, realnr):
+        """Check if columns for specific real matches the other reals
+
+        Args:
+            columns (list): list of cols for specific objecty
+            realnr (int): realization nr
+        """
+        if (len(self._columns) > 0) & (len(self._columns) != len(columns)):
+            if len(self.agg_columns) < len(columns):
+                to_keep = columns
+                to_compare = self.agg_columns
+            else:
+                to_keep = self.agg_columns
+                to_compare = columns
+            diff = [col_name for col_name in to_keep if col_name not in to_compare]
+            if len(diff) > 0:
+                mess = (
+                    f", something is different with real {realnr} \n"
+                    + f"This/these columns are not found earlier {diff}"
+                )
+                self._logger.warning(mess)
+
+            self.agg_columns = to_keep
+        else:
+            self._columns = columns
+            self._logger.debug("Columns are g ood")
+
+    def aggid(self) -> str:
+        """Return the hash of the sum of all the sorted(uuids)"""
+        return str("".join(sorted(self.uuids)))
+
+    def add_realisation(self, real_nr: int, object_id: str = None):
+        """Adds realnr for relevant real
+        args:
+        real_nr (int):real nr
+        object_id (str): sumo id of object of real
+        """
+        self._registry = self._registry.merge(
+            RealizationRegistry([real_nr], [object_id])
+        )
+
+    def gen_agg_meta(self, metadata: dict) -> dict:
+        """Converts one metadata file into aggregated metadata
+        args:
+        metadata (dict): one valid metadatafile
+        returns agg_metadata (dict): one valid metadata file to be used for
+                                     aggregations to come
+        """
+        logger = init_logging(__name__ + ".base_meta")
+        self._base_meta = convert_metadata(
+            metadata, self.real_ids, self.parameter_dict, self.table_index
+        )
+        self._base_meta["data"]["spec"]["columns"] = self.agg_columns
+        self._table_index = self._base_meta["data"]["table_index"]
+
+        logger.debug("--\n Table index is: %s\n--------", self._table_index)
+
+
+def split_results_and_meta(results: list, **kwargs: dict) -> tuple:
+    """split hits from sumo query
+    results (list): query_results["hits"]["hist"]
+    returns tuple: registry of realization objects, meta stub,
+                   and table index
+    """
+    logger = init_logging(__name__ + ".split_result_and_meta")
+    col_lengths = set()
+    meta = MetadataSet(kwargs.get("table_index", None))
+    meta.registry = RealizationRegistry.from_hits(
+        [result for result in results if "realization" in result["_source"]["fmu"]]
+    )
+
+    for result in results:
+        real_meta = result["_source"]
+        found_cols = real_meta["data"]["spec"]["columns"]
+        col_lengths.add(len(found_cols))
+        try:
+            real_meta["fmu"].pop("realization")
+        except KeyError:
+            logger.warning("No realization in result, already aggregation?")
+            continue
+        # meta.resolve_col_conflicts(found_cols, realnr)
+    logger.debug(col_lengths)
+    if len(col_lengths) != 1:
+        logger.warning(
+            "Several sets of columns (%s) see difference in lengths: \n%s",
+            len(col_lengths),
+            col_lengths,
+        )
+    meta.gen_agg_meta(real_meta)
+
+    split_tup = (
+        meta.registry,
+        meta.base_meta,
+        meta.table_index,
+    )
+    return split_tup
+
+
+def get_blob_ids_w_metadata(hits: list, **kwargs: dict) -> tuple:
+    """Get all object ids and metadata for iteration
+
+    Args:
+        query_results (dict): results from sumo query
+
+    Returns:
+        tuple: see under split results_and_meta
+    """
+    logger = init_logging(__name__ + ".get_blob_ids_w_meta")
+
+    logger.info("hits actually contained in request: %s", len(hits))
+
+    return split_results_and_meta(hits, **kwargs)
@@ -0,0 +1,288 @@
+"""Queries to sumo, and checks of the client"""
+import json
+import time
+import base64
+import uuid
+import warnings
+from datetime import datetime
+from sumo.wrapper import SumoClient
+from sumo.table_aggregation import metrics
+from sumo.table_aggregation.registry import RealizationRegistry
+from sumo.table_aggregation.utilities.common import init_logging
+from sumo.table_aggregation.utilities.metadata import convert_metadata
+
+
+def get_expiry_time(sumo: SumoClient) -> int:
+    """Get expiry time from sumo client
+
+    Args:
+        sumo (SumoClient): The activated client
+
+    Returns:
+        int: time since epoch in seconds
+    """
+    logger = init_logging(__name__ + ".get_expiry_time")
+    token_parts = sumo._retrieve_token().split(".")
+    body = json.loads(base64.b64decode(token_parts[1]).decode(encoding="utf-8"))
+
+    expiry_time = body["exp"]
+    strftime = datetime.fromtimestamp(expiry_time).strftime("%Y-%m-%d %H:%M:%S")
+    logger.debug("Token expires at %s", strftime)
+    return expiry_time
+
+
+def find_env(url):
+    """Return sumo environment
+
+    Args:
+        url (str): the base url of sumo client
+
+    Returns:
+        str: the name of environments
+    """
+    logger = init_logging(__name__ + ".find_url")
+    logger.debug("Finding env from url: %s", url)
+    url_parts = url.split(".")
+    return url_parts[0].split("-")[-1]
+
+
+def check_or_refresh_token(sumo):
+    """Checks whether token is about to expire
+
+    Args:
+        sumo (SumoClient): the client to check against
+
+    Raises:
+        TimeoutError: if the token has expired
+
+    Returns:
+        sumo: _description_
+    """
+    logger = init_logging(__name__ + ".check_or_refresh_token")
+    expiry_time = get_expiry_time(sumo)
+    current_time = time.time()
+    lim_in_min = 10
+    limit = (expiry_time - current_time) / (60 * lim_in_min)
+    logger.debug("%s to go ", f"{limit: 3.1f}")
+    if limit < 0:
+        logger.critical("Oh no too late! No token")
+        raise TimeoutError("To late!!!")
+    if limit < 10:
+        logger.info("Refreshing token")
+        sumo.auth.get_token()
+        # sumo = SumoClient(find_env(sumo.base_url))
+    else:
+        logger.debug("No worries here")
+    return sumo
+
+
+def return_uuid(sumo, identifier, version=4):
+    """Return fmu.case.uuid, either via name, or just pass on
+    args:
+    identifier (str): either case name of case uuid (prefered)
+    version (int): what version of uuid to compare to
+    """
+    # Concepts stolen from stackoverflow.com
+    # questions/19989481/how-to-determine-if-a-string-is-a-valid-v4-uuid
+    logger = init_logging(__name__ + ".return_uuid")
+    logger.debug("Checking %s", identifier)
+    try:
+        logger.debug("Checking for uuid")
+        uuid.UUID(identifier, version=version)
+    except ValueError:
+        logger.warning("%s should be the name of a case", identifier)
+        warnings.warn(
+            "Using case name: this is not the prefered option,"
+            "might in the case of duplicate case names give errors"
+        )
+        logger.debug("Passing %s to return a uuid", identifier)
+        identifier = query_for_sumo_id(sumo, identifier)
+        logger.debug("After query we are left with %s", identifier)
+    return identifier
+
+
+def query_for_sumo_id(sumo: SumoClient, case_name: str) -> str:
+    """Find uuid for given case name
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        case_name (str): name of case
+
+    Returns:
+        str: case uuid
+    """
+    logger = init_logging(__name__ + ".query_for_sumo_id")
+    select = "fmu.case.uuid"
+    query = f"fmu.case.name:{case_name}"
+    results = sumo.get(
+        "/searchroot",
+        {
+            "$query": query,
+            "$size": 1,
+            "$select": select,
+        },
+    ).json()
+    logger.debug("%s hits.", len(results["hits"]["hits"]))
+    unique_id = results["hits"]["hits"][0]["_source"]["fmu"]["case"]["uuid"]
+    return unique_id
+
+
+def get_buckets(agg_results, selector):
+    """Fetch unique combinations in aggregated results
+
+    Args:
+        agg_results (dict): dict of results["aggregations"]
+        selector (str): name of buckets
+
+    Returns:
+        list: list of results
+    """
+
+    agg_list = [bucket["key"] for bucket in agg_results[selector]["buckets"]]
+    return agg_list
+
+
+def query_sumo_iterations(sumo: SumoClient, case_uuid: str) -> list:
+    """Qeury for iteration names
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        case_uuid (str): name of case
+
+    Returns:
+        list: list with iteration numbers
+    """
+    logger = init_logging(__name__ + ".query_sumo_iterations")
+    query = f"\nfmu.case.uuid:{case_uuid}\n"
+    logger.debug(query)
+    selector = "fmu.iteration.name"
+    bucket_name = selector + ".keyword"
+    results = sumo.get(
+        "/search",
+        {"$query": query, "$size": 0, "$select": selector, "$buckets": bucket_name},
+    ).json()
+    iterations = get_buckets(results["aggregations"], bucket_name)
+    return iterations
+
+
+def query_for_name_and_tags(sumo: SumoClient, case_uuid: str, iteration: str):
+    """Make dict with key as table name, and value list of corresponding tags
+
+    Args:
+        sumo (SumoClient): Initialized sumo client
+        case_uuid (str): uuid for case
+        iteration (str): iteration name
+
+    Returns:
+        dict: the results
+    """
+    logger = init_logging(__name__ + ".query_for_name_and_tags")
+    logger.info("Finding tables for iteration: %s", iteration)
+    query = {
+        "query": {
+            "bool": {
+                "must": [
+                    {"term": {"_sumo.parent_object.keyword": {"value": case_uuid}}},
+                    {"term": {"class.keyword": {"value": "table"}}},
+                    {"term": {"fmu.iteration.name.keyword": {"value": iteration}}},
+                ],
+                "must_not": [{"term": {"data.tagname.keyword": {"value": ""}}}],
+            }
+        },
+        "aggs": {
+            "table": {
+                "terms": {"field": "data.name.keyword", "size": 100},
+                "aggs": {
+                    "tagname": {"terms": {"field": "data.tagname.keyword", "size": 100}}
+                },
+            }
+        },
+        "size": 0,
+    }
+    logger.debug("\nSubmitting query for tags: %s\n", query)
+    results = sumo.post("/search", json=query).json()
+    logger.debug("\nQuery results\n %s", results)
+
+    name_with_tags = {}
+    for hit in results["aggregations"]["table"]["buckets"]:
+        logger.debug(hit["key"])
+        name = hit["key"]
+        name_with_tags[name] = name_with_tags.get(name, [])
+        for taghit in hit["tagname"]["buckets"]:
+            name_with_tags[name].append(taghit["key"])
+    logger.info("These are the names and tags:\n%s", name_with_tags)
+    return name_with_tags
+
+
+def query_for_table(
+    sumo: SumoClient,
+    case_uuid: str,
+    name: str,
+    tagname: str,
+    iterationname: str,
+    pit: str = None,
+    **kwargs: dict,
+):
+    """Get blob id's for one specific table combination of name,tagname, and iteration
+
+    Args:
+        sumo (SumoClient): Initialized client
+        case_uuid (str): case uuid
+        name (str): name of table
+        tagname (str): tagname of table
+        iterationname (str): name of iteration
+        pit (str, optional): point in time. Defaults to None.
+
+    Returns:
+        tuple: registry of the realization objects, metadata for aggregation,
+               and table index
+    """
+    logger = init_logging(__name__ + ".query_for_table")
+    query = {
+        "query": {
+            "bool": {
+                "must": [
+                    {"term": {"fmu.case.uuid.keyword": {"value": case_uuid}}},
+                    {"term": {"data.name.keyword": {"value": name}}},
+                    {"term": {"data.tagname.keyword": {"value": tagname}}},
+                    {"term": {"fmu.iteration.name.keyword": {"value": iterationname}}},
+                    {"term": {"fmu.context.stage.keyword": {"value": "realization"}}},
+                ]
+            }
+        },
+        "size": 1,
+        "track_total_hits": True,
+        "_source": {"excludes": ["fmu.realization.parameters"]},
+    }
+    with metrics.measure("discovery"):
+        query_result = sumo.post("/search", json=query).json()
+    query["size"] = 1000  # fixme: should handle cases with more than 1000 objects ?
+    query["_source"] = {"includes": list(RealizationRegistry.SOURCE_FIELDS)}
+    with metrics.measure("discovery") as sample:
+        query_ids = sumo.post("/search", json=query).json()
+        sample.objects = len(query_ids["hits"]["hits"])
+
+    first_spec = query_result["hits"]["hits"][0]["_source"]["data"].get("spec") or {}
+    registry = RealizationRegistry.from_hits(
+        query_ids["hits"]["hits"], len(first_spec.get("columns", [])) or None
+    )
+    if registry.nr_unique < len(registry):
+        logger.warning(
+            "Name: %s and tag %s, %s realizations share %s objects, "
+            "each will be fetched once",
+            name,
+            tagname,
+            len(registry),
+            registry.nr_unique,
+        )
+
+    table_index = query_result["hits"]["hits"][0]["_source"]["data"]["table_index"]
+    return (
+        registry,
+        convert_metadata(
+            query_result["hits"]["hits"][0]["_source"],
+            registry.reals.tolist(),
+            table_index,
+        ),
+        table_index,
+    )
@@ -0,0 +1,590 @@
+"""Splitting of aggregated tables into objects, and upload of them"""
+import sys
+import json
+import asyncio
+import threading
+from copy import deepcopy
+from typing import Union
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sumo.wrapper import SumoClient
+from sumo.table_aggregation import limits, metrics
+from sumo.table_aggregation.gather import RealizationTables
+from sumo.table_aggregation.sketch import EnsembleSketch
+from sumo.table_aggregation.utilities import aggregations
+from sumo.table_aggregation.utilities.common import (
+    call_parallel,
+    init_logging,
+    md5sum,
+    uuid_from_string,
+)
+
+# Keys of index objects uploaded by this process, see upload_index
+_UPLOADED_INDEXES = set()
+_INDEX_LOCK = threading.Lock()
+
+
+def prepare_object_launch(meta: dict, table, name, operation, frequency=None):
+    """Complete metadata for object
+    args:
+    frame (pd.DataFrame): the data to write
+    agg_meta (dict): Stub for aggregated meta to be written
+    columns (list): the column names in the frame
+    frequency (str): frequency of resampled results, None when not resampled
+    """
+    logger = init_logging(__name__ + ".complete_meta")
+    logger.debug("Preparing with data source %s", type(table))
+    byte_string = table_to_bytes(table)
+    tag = meta["data"]["tagname"]
+    md5 = md5sum(byte_string)
+    full_meta = deepcopy(meta)
+    parent = full_meta["data"]["name"]
+    label = operation if frequency is None else f"{operation}-{frequency}"
+    unique_name = (
+        parent
+        + f"--{name}--{tag}--{label}--"
+        + full_meta["fmu"]["iteration"]["name"]
+    )
+    full_meta["file"]["checksum_md5"] = md5
+    full_meta["fmu"]["aggregation"]["id"] = uuid_from_string(md5)
+    full_meta["fmu"]["aggregation"]["operation"] = operation
+    if frequency is not None:
+        full_meta["fmu"]["aggregation"]["frequency"] = frequency
+    full_meta["data"]["format"] = "arrow"
+    full_meta["data"]["spec"]["columns"] = table.column_names
+    if operation == "collection":
+        full_meta["data"]["table_index"].append("REAL")
+    full_meta["display"]["name"] = name
+    full_meta["file"]["relative_path"] = unique_name
+    size = sys.getsizeof(json.dumps(full_meta)) / (1024 * 1024)
+    logger.info("Size of meta dict: %.2e\n", size)
+    logger.debug("Metadata %s", full_meta)
+    logger.debug("Object %s ready for launch", unique_name)
+    return byte_string, full_meta
+
+
+def table_to_bytes(table: pa.Table):
+    """Return table as bytestring
+
+    Args:
+        table (pa.Table): the table to be converted
+
+    Returns:
+        bytes: table as bytestring
+    """
+    with metrics.measure("serialize") as sample:
+        sink = pa.BufferOutputStream()
+        pq.write_table(table, sink)
+        byte_string = sink.getvalue().to_pybytes()
+        sample.bytes_in = table.nbytes
+        sample.bytes_out = len(byte_string)
+        sample.objects = 1
+    return byte_string
+
+
+def cast_correctly(table):
+    """Cast table with correct datypes
+
+    Args:
+        table (pa.Table): the table to modify
+
+    Returns:
+        pa.Table: table corrected
+    """
+    scheme = []
+    standards = {"DATE": pa.timestamp("ms"), "REAL": pa.uint16()}
+    for col_scheme in table.schema:
+        column_name = col_scheme.name
+        if col_scheme.type == pa.string():
+            scheme.append((column_name, pa.string()))
+        else:
+            scheme.append((column_name, standards.get(column_name, pa.float32())))
+    return table.cast(pa.schema(scheme))
+
+
+def upload_table(
+    sumo: SumoClient,
+    parent_id: str,
+    table: pa.Table,
+    name: str,
+    meta: dict,
+    operation,
+    frequency=None,
+):
+    """Upload single table
+
+    Args:
+        sumo (SumoClient): client with given environment
+        parent_id (str): the parent id of the object
+        table (pa.Table): the object to upload
+        name (str): name to fill the data.name tag
+        meta (dict): meta stub to pass on to completion of metadata
+        operation (str): operation type
+        frequency (str, optional): frequency of resampled results
+
+    Returns:
+        bool: True if both metadata and blob were uploaded
+    """
+    # sumo = check_or_refresh_token(sumo)
+    logger = init_logging(__name__ + ".upload_table")
+    logger.debug("Uploading %s-%s", name, operation)
+    logger.debug("Columns in table %s", table.column_names)
+    logger.debug("Uploading to parent with id %s", parent_id)
+    logger.debug(
+        "At upload table %s has following metadata %s",
+        name,
+        table.schema.field(name).metadata,
+    )
+    byte_string, meta = prepare_object_launch(meta, table, name, operation, frequency)
+    logger.debug("operation from meta %s", meta["fmu"]["aggregation"])
+    logger.debug("cols from meta %s", meta["data"]["spec"]["columns"])
+    path = f"/objects('{parent_id}')"
+    rsp_code = "0"
+    success_response = (200, 201)
+    with limits.slot("upload"):
+        with metrics.measure("metadata_post") as sample:
+            response = sumo.post(path=path, json=meta)
+            sample.objects = 1
+        meta_rsp_code = response.status_code
+        logger.info("response meta: %s", meta_rsp_code)
+        logger.info("Response type %s", type(meta_rsp_code))
+        if meta_rsp_code in success_response:
+            blob_url = response.json().get("blob_url")
+            with metrics.measure("blob_upload") as sample:
+                response = sumo.blob_client.upload_blob(blob=byte_string, url=blob_url)
+                sample.bytes_out = len(byte_string)
+                sample.objects = 1
+            rsp_code = response.status_code
+            logger.info("Response blob %s", rsp_code)
+            logger.info("Uploaded byte string with size %s", len(byte_string))
+            logger.info("uploaded %s", meta["file"]["relative_path"])
+        else:
+            logger.error(
+                "Cannot upload blob since no meta upload, response was %s",
+                meta_rsp_code,
+            )
+    return rsp_code in success_response
+
+
+def upload_collection(
+    sumo: SumoClient,
+    parent_id: str,
+    table: Union[pa.Table, RealizationTables],
+    columns: list,
+    name: str,
+    meta: dict,
+):
+    """Upload collection of one vector
+
+    From realization tables the collection is gathered just before upload,
+    and the vector released from them after
+
+    Args:
+        sumo (SumoClient): client with given environment
+        parent_id (str): the parent id of the object
+        table (pa.Table, RealizationTables): the aggregated table
+        columns (list): columns of collection, index, REAL and the vector
+        name (str): name of the vector
+        meta (dict): meta stub to pass on to completion of metadata
+    """
+    if isinstance(table, RealizationTables):
+        upload_table(sumo, parent_id, table.gather(columns), name, meta, "collection")
+        table.release([name])
+    else:
+        upload_table(sumo, parent_id, table.select(columns), name, meta, "collection")
+
+
+def upload_stats(
+    sumo: SumoClient, parent_id: str, stat_input: list, meta: dict, loop, executor
+):
+    """Generate set of coroutine tasks for uploads
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        parent_id (str): sumo id of parent object
+        stat_input (list): list of tuples with name of table, and table
+        meta (dict): metadata stub
+        loop (ayncio.event_loog): Event loop to run coroutines
+        executor (ThreadPoolExecutor): Executor for event loop
+
+    Returns:
+        list: list of coroutines
+    """
+    logger = init_logging(__name__ + ".upload_stats")
+    tasks = []
+    logger.debug("%s tables to upload", len(stat_input))
+
+    for item in stat_input:
+        operation, table = item
+        try:
+            name = table.column_names.pop()
+            tasks.append(
+                call_parallel(
+                    loop,
+                    executor,
+                    upload_table,
+                    sumo,
+                    parent_id,
+                    table,
+                    name,
+                    meta,
+                    operation,
+                )
+            )
+        except IndexError:
+            logger.warning("Nothing to add, empty list!")
+    logger.debug("Adding %i tasks", len(tasks))
+    return tasks
+
+
+async def upload_statistics(
+    sumo: SumoClient,
+    parent_id: str,
+    table: pa.Table,
+    table_index: list,
+    meta_stub: dict,
+    loop,
+    executor,
+    aggfuncs: Union[str, list] = "standards",
+    mode: str = "exact",
+    sketch: EnsembleSketch = None,
+    release=None,
+):
+    """Make statistics outside the event loop, then upload them
+
+    The statistics are made in the default executor of the loop,
+    the uploads go through the same executor as the other uploads
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        parent_id (str): object id of parent object
+        table (pa.Table, RealizationTables): The aggregated table
+        table_index (list): the columns in the table defining the index
+        meta_stub (dict): metadata stub for generating metadata for all results
+        loop (asyncio.event_loop): event loop to be used for upload
+        executor (ThreadpoolExecutor): Executor for uploads
+        aggfuncs (str, list): names of statistics, defaults to "standards"
+        mode (str): "exact" or "sketch", see make_stat_aggregations
+        sketch (EnsembleSketch, optional): sketch filled while fetching
+        release (Callable, optional): called with vectors no longer needed,
+                                      e.g. RealizationTables.release
+    """
+    logger = init_logging(__name__ + ".upload_statistics")
+    stat_input = await call_parallel(
+        loop,
+        None,
+        aggregations.make_stat_aggregations,
+        table,
+        table_index,
+        aggfuncs,
+        mode,
+        None,
+        sketch,
+        release,
+    )
+    tasks = upload_stats(sumo, parent_id, stat_input, meta_stub, loop, executor)
+    logger.debug("Submitting: %s statistics", len(tasks))
+    await asyncio.gather(*tasks)
+
+
+async def upload_resampled(
+    sumo: SumoClient,
+    parent_id: str,
+    table: pa.Table,
+    table_index: list,
+    meta_stub: dict,
+    loop,
+    executor,
+    frequencies: tuple,
+    aggfuncs: Union[str, list, None] = "standards",
+    release=None,
+):
+    """Make resampled collections and statistics outside the event loop, then upload
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        parent_id (str): object id of parent object
+        table (pa.Table, RealizationTables): The aggregated table
+        table_index (list): the columns in the table defining the index
+        meta_stub (dict): metadata stub for generating metadata for all results
+        loop (asyncio.event_loop): event loop to be used for upload
+        executor (ThreadpoolExecutor): Executor for uploads
+        frequencies (tuple): frequencies, see matrix.FREQUENCIES
+        aggfuncs (str, list, None): statistics to make, None for no statistics
+        release (Callable, optional): called with vectors no longer needed,
+                                      e.g. RealizationTables.release
+    """
+    logger = init_logging(__name__ + ".upload_resampled")
+    resampled_input = await call_parallel(
+        loop,
+        None,
+        aggregations.make_resampled_aggregations,
+        table,
+        table_index,
+        frequencies,
+        aggfuncs,
+        release,
+    )
+    logger.debug("Submitting: %s resampled results", len(resampled_input))
+    await asyncio.gather(
+        *[
+            call_parallel(
+                loop,
+                executor,
+                upload_table,
+                sumo,
+                parent_id,
+                resampled_table,
+                resampled_table.column_names[-1],
+                meta_stub,
+                operation,
+                frequency,
+            )
+            for operation, resampled_table, frequency in resampled_input
+        ]
+    )
+
+
+async def extract_and_upload(
+    sumo: SumoClient,
+    parent_id: str,
+    table: Union[pa.Table, RealizationTables],
+    table_index: list,
+    meta_stub: dict,
+    loop,
+    executor,
+    aggfuncs: Union[str, list, None] = "standards",
+    stats_mode: str = "exact",
+    frequencies: tuple = (),
+    index: bool = True,
+    sketch: EnsembleSketch = None,
+):
+    """Split pa.Table into seperate parts, and upload them with statistics
+
+    Statistics are made while the collections are uploaded,
+    and uploaded as soon as they are ready. From realization tables, see
+    gather.RealizationTables, each collection is gathered when uploaded,
+    and statistics and resampling gather a block of vectors at the time.
+    A vector is dropped once the collection, the statistics and the
+    resampling have all released it
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        parent_id (str): object id of parent object
+        table (pa.Table, RealizationTables): The table to split
+        table_index (list): the columns in the table defining the index
+        meta_stub (dict): metadata stub for generating metadata for all split results
+        loop (asyncio.event_loop): event loop to be used for upload
+        executor (ThreadpoolExecutor): Executor for event loop
+        aggfuncs (str, list, None): statistics to make, None for no statistics,
+                                    defaults to "standards"
+        stats_mode (str): "exact" or "sketch", see make_stat_aggregations
+        frequencies (tuple): frequencies to also upload resampled collections
+                             and statistics for, e.g. ("monthly", "yearly"),
+                             defaults to none
+        index (bool): upload index objects, see generate_table_index_values,
+                      False for later segments of table, defaults to True
+        sketch (EnsembleSketch, optional): sketch filled while fetching, for
+                                           statistics in sketch mode, see
+                                           aggregations.segment_sketch
+    """
+    logger = init_logging(__name__ + ".extract_and_upload")
+    logger.debug(
+        "Opening the show with a table consisting of columns %s", table.column_names
+    )
+    count = 0
+    neccessaries = table_index + ["REAL"]
+    unneccessaries = ["YEARS", "SECONDS", "ENSEMBLE"]
+    logger.debug("This is the index to keep %s", neccessaries)
+    # task scheduler
+    tasks = []
+    release = None
+    if isinstance(table, RealizationTables):
+        table.share(1 + (aggfuncs is not None) + bool(frequencies))
+        release = table.release
+    if index:
+        tasks += generate_table_index_values(
+            sumo, parent_id, table, table_index, meta_stub, loop, executor
+        )
+    if aggfuncs is not None:
+        tasks.append(
+            upload_statistics(
+                sumo,
+                parent_id,
+                table,
+                table_index,
+                meta_stub,
+                loop,
+                executor,
+                aggfuncs,
+                stats_mode,
+                sketch,
+                release,
+            )
+        )
+    if frequencies:
+        tasks.append(
+            upload_resampled(
+                sumo,
+                parent_id,
+                table,
+                table_index,
+                meta_stub,
+                loop,
+                executor,
+                frequencies,
+                aggfuncs,
+                release,
+            )
+        )
+    for col_name in table.column_names:
+        if col_name in (neccessaries + unneccessaries):
+            continue
+        logger.debug("Preparing %s", col_name)
+        keep_cols = neccessaries + [col_name]
+        logger.debug("Columns to pass through %s", keep_cols)
+        tasks.append(
+            call_parallel(
+                loop,
+                executor,
+                upload_collection,
+                sumo,
+                parent_id,
+                table,
+                keep_cols,
+                col_name,
+                meta_stub,
+            )
+        )
+
+        count += 1
+
+    logger.debug("Tasks to run %s ", len(tasks))
+    await asyncio.gather(*tasks)
+    logger.debug("%s collections produced", count)
+
+
+def index_key(parent_id: str, meta: dict, name: str, checksum: str) -> tuple:
+    """Make key identifying index object of table by content
+
+    Args:
+        parent_id (str): object id of parent object
+        meta (dict): metadata stub of table
+        name (str): name of index
+        checksum (str): md5 checksum of index object
+
+    Returns:
+        tuple: the key
+    """
+    return (
+        parent_id,
+        meta["data"]["name"],
+        meta["data"]["tagname"],
+        meta["fmu"]["iteration"]["name"],
+        name,
+        checksum,
+    )
+
+
+def forget_uploaded_indexes():
+    """Forget index objects uploaded by this process, see upload_index"""
+    with _INDEX_LOCK:
+        _UPLOADED_INDEXES.clear()
+
+
+def upload_index(
+    sumo: SumoClient, parent_id: str, table: pa.Table, name: str, meta: dict
+):
+    """Upload index object, unless uploaded before for the same table
+
+    Index objects are identified by content, see index_key, and those
+    uploaded successfully by this process are remembered, so segments of a
+    table share them, and failed uploads are tried again. Across jobs the dispatcher gives the index to one job per table,
+    see dispatch.table_jobs.
+
+    Args:
+        sumo (SumoClient): initialized sumo client
+        parent_id (str): object id of parent object
+        table (pa.Table): the index values
+        name (str): name of index
+        meta (dict): metadata stub of table
+    """
+    logger = init_logging(__name__ + ".upload_index")
+    key = index_key(parent_id, meta, name, md5sum(table_to_bytes(table)))
+    with _INDEX_LOCK:
+        uploaded = key in _UPLOADED_INDEXES
+    if uploaded:
+        logger.debug("Index %s of %s already uploaded", name, meta["data"]["name"])
+        metrics.count("index_reused")
+        return
+    if upload_table(sumo, parent_id, table, name, meta, "index"):
+        with _INDEX_LOCK:
+            _UPLOADED_INDEXES.add(key)
+    else:
+        logger.warning("Index %s of %s not uploaded", name, meta["data"]["name"])
+
+
+def realization_index(table: Union[pa.Table, RealizationTables], index: str):
+    """Return unique values of index column, from the index column only
+
+    For realization tables the unique values of each realization are
+    united, without gathering the column of the whole aggregation
+
+    Args:
+        table (pa.Table, RealizationTables): the aggregated table
+        index (str): name of index column
+
+    Returns:
+        pa.Table: table with the unique values of the index column
+    """
+    if isinstance(table, RealizationTables):
+        uniques = [pc.unique(column) for column in table.column(index).chunks]
+        column = pa.chunked_array(uniques, type=table.schema.field(index).type)
+    else:
+        column = table[index]
+    return pa.Table.from_arrays([pc.unique(column)], names=[index])
+
+
+def generate_table_index_values(
+    sumo,
+    parent_id,
+    table,
+    table_index,
+    meta_stub,
+    loop,
+    executor,
+):
+    """Que table_index values
+
+    The values are read from the index columns only, see realization_index,
+    and each index object is uploaded once per table, see upload_index
+
+    Args:
+        sumo (SumoClient): initialized sumo Client
+        parent_id (str): object id of parent object
+        table (pa.Table, RealizationTables): Table to derive indexes from
+        table_index (list)): list of indexes
+        meta_stub (dic): a metadata stub to be used for generating final meta
+        loop (asyncio.event_loop): event loop to be used for upload
+        executor (ThreadpoolExecutor): Executor for event loop
+
+    Returns:
+        list: tasks queued
+    """
+    index_tasks = []
+    for index in table_index:
+        ind_table = realization_index(table, index)
+        index_tasks.append(
+            call_parallel(
+                loop,
+                executor,
+                upload_index,
+                sumo,
+                parent_id,
+                ind_table,
+                index,
+                meta_stub,
+            )
+        )
+    return index_tasks
@@ -154,8 +154,11 @@ def fixture_aggregation(ids_and_friends, sumo):
         _type_: _description_
     """
     ids = ids_and_friends[1]
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(ut.aggregate_arrow(ids, sumo, loop))
+
+    async def aggregate():
+        return await ut.aggregate_arrow(ids, sumo, asyncio.get_running_loop())
+
+    return asyncio.run(aggregate())
 
 
 @pytest.fixture(name="do_upload", scope="function")
@@ -168,19 +171,19 @@ def fixture_upload():
 
     # Run upload
     def da_func(client, ids, agg_table):
-        executor = ThreadPoolExecutor()
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(
-            ut.extract_and_upload(
-                client,
-                ids[0],
-                agg_table,
-                ["DATE"],
-                ids[2],
-                loop,
-                executor,
-            )
-        )
+        async def upload():
+            with ThreadPoolExecutor() as executor:
+                await ut.extract_and_upload(
+                    client,
+                    ids[0],
+                    agg_table,
+                    ["DATE"],
+                    ids[2],
+                    asyncio.get_running_loop(),
+                    executor,
+                )
+
+        asyncio.run(upload())
 
     return da_func
 
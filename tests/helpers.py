@@ -0,0 +1,28 @@
+"""Helpers shared by the tests that run without a sumo environment"""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+
+def make_long_table(nr_reals=5, nr_dates=4, seed=0):
+    """Make table with DATE, REAL and two vectors, with a hole in real 0
+
+    Returns:
+        pa.Table: the table
+    """
+    rng = np.random.default_rng(seed)
+    dates = np.arange(
+        np.datetime64("2020-01-01"), np.datetime64("2020-01-01") + nr_dates
+    ).astype("datetime64[ms]")
+    frame = pd.DataFrame(
+        {
+            "DATE": np.tile(dates, nr_reals),
+            "REAL": np.repeat(np.arange(nr_reals, dtype=np.int16), nr_dates),
+            "FOPT": rng.random(nr_reals * nr_dates).astype(np.float32),
+            "FOPR": rng.random(nr_reals * nr_dates),
+        }
+    )
+    frame.loc[0, "FOPR"] = np.nan
+    # Realization 0 does not have the last date
+    frame = frame.drop(index=nr_dates - 1)
+    return pa.Table.from_pandas(frame, preserve_index=False)
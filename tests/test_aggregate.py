@@ -0,0 +1,111 @@
+"""Tests module aggregate.py"""
+import asyncio
+from sumo.table_aggregation import aggregate, limits
+
+
+class FakeAggregator:
+    """Aggregator that sleeps on the loop, or fails when told to"""
+
+    running = 0
+    most_running = 0
+
+    def __init__(self, name: str):
+        """Set name
+
+        Args:
+            name (str): name of table, broken fails
+        """
+        self.name = name
+        self.loop = None
+
+    def estimate_cost(self) -> float:
+        """Return estimated seconds"""
+        return 1.0
+
+    def estimate_memory(self) -> int:
+        """Return estimated peak memory"""
+        return 10
+
+    async def arun(self, cancelled=None):
+        """Run table on the running loop"""
+        self.loop = asyncio.get_running_loop()
+        FakeAggregator.running += 1
+        FakeAggregator.most_running = max(
+            FakeAggregator.most_running, FakeAggregator.running
+        )
+        try:
+            await asyncio.sleep(0.02)
+            if self.name == "broken":
+                raise ValueError("Broken table")
+        finally:
+            FakeAggregator.running -= 1
+
+
+class FakeRunner(aggregate.AggregationRunner):
+    """Runner discovering fake aggregators, by name of table"""
+
+    names = ()
+
+    def combinations(self) -> list:
+        """Return one combination per name"""
+        return [("iter-0", name, "tag") for name in self.names]
+
+    def discover(self, combinations: list) -> tuple:
+        """Make fake aggregators, kept as attribute aggregators"""
+        self.aggregators = {
+            combination: FakeAggregator(combination[1]) for combination in combinations
+        }
+        return dict(self.aggregators), []
+
+
+def make_runner(monkeypatch, exports: list) -> FakeRunner:
+    """Make runner of five tables and a failing one, without sumo
+
+    Args:
+        exports (list): exports of metrics and profile are appended to it
+
+    Returns:
+        FakeRunner: the runner
+    """
+
+    def init_without_sumo(self, case_identifier, env="prod", token=None):
+        self._case_identifier = self._uuid = case_identifier
+        self._sumo = None
+
+    monkeypatch.setattr(aggregate.AggregationBasics, "__init__", init_without_sumo)
+    monkeypatch.setattr(aggregate.metrics, "export", lambda: exports.append("metrics"))
+    monkeypatch.setattr(
+        aggregate.profiling, "export", lambda: exports.append("profile")
+    )
+    runner = FakeRunner("case", max_tables=2, limiter=limits.ResourceLimiter(memory=25))
+    runner.names = [f"table{number}" for number in range(5)] + ["broken"]
+    FakeAggregator.most_running = 0
+    return runner
+
+
+def test_run_exports_once(monkeypatch):
+    """Tables run in threads report failures, metrics are exported once"""
+    exports = []
+    reports = make_runner(monkeypatch, exports).run()
+    failed = [report["name"] for report in reports if report["status"] == "failed"]
+    assert failed == ["broken"], f"Wrong failures {failed}"
+    assert exports == ["metrics", "profile"], f"Not exported once {exports}"
+
+
+def test_arun_on_caller_loop(monkeypatch):
+    """Tables run on the caller's loop, max_tables at the time, export once"""
+    exports = []
+    runner = make_runner(monkeypatch, exports)
+
+    async def run():
+        return asyncio.get_running_loop(), await runner.arun()
+
+    loop, reports = asyncio.run(run())
+    statuses = {report["name"]: report["status"] for report in reports}
+    assert statuses.pop("broken") == "failed", "Failing table not reported"
+    assert set(statuses.values()) == {"ok"}, statuses
+    assert len(statuses) == 5, "Not all tables run"
+    for aggregator in runner.aggregators.values():
+        assert aggregator.loop is loop, f"{aggregator.name} not run on caller loop"
+    assert FakeAggregator.most_running == 2, "Tables not limited to max_tables"
+    assert exports == ["metrics", "profile"], f"Not exported once {exports}"
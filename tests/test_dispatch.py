@@ -1,5 +1,6 @@
 from sumo.wrapper import SumoClient
 from sumo.table_aggregation import dispatch
+from sumo.table_aggregation.registry import RealizationRegistry, as_registry
 from sumo.table_aggregation import utilities as ut
 import pytest
 import logging
@@ -112,3 +113,128 @@ def test_aggregate_and_upload(sumo):
 def test_get_object(sumo):
     table = ut.get_object('8557eacd-ed4f-a80d-d466-467301f22bbd', ["DATE"], sumo)
     # table = ut.get_object('fe7b75c5-9219-548f-476f-46c4535a98e3', ["DATE"], sumo)
+
+
+def test_manifest_round_trip(tmp_path):
+    """Test that table data is stored once, and jobs are resolved when read"""
+    object_ids = {real: f"id-{real}" for real in range(100)}
+    table = {
+        "table": dispatch.table_key("case", "summary", "eclipse", "iter-0"),
+        "uuid": "case",
+        "table_name": "summary",
+        "tag_name": "eclipse",
+        "object_ids": object_ids,
+        "table_index": ["DATE"],
+        "base_meta": {"data": {"spec": {"columns": []}}},
+    }
+    segments = [["DATE", f"V{number}"] for number in range(10)]
+    records = [table] + [
+        {"job": number, "table": table["table"], "columns": columns}
+        for number, columns in enumerate(segments)
+    ]
+    path = tmp_path / "manifest.jsonl.gz"
+    assert dispatch.write_manifest(iter(records), path) == 10, "Wrong nr of jobs"
+    read = list(dispatch.read_manifest(path))
+    assert read[0]["object_ids"] == object_ids, "Object ids differ"
+    assert sum("object_ids" in record for record in read) == 1, "Table stored more than once"
+    tasks = list(dispatch.expand_manifest(read))
+    assert [task["columns"] for task in tasks] == segments, "Wrong columns in tasks"
+    assert json.loads(json.dumps(tasks[0]))["object_ids"] == tasks[0]["object_ids"]
+    assert as_registry(tasks[0]["object_ids"]) == object_ids, "Registry not in json"
+    assert all(task["table_index"] == ["DATE"] for task in tasks), "Table not resolved"
+
+
+def test_balanced_segment_length():
+    """Test that small tables get one job, and large tables even jobs"""
+    columns = [f"V{number}" for number in range(1000)]
+    small = {
+        "data": {"spec": {"columns": columns[:20], "num_rows": 30}},
+        "file": {"size_bytes": 10000},
+    }
+    assert dispatch.balanced_segment_length(small, 100, 60) == 20, "Should be one job"
+    large = {
+        "data": {"spec": {"columns": columns, "num_rows": 10000}},
+        "file": {"size_bytes": 5e6},
+    }
+    length = dispatch.balanced_segment_length(large, 100, 45)
+    segments = ut.split_list(columns, length)
+    costs = [dispatch.estimate_cost(large, 100, len(seg)) for seg in segments]
+    assert len(segments) > 1, "Large table should be split"
+    assert max(costs) <= 45, f"Jobs above target cost {costs}"
+    assert len(segments[-1]) > length / 2, "Last segment should not be a straggler"
+
+
+def test_table_jobs_grouped():
+    """Test that grouped jobs cover the same columns with fewer fetches"""
+    metadata = {
+        "data": {
+            "spec": {"columns": [f"V{nr}" for nr in range(100)], "num_rows": 1000},
+            "table_index": ["DATE"],
+        },
+        "file": {"size_bytes": 1e6},
+    }
+    single = dispatch.table_jobs(metadata, 50, seg_length=10)
+    grouped = dispatch.table_jobs(metadata, 50, seg_length=10, group_segments=True)
+    assert len(single) == 10, "Should be one job per segment"
+    assert [job["index"] for job in single] == [True] + [False] * 9, "Index once"
+    assert len(grouped) == 1, "Segments should be grouped in one job"
+    assert grouped[0]["segments"] == [job["columns"] for job in single]
+    assert grouped[0]["cost"] < sum(job["cost"] for job in single), "Fetch once"
+    target = dispatch.estimate_cost(metadata, 50, 50)
+    packed = dispatch.table_jobs(
+        metadata, 50, seg_length=10, target_cost=target, group_segments=True
+    )
+    assert all(job["cost"] <= target for job in packed), "Jobs above target"
+    assert dispatch.job_segments({"columns": ["A"]}) == [["A"]], "Wrong segments"
+
+
+def test_cost_with_registry(tmp_path):
+    """Test that shared blobs are fetched once in cost, and registry kept in manifest"""
+    metadata = {
+        "data": {"spec": {"columns": ["V0"], "num_rows": 1000}},
+        "file": {"size_bytes": 1e6},
+    }
+    registry = RealizationRegistry(
+        range(10), [f"id{real}" for real in range(10)], ["same"] * 10, [1e6] * 10
+    )
+    plain = dispatch.estimate_cost(metadata, 10, 5)
+    shared = dispatch.estimate_cost(metadata, 10, 5, registry)
+    fetch_once = 9 * 1e6 / dispatch.FETCH_BYTES_PER_SECOND
+    assert abs(plain - shared - fetch_once) < 1e-9, "Shared blob not fetched once"
+    path = tmp_path / "manifest.jsonl.gz"
+    dispatch.write_manifest(iter([{"table": "key", "object_ids": registry}]), path)
+    read = next(dispatch.read_manifest(path))["object_ids"]
+    assert read == registry, "Registry changed in manifest"
+    assert read.nr_unique == 1, "Checksums lost in manifest"
+
+
+def test_hash_ring_stable():
+    """Test that few keys move when adding one shard"""
+    keys = [f"table{nr}" for nr in range(1000)]
+    before = dispatch.HashRing(8)
+    after = dispatch.HashRing(9)
+    moved = sum(before.shard_of(key) != after.shard_of(key) for key in keys)
+    assert moved < 200, f"Too many keys moved: {moved}"
+    assert {before.shard_of(key) for key in keys} == set(range(8)), "Unused shard"
+
+
+def test_shard_records():
+    """Test that shards split tables, and keep jobs with their table"""
+    records = []
+    for nr in range(20):
+        key = f"key{nr}"
+        records.append(
+            {
+                "table": key,
+                "table_name": f"table{nr}",
+                "tag_name": "tag",
+                "object_ids": {"0": f"id{nr}"},
+            }
+        )
+        records += [{"job": nr * 2 + seg, "table": key} for seg in range(2)]
+    shards = [list(dispatch.shard_records(records, shard, 3)) for shard in range(3)]
+    assert sum(len(shard) for shard in shards) == len(records), "Records lost"
+    for shard in shards:
+        tables = {record["table"] for record in shard if not dispatch.is_job(record)}
+        jobs = {record["table"] for record in shard if dispatch.is_job(record)}
+        assert jobs == tables, "Jobs separated from their table"
@@ -0,0 +1,78 @@
+"""Tests module executor.py"""
+import os
+from time import sleep
+from sumo.table_aggregation import executor
+
+
+def fake_job(dispatch_info, env, token):
+    """Job that sleeps, or fails or kills its worker when told to
+
+    Args:
+        dispatch_info (dict): dispatch info for job
+        env (str): name of sumo environment
+        token (str): authentication token
+    """
+    if dispatch_info["table_name"] == "broken":
+        raise ValueError("Broken table")
+    if dispatch_info["table_name"] == "crash":
+        os._exit(1)
+    sleep(0.05)
+    cache = os.environ.get(executor.BLOB_CACHE)
+    with open(os.path.join(cache, dispatch_info["table_name"]), "w") as stream:
+        stream.write(env)
+
+
+def make_dispatch_info(table_name, nr_reals=10, nr_cols=5, rows=100):
+    """Make dispatch info for one job
+
+    Returns:
+        dict: the dispatch info
+    """
+    return {
+        "table_name": table_name,
+        "tag_name": "tag",
+        "object_ids": {str(real): f"id-{real}" for real in range(nr_reals)},
+        "columns": [f"V{col}" for col in range(nr_cols)],
+        "base_meta": {"data": {"spec": {"num_rows": rows}}},
+    }
+
+
+def test_estimate_job_memory():
+    """Test that memory estimate scales with realizations"""
+    small = executor.estimate_job_memory(make_dispatch_info("a", nr_reals=10))
+    large = executor.estimate_job_memory(make_dispatch_info("a", nr_reals=20))
+    assert large == 2 * small, "Estimate should scale with realizations"
+
+
+def test_local_executor(tmp_path):
+    """Test running jobs, with failure and memory limit below one job"""
+    infos = [make_dispatch_info(f"table{nr}") for nr in range(4)]
+    infos.append(make_dispatch_info("broken"))
+    limit = executor.estimate_job_memory(infos[0]) - 1
+    runner = executor.LocalExecutor(
+        "test", workers=2, memory_limit=limit, cache_dir=str(tmp_path), job=fake_job
+    )
+    report = runner.run(infos)
+    assert report["succeeded"] == 4, f"Wrong nr of succeeded jobs {report}"
+    assert report["failed"] == [4], "Last job should fail"
+    assert "Broken table" in report["jobs"][4]["error"], "Error not reported"
+    assert [job["job"] for job in report["jobs"]] == list(range(5)), "Not sorted"
+    assert report["seconds"] >= report["job_seconds"], "Jobs above limit run alone"
+    assert sorted(os.listdir(tmp_path)) == [f"table{nr}" for nr in range(4)]
+    executor.write_report(report, tmp_path / "report.json")
+
+
+def test_local_executor_worker_dies(tmp_path):
+    """Test that job killing its worker fails, and the other jobs still run"""
+    infos = [make_dispatch_info(f"table{nr}") for nr in range(4)]
+    infos.insert(2, make_dispatch_info("crash"))
+    # Limit below one job, so the jobs run one at the time
+    limit = executor.estimate_job_memory(infos[0]) - 1
+    runner = executor.LocalExecutor(
+        "test", workers=2, memory_limit=limit, cache_dir=str(tmp_path), job=fake_job
+    )
+    report = runner.run(infos)
+    assert report["failed"] == [2], f"Only crashing job should fail {report}"
+    assert "BrokenProcessPool" in report["jobs"][2]["error"], "Crash not reported"
+    assert report["jobs"][2]["seconds"] >= 0, "Failed job not timed"
+    assert sorted(os.listdir(tmp_path)) == [f"table{nr}" for nr in range(4)]
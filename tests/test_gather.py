@@ -0,0 +1,65 @@
+"""Tests module gather.py"""
+import pytest
+import pyarrow as pa
+from sumo.table_aggregation.gather import RealizationTables
+
+
+def make_table(real, columns=("DATE", "V", "W"), rows=4):
+    """Make realization table
+
+    Returns:
+        pa.Table: the table
+    """
+    table = pa.table(
+        {name: [float(row + real) for row in range(rows)] for name in columns}
+    )
+    return table.add_column(0, "REAL", pa.array([real] * rows, pa.int16()))
+
+
+def test_gather_equals_concat():
+    """Test that gathered columns equal those of concatenated table"""
+    tables = [
+        make_table(0),
+        make_table(1, columns=("DATE", "V")),
+        make_table(2).set_column(3, "W", pa.nulls(4)),
+        pa.table([]),
+    ]
+    realizations = RealizationTables(tables)
+    concatenated = pa.concat_tables(tables, promote_options="default")
+    assert realizations.column_names == concatenated.column_names
+    assert realizations.num_rows == concatenated.num_rows
+    for name in concatenated.column_names:
+        gathered = realizations.gather(["DATE", "REAL", name])
+        expected = concatenated.select(["DATE", "REAL", name])
+        assert gathered.equals(expected), f"{name} differs from concatenation"
+    assert realizations.to_table().equals(concatenated)
+
+
+def test_gather_zero_copy_and_release():
+    """Test that gathering shares buffers, and that release frees columns"""
+    tables = [make_table(real, rows=1000) for real in range(3)]
+    realizations = RealizationTables(tables)
+    gathered = realizations.column("V")
+    assert gathered.num_chunks == 3, "Should be one chunk per realization"
+    for chunk, table in zip(gathered.chunks, tables):
+        original = table["V"].chunk(0).buffers()[1]
+        assert chunk.buffers()[1].address == original.address, "Column copied"
+    before = realizations.nbytes
+    realizations.release(["V", "unknown"])
+    assert realizations.nbytes == before - 3 * 1000 * 8, "Column not released"
+    assert realizations.gather(["REAL", "W"]).num_rows == 3000
+
+
+def test_shared_release():
+    """Test that shared columns are dropped when released by all users"""
+    realizations = RealizationTables([make_table(real) for real in range(2)])
+    realizations.share(2)
+    assert realizations.select(["V"]).equals(realizations.gather(["V"]))
+    assert realizations.schema.names == realizations.column_names
+    realizations.release(["V", "W"])
+    assert "V" in realizations.gather(["V"]).column_names, "Dropped by first user"
+    before = realizations.nbytes
+    realizations.release(["V"])
+    assert realizations.nbytes == before - 2 * 4 * 8, "Not dropped by last user"
+    with pytest.raises(KeyError):
+        realizations.gather(["DATE", "V"])
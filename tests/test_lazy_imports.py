@@ -0,0 +1,45 @@
+"""Tests that importing the package does not load the heavy dependencies"""
+import sys
+import json
+import subprocess
+import sumo.table_aggregation
+
+HEAVY = ("pandas", "pyarrow", "numpy", "psutil", "sumo.wrapper", "httpx")
+
+
+def loaded_after(code: str) -> list:
+    """Run code in fresh interpreter, return heavy modules loaded by it"""
+    probe = f"import sys, json\n{code}\nprint(json.dumps(sorted(sys.modules)))"
+    output = subprocess.run(
+        [sys.executable, "-c", probe],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    modules = json.loads(output.splitlines()[-1])
+    return [name for name in HEAVY if name in modules]
+
+
+def test_import_package():
+    """Test that the package and the dispatch modules import nothing heavy"""
+    for module in (
+        "sumo.table_aggregation",
+        "sumo.table_aggregation.utilities",
+        "sumo.table_aggregation.dispatch",
+        "sumo.table_aggregation.executor",
+        "sumo.table_aggregation.aggregate",
+    ):
+        heavy = loaded_after(f"import {module}")
+        assert not heavy, f"import {module} loaded {heavy}"
+
+
+def test_public_names():
+    """Test that public names are imported on first use"""
+    assert sorted(sumo.table_aggregation.__all__) == sorted(
+        ["AggregationRunner", "TableAggregator", "query_for_name_and_tags"]
+    )
+    for name in sumo.table_aggregation.__all__:
+        assert callable(getattr(sumo.table_aggregation, name)), f"{name} missing"
+    heavy = loaded_after("from sumo.table_aggregation import TableAggregator")
+    assert "pandas" not in heavy, "TableAggregator should not need pandas"
+
@@ -0,0 +1,101 @@
+"""Tests module limits.py"""
+import asyncio
+import threading
+from time import sleep
+from concurrent.futures import ThreadPoolExecutor
+from sumo.table_aggregation import limits
+
+
+def run_concurrently(func, nr_tasks=8):
+    """Run func in threads, and return max number of concurrent calls
+
+    Args:
+        func (callable): function taking a callable to run while holding resource
+        nr_tasks (int): number of tasks
+
+    Returns:
+        int: max concurrent calls
+    """
+    lock = threading.Lock()
+    state = {"running": 0, "max": 0}
+
+    def work():
+        with lock:
+            state["running"] += 1
+            state["max"] = max(state["max"], state["running"])
+        sleep(0.02)
+        with lock:
+            state["running"] -= 1
+
+    with ThreadPoolExecutor(nr_tasks) as executor:
+        list(executor.map(lambda _: func(work), range(nr_tasks)))
+    return state["max"]
+
+
+def test_slot_limit():
+    """Test that slots limit concurrent work, and no limit lets all through"""
+    limiter = limits.ResourceLimiter(downloads=2)
+
+    def hold(work):
+        with limiter.slot("download"):
+            work()
+
+    def free(work):
+        with limiter.slot("upload"):
+            work()
+
+    assert run_concurrently(hold) <= 2, "More downloads than allowed"
+    assert run_concurrently(free) > 2, "Uploads should not be limited"
+
+
+def test_memory_budget():
+    """Test that reservations wait, but a too large one runs alone"""
+    budget = limits.MemoryBudget(100)
+
+    def reserve(work):
+        with budget.reserve(60):
+            work()
+
+    def reserve_large(work):
+        with budget.reserve(500):
+            work()
+
+    assert run_concurrently(reserve) == 1, "Reservations above limit"
+    assert run_concurrently(reserve_large) == 1, "Large reservation not alone"
+    assert budget.reserved == 0, "Reservations not released"
+
+
+def test_memory_budget_async():
+    """Test that async reservations wait without blocking the loop"""
+    budget = limits.MemoryBudget(100)
+    order = []
+
+    async def reserve(name):
+        async with budget.areserve(60):
+            order.append(f"{name} in")
+            await asyncio.sleep(0.05)
+            order.append(f"{name} out")
+
+    async def cancel_waiting():
+        async with budget.areserve(60):
+            waiting = asyncio.ensure_future(reserve("cancelled"))
+            await asyncio.sleep(0.05)
+            waiting.cancel()
+        await asyncio.sleep(0.05)
+
+    async def run_all():
+        await asyncio.gather(reserve("first"), reserve("second"))
+        await cancel_waiting()
+
+    asyncio.run(run_all())
+    assert order == ["first in", "first out", "second in", "second out"], order
+    assert budget.reserved == 0, "Reservations not released"
+
+
+def test_set_limiter():
+    """Test that the process limiter can be replaced and restored"""
+    limiter = limits.ResourceLimiter(cpu=1)
+    previous = limits.set_limiter(limiter)
+    assert limits.get_limiter() is limiter, "Limiter not set"
+    limits.set_limiter(previous)
+    assert limits.get_limiter() is previous, "Limiter not restored"
@@ -0,0 +1,101 @@
+"""Tests module matrix.py"""
+import numpy as np
+import pyarrow as pa
+from sumo.table_aggregation import matrix, stats
+from helpers import make_long_table
+
+
+def make_realizations():
+    """Make three realizations with different dates
+
+    Returns:
+        dict: realization number as key, table as value
+    """
+    dates = np.array(
+        ["2020-01-01", "2020-02-01", "2020-03-01", "2020-04-01"], dtype="datetime64[ms]"
+    )
+    return {
+        0: pa.table({"DATE": dates[:3], "FOPT": [1.0, 2.0, 3.0]}),
+        1: pa.table({"DATE": dates[1:], "FOPT": [2.0, 4.0, 6.0]}),
+        4: pa.table({"DATE": dates[[0, 3]], "FOPT": [0.5, 7.0], "FOPR": [1.0, 2.0]}),
+    }
+
+
+def test_from_realizations_aligns_dates():
+    """Union of dates, NaN where realizations have no values"""
+    ensemble = matrix.EnsembleMatrix.from_realizations(make_realizations(), ["DATE"])
+    assert ensemble.keys.num_rows == 4
+    assert ensemble.reals.tolist() == [0, 1, 4]
+    assert ensemble.vectors == ["FOPT"]
+    np.testing.assert_array_equal(
+        ensemble["FOPT"],
+        [[1.0, np.nan, 0.5], [2.0, 2.0, np.nan], [3.0, 4.0, np.nan], [np.nan, 6.0, 7.0]],
+    )
+    np.testing.assert_array_equal(np.nanmax(ensemble["FOPT"], axis=1), [1, 2, 4, 7])
+
+
+def test_to_table_only_where_present():
+    """Long format has one row per realization and date it had"""
+    realizations = make_realizations()
+    ensemble = matrix.EnsembleMatrix.from_realizations(realizations, ["DATE"])
+    long_table = ensemble.to_table("FOPT")
+    assert long_table.column_names == ["DATE", "REAL", "FOPT"]
+    assert long_table.num_rows == sum(table.num_rows for table in realizations.values())
+    assert long_table.schema.field("FOPT").type == pa.float64()
+
+
+def test_from_table_equals_from_realizations():
+    """Same matrix from long table as from realizations"""
+    table = make_long_table(nr_reals=6)
+    reals = table["REAL"].to_numpy()
+    per_real = {
+        real: table.filter(pa.array(reals == real)).drop_columns(["REAL"])
+        for real in np.unique(reals)
+    }
+    from_table = matrix.EnsembleMatrix.from_table(table, ["DATE"])
+    from_reals = matrix.EnsembleMatrix.from_realizations(per_real, ["DATE"])
+    assert from_table.keys.equals(from_reals.keys)
+    np.testing.assert_array_equal(from_table.values, from_reals.values)
+    assert stats.matrix_statistics(from_table) == stats.matrix_statistics(from_reals)
+
+
+def test_reindex_for_comparison():
+    """Matrices can be aligned and compared elementwise"""
+    ensemble = matrix.EnsembleMatrix.from_realizations(make_realizations(), ["DATE"])
+    subset = matrix.EnsembleMatrix.from_realizations(
+        {1: make_realizations()[1]}, ["DATE"]
+    )
+    aligned = subset.reindex(ensemble.keys, ensemble.reals)
+    assert aligned.values.shape == ensemble.values.shape
+    difference = ensemble["FOPT"] - aligned["FOPT"]
+    assert np.nansum(np.abs(difference)) == 0
+    assert not aligned.present[:, 0].any()
+
+
+def test_resample_monthly():
+    """Last value for totals, average for rates"""
+    dates = np.array(
+        ["2020-01-01", "2020-01-15", "2020-02-01", "2020-02-20"], dtype="datetime64[ms]"
+    )
+    realizations = {
+        0: pa.table({"DATE": dates, "FOPT": [1.0, 2.0, 3.0, 4.0], "FOPR": [1.0, 3.0, 5.0, 7.0]}),
+        1: pa.table({"DATE": dates[:3], "FOPT": [2.0, 3.0, 5.0], "FOPR": [2.0, 2.0, 2.0]}),
+    }
+    ensemble = matrix.EnsembleMatrix.from_realizations(realizations, ["DATE"])
+    monthly = ensemble.resample("monthly")
+    assert monthly.keys["DATE"].to_numpy().astype("datetime64[D]").astype(str).tolist() == [
+        "2020-01-01",
+        "2020-02-01",
+    ]
+    np.testing.assert_array_equal(monthly["FOPT"], [[2.0, 3.0], [4.0, 5.0]])
+    np.testing.assert_array_equal(monthly["FOPR"], [[2.0, 2.0], [6.0, 2.0]])
+    yearly = ensemble.resample("yearly")
+    np.testing.assert_array_equal(yearly["FOPT"], [[4.0, 5.0]])
+
+
+def test_is_cumulative():
+    """Totals by eclipse mnemonic"""
+    assert matrix.is_cumulative("FOPT")
+    assert matrix.is_cumulative("WOPTH:OP_1")
+    assert not matrix.is_cumulative("FOPR")
+    assert not matrix.is_cumulative("WWCT:OP_1")
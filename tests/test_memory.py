@@ -0,0 +1,51 @@
+"""Tests module memory.py"""
+from time import sleep
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from sumo.table_aggregation import memory
+from sumo.table_aggregation import utilities as ut
+
+
+def test_profile_disabled():
+    """Test that nothing is tracked when profiling is off"""
+    memory.disable()
+    with memory.profile("nothing"):
+        pass
+    assert memory.report() is None, "Should have no report when disabled"
+
+
+def test_profile_peak_inside_call(tmp_path):
+    """Test that a peak inside the context is caught, also when freed again"""
+    profiler = memory.enable(interval=0.01, top_allocators=3)
+    try:
+        with memory.profile("table"):
+            with memory.profile("segment"):
+                # Computed arrays are allocated by arrow, not numpy
+                values = pc.multiply(pa.array(np.ones(10_000_000)), 2.0)
+                sleep(0.05)
+                del values
+        report = memory.report()
+    finally:
+        memory.disable()
+    labels = report["labels"]
+    assert labels["segment"]["peak_arrow"] >= 80_000_000, "Missed arrow peak"
+    assert labels["table"]["peak_rss"] >= labels["segment"]["peak_rss"]
+    assert "top_allocators" in labels["segment"], "No tracemalloc results"
+    assert report["arrow_pool"]["max_memory"] >= 80_000_000, "Wrong pool stats"
+    profiler.export(tmp_path / "memory.json")
+
+
+def test_memcount():
+    """Test that memcount labels profiles with function name"""
+    memory.enable(interval=0.01)
+    try:
+
+        @ut.memcount()
+        def make_table():
+            return pa.table({"A": np.arange(1000)})
+
+        assert make_table().num_rows == 1000, "Result not passed on"
+        assert memory.report()["labels"]["make_table"]["count"] == 1
+    finally:
+        memory.disable()
@@ -0,0 +1,48 @@
+"""Tests module metrics.py"""
+import os
+import json
+import pyarrow as pa
+from sumo.table_aggregation import metrics
+from sumo.table_aggregation import utilities as ut
+
+
+def test_measure_and_count():
+    """Test stage durations, bytes, histogram and counters"""
+    recorder = metrics.Metrics()
+    for _ in range(3):
+        with recorder.measure("download") as sample:
+            sample.bytes_in = 10
+            sample.objects = 1
+    recorder.count("cache_hits", 2)
+    recorded = recorder.to_dict()
+    download = recorded["stages"]["download"]
+    assert download["count"] == 3, "Wrong count"
+    assert download["bytes_in"] == 30, "Wrong bytes"
+    assert sum(download["buckets"]) == 3, "Histogram should hold all samples"
+    assert recorded["counters"] == {"cache_hits": 2}, "Wrong counters"
+
+
+def test_export(tmp_path, monkeypatch):
+    """Test export as json and Prometheus textfile"""
+    recorder = metrics.Metrics()
+    with recorder.measure("serialize"):
+        pass
+    assert recorder.export() is None, "Nothing should be written without path"
+    monkeypatch.setenv(metrics.METRICS_PATH, str(tmp_path / "aggregation.prom"))
+    prom_path = tmp_path / f"aggregation-{os.getpid()}.prom"
+    assert recorder.export() == str(prom_path), "File not named by process"
+    text = prom_path.read_text()
+    pid = f'pid="{os.getpid()}"'
+    assert f'sumo_aggregation_stage_seconds_count{{stage="serialize",{pid}}} 1' in text
+    assert 'le="+Inf"} 1' in text, "Missing +Inf bucket"
+    json_path = tmp_path / "aggregation.json"
+    recorder.export(str(json_path))
+    assert json.loads(json_path.read_text())["stages"]["serialize"]["count"] == 1
+
+
+def test_serialize_recorded():
+    """Test that table_to_bytes records the serialize stage"""
+    metrics.METRICS.reset()
+    byte_string = ut.table_to_bytes(pa.table({"A": [1, 2, 3]}))
+    serialize = metrics.METRICS.to_dict()["stages"]["serialize"]
+    assert serialize["bytes_out"] == len(byte_string), "Wrong bytes out"
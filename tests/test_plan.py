@@ -0,0 +1,54 @@
+"""Tests module plan.py"""
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sumo.table_aggregation import plan
+from sumo.table_aggregation import utilities as ut
+
+
+def make_records(nr_reals=10, nr_cols=20, rows=100):
+    """Make manifest records for one table with two jobs
+
+    Returns:
+        list: the records
+    """
+    columns = ["DATE"] + [f"V{nr}" for nr in range(nr_cols - 1)]
+    table = {
+        "table": "key",
+        "table_name": "summary",
+        "tag_name": "eclipse",
+        "object_ids": {str(real): f"id{real}" for real in range(nr_reals)},
+        "table_index": ["DATE"],
+        "base_meta": {
+            "data": {"spec": {"columns": columns, "num_rows": rows}},
+            "file": {"size_bytes": 1000},
+        },
+    }
+    jobs = [
+        {"job": nr, "table": "key", "columns": ["DATE"] + segment, "index": nr == 0}
+        for nr, segment in enumerate(ut.split_list(columns[1:], 10))
+    ]
+    return [table] + jobs
+
+
+def test_explain_records(tmp_path, monkeypatch):
+    """Test report for table with two jobs"""
+    monkeypatch.setenv(plan.BLOB_CACHE, str(tmp_path))
+    report = plan.explain_records(make_records(), ["mean", "p90"])
+    totals = report["totals"]
+    assert totals["jobs"] == 2, "Should be two jobs"
+    assert totals["download_bytes"] == 2 * 10 * 1000, "Every job fetches all blobs"
+    # 19 vectors with collection and two statistics, plus one index for the table
+    assert totals["output_objects"] == 19 * 3 + 1, "Wrong nr of output objects"
+    assert report["tables"][0]["rows_from"] == "metadata"
+    json.dumps(report)
+
+
+def test_explain_records_footer(tmp_path, monkeypatch):
+    """Test that rows are read from cached blobs"""
+    monkeypatch.setenv(plan.BLOB_CACHE, str(tmp_path))
+    pq.write_table(pa.table({"DATE": list(range(7))}), tmp_path / "id0.parquet")
+    report = plan.explain_records(make_records(), None)
+    table = report["tables"][0]
+    assert table["rows_from"] == "footer", "Footer not read"
+    assert table["rows"] == 7, "Wrong rows from footer"
@@ -0,0 +1,104 @@
+"""Tests module profiling.py"""
+import json
+import threading
+from time import perf_counter
+import pyarrow as pa
+from sumo.table_aggregation import profiling
+from sumo.table_aggregation import utilities as ut
+
+
+def busy(seconds):
+    """Keep cpu busy in python for some time"""
+    end = perf_counter() + seconds
+    total = 0
+    while perf_counter() < end:
+        total += 1
+    return total
+
+
+def test_disabled_leaves_functions_alone():
+    """Test that nothing is wrapped or exported when profiling is off"""
+    originals = [getattr(ut, name) for _, name in profiling.HOOKS]
+    profiler = profiling.enable("unused")
+    wrapped = [getattr(ut, name) for _, name in profiling.HOOKS]
+    profiling.disable()
+    restored = [getattr(ut, name) for _, name in profiling.HOOKS]
+    assert profiler is not None
+    for original, wrapper in zip(originals, wrapped):
+        assert wrapper.__wrapped__ is original, f"{original.__name__} not wrapped"
+    assert restored == originals, "Functions not restored when disabled"
+    assert profiling.export() is None, "Should not export when disabled"
+    assert isinstance(profiling.table("x"), type(profiling.profile("x")))
+
+
+def unrelated(seconds):
+    """Keep cpu busy outside any profiled table"""
+    return busy(seconds)
+
+
+def test_stage_profile(tmp_path):
+    """Test that stages are labelled with table, and samples of its threads kept"""
+    profiling.enable(str(tmp_path), interval=0.002, top=5)
+    try:
+        # Large enough for the sampler to catch the stage
+        table = pa.table(
+            {
+                "DATE": [date for date in range(100) for _ in range(2000)],
+                "REAL": list(range(2000)) * 100,
+                "V": [1.0] * 200000,
+            }
+        )
+        other = threading.Thread(target=unrelated, args=(0.3,))
+        other.start()
+        with profiling.table("summary--eclipse"):
+            worker = threading.Thread(target=profiling.carried(busy), args=(0.2,))
+            worker.start()
+            ut.make_stat_aggregations(table, ["DATE"], ["mean", "p90"])
+            worker.join()
+        other.join()
+        report = profiling.get_profiler().report()
+        paths = profiling.export()
+    finally:
+        profiling.disable()
+    assert "summary--eclipse" in report, "Table label missing"
+    assert "summary--eclipse/make_stat_aggregations" in report, "Stage label missing"
+    functions = [entry["function"] for entry in report["summary--eclipse"]["top"]]
+    assert any(name.startswith("busy ") for name in functions), "Thread not sampled"
+    assert len(report["summary--eclipse"]["top"]) <= 5, "Top not limited"
+    with open(paths[0], encoding="utf-8") as stream:
+        lines = stream.read().splitlines()
+    assert lines, "No collapsed stacks written"
+    assert not any("unrelated " in line for line in lines), "Other thread sampled"
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert stack.startswith("summary--eclipse;"), f"Label not root in {line}"
+        assert int(count) > 0
+    with open(paths[1], encoding="utf-8") as stream:
+        assert json.load(stream).keys() == report.keys(), "Top summary differs"
+
+
+def test_tables_in_threads_kept_apart(tmp_path):
+    """Test that tables run at the same time only get their own samples"""
+    profiling.enable(str(tmp_path), interval=0.002)
+
+    def run_table(label, func):
+        with profiling.table(label):
+            func(0.2)
+
+    try:
+        threads = [
+            threading.Thread(target=run_table, args=("first", busy)),
+            threading.Thread(target=run_table, args=("second", unrelated)),
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        collapsed = profiling.get_profiler().collapsed()
+    finally:
+        profiling.disable()
+    first = [line for line in collapsed.splitlines() if line.startswith("first;")]
+    second = [line for line in collapsed.splitlines() if line.startswith("second;")]
+    assert first and second, "Tables not sampled"
+    assert not any("unrelated " in line for line in first), "Samples of other table"
+    assert any("unrelated " in line for line in second), "Own samples missing"
@@ -0,0 +1,82 @@
+"""Tests module registry.py"""
+import json
+import numpy as np
+import pytest
+from sumo.table_aggregation.registry import RealizationRegistry, as_registry
+
+
+def make_hit(real, checksum=None, size_bytes=100, rows=10, columns=2):
+    """Make search hit of realization object
+
+    Returns:
+        dict: the hit
+    """
+    return {
+        "_id": f"id{real}",
+        "_source": {
+            "fmu": {"realization": {"id": real}},
+            "file": {"checksum_md5": checksum, "size_bytes": size_bytes},
+            "data": {"spec": {"num_rows": rows, "num_columns": columns}},
+        },
+    }
+
+
+def test_from_hits():
+    """Test that fields are read from hits, sorted by real"""
+    registry = RealizationRegistry.from_hits(
+        [make_hit(3, "a"), make_hit(1, "b", rows=20), make_hit(2, columns=None)], 2
+    )
+    assert registry.reals.tolist() == [1, 2, 3], "Not sorted by real"
+    assert registry.object_ids.tolist() == ["id1", "id2", "id3"]
+    assert registry.checksums.tolist() == ["b", None, "a"]
+    assert registry.rows.tolist() == [20, 10, 10]
+    assert registry.columns.tolist() == [2, 2, 2], "Columns not given"
+    assert registry.total_rows() == 40
+    assert registry.max_rows() == 20
+    with pytest.raises(ValueError):
+        registry.reals[0] = 5
+
+
+def test_mapping():
+    """Test that registry works as dict of real to object id"""
+    object_ids = {real: f"id{real}" for real in (4, 0, 2)}
+    registry = as_registry({str(real): oid for real, oid in object_ids.items()})
+    assert registry == object_ids, "Not equal to dict"
+    assert dict(registry) == object_ids
+    assert registry[2] == "id2"
+    assert list(registry) == [0, 2, 4], "Should iterate sorted reals"
+    assert registry.lookup([4, 0]).tolist() == ["id4", "id0"]
+    with pytest.raises(KeyError):
+        registry[1]  # pylint: disable=pointless-statement
+    assert 1 not in registry
+    assert as_registry(registry) is registry
+    duplicated = RealizationRegistry([1, 1], ["old", "new"])
+    assert dict(duplicated) == {1: "new"}, "Last duplicate should win"
+
+
+def test_dedup_by_checksum():
+    """Test that realizations with equal checksum are fetched once"""
+    checksums = ["a", "b", "a", None, None, "a"]
+    registry = RealizationRegistry(
+        range(6), [f"id{real}" for real in range(6)], checksums, [100] * 6
+    )
+    assert registry.nr_unique == 4, "Unknown checksums are never equal"
+    groups = registry.fetch_groups()
+    assert [group[0] for group in groups] == ["id0", "id1", "id3", "id4"]
+    assert groups[0][1] == 0, "Should fetch first realization"
+    assert groups[0][2].tolist() == [0, 2, 5], "Wrong realizations of blob"
+    assert registry.fetch_bytes() == 400
+    assert RealizationRegistry(range(2), ["x", "y"]).fetch_bytes(default=7) == 14
+
+
+def test_select_merge_and_json():
+    """Test selections, merges and json round trip"""
+    registry = RealizationRegistry(range(5), [f"id{real}" for real in range(5)])
+    assert list(registry.select([3, 1])) == [1, 3]
+    assert list(registry.select(registry.reals % 2 == 0)) == [0, 2, 4]
+    merged = registry.merge(RealizationRegistry([2, 7], ["new2", "id7"]))
+    assert merged[2] == "new2", "Other registry should win"
+    assert len(merged) == 6
+    copy = as_registry(json.loads(json.dumps(merged.to_json())))
+    assert copy == merged, "Json round trip changed registry"
+    assert isinstance(copy.reals, np.ndarray)
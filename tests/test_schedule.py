@@ -0,0 +1,28 @@
+"""Tests module schedule.py"""
+from sumo.table_aggregation import schedule
+
+
+def test_lpt_schedule():
+    """Test that the large table starts first, and small ones fill the gaps"""
+    costs = {"summary": 100.0, "volumes": 10.0, "rft": 40.0, "pvt": 50.0, "wells": 10.0}
+    plan = schedule.lpt_schedule(costs, 2)
+    assert plan["order"][0] == "summary", "Largest should start first"
+    assert plan["workers"][1] == ["pvt", "rft", "volumes"], "Gaps not filled"
+    assert plan["predicted_makespan"] == 110.0, "Wrong makespan"
+    assert plan["predicted_utilisation"] == 210.0 / 220.0, "Wrong utilisation"
+
+
+def test_order_dispatch_infos():
+    """Test ordering jobs by given cost"""
+    infos = [{"cost": cost} for cost in (1.0, 5.0, 3.0)]
+    ordered, plan = schedule.order_dispatch_infos(infos, 2)
+    assert [info["cost"] for info in ordered] == [5.0, 3.0, 1.0], "Wrong order"
+    assert plan["order"] == [1, 2, 0], "Wrong schedule"
+
+
+def test_achieved_utilisation():
+    """Test utilisation from start and end times"""
+    result = schedule.achieved_utilisation([(0, 10), (0, 5), (5, 10)], 2)
+    assert result["makespan"] == 10, "Wrong makespan"
+    assert result["utilisation"] == 1.0, "Workers were always busy"
+    assert schedule.achieved_utilisation([], 2)["utilisation"] == 0.0
@@ -0,0 +1,126 @@
+"""Tests module sketch.py"""
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+from sumo.table_aggregation import sketch, stats
+from helpers import make_long_table
+
+
+def test_quantile_sketch_error_bound():
+    """Ranks of estimated quantiles are within documented bound"""
+    rng = np.random.default_rng(1)
+    data = rng.normal(size=(4, 20000))
+    quantile_sketch = sketch.QuantileSketch(4, seed=2)
+    for column in data.T:
+        quantile_sketch.update(column)
+    bound = sketch.normalised_rank_error(quantile_sketch.k)
+    for quantile, estimate in zip(
+        (0.1, 0.5, 0.9), quantile_sketch.quantiles((0.1, 0.5, 0.9))
+    ):
+        ranks = (data < estimate[:, np.newaxis]).mean(axis=1)
+        assert (np.abs(ranks - quantile) < bound).all(), f"{quantile}: {ranks}"
+    assert quantile_sketch.retained < 3 * quantile_sketch.k + 100
+
+
+def test_quantile_sketch_serialize_and_merge():
+    """Round trip through bytes, and merge of two halves"""
+    data = np.random.default_rng(3).random((2, 4000))
+    first = sketch.QuantileSketch(2, seed=1)
+    second = sketch.QuantileSketch(2, seed=1)
+    first.update(data[:, :2000])
+    second.update(data[:, 2000:])
+    restored = sketch.QuantileSketch.from_bytes(first.to_bytes())
+    np.testing.assert_array_equal(restored.quantiles([0.5])[0], first.quantiles([0.5])[0])
+    restored.merge(second)
+    assert restored.count == 4000
+    median = restored.quantiles([0.5])[0]
+    ranks = (data < median[:, np.newaxis]).mean(axis=1)
+    assert (np.abs(ranks - 0.5) < sketch.normalised_rank_error()).all()
+
+
+def test_ensemble_sketch_against_exact():
+    """Moments are exact, percentiles within bound"""
+    table = make_long_table(nr_reals=300, nr_dates=6)
+    exact = stats.compute_statistics(table, ["DATE"])
+    approximate = sketch.sketch_table(table, ["DATE"], ["FOPT", "FOPR"]).statistics()
+    for aggname in ("mean", "std", "min", "max"):
+        np.testing.assert_allclose(
+            approximate[aggname]["FOPR"].to_numpy(zero_copy_only=False),
+            exact[aggname]["FOPR"].to_numpy(zero_copy_only=False),
+            rtol=1e-6,
+        )
+    for aggname in ("p10", "p90"):
+        difference = np.abs(
+            approximate[aggname]["FOPT"].to_numpy() - exact[aggname]["FOPT"].to_numpy()
+        )
+        # Uniform values on [0, 1) so value error is close to rank error
+        assert difference.max() < 2 * sketch.normalised_rank_error()
+
+
+def test_ensemble_sketch_merge():
+    """Sketches of different realizations and vectors merge"""
+    table = make_long_table(nr_reals=40, nr_dates=6)
+    first = sketch.sketch_table(
+        table.filter(pc.less(table["REAL"], 20)), ["DATE"], ["FOPT"]
+    )
+    second = sketch.sketch_table(
+        table.filter(pc.greater_equal(table["REAL"], 20)), ["DATE"], ["FOPT", "FOPR"]
+    )
+    merged = sketch.EnsembleSketch.from_bytes(first.to_bytes())
+    merged.merge(second)
+    assert merged.vectors == ["FOPT", "FOPR"]
+    assert merged.nr_realizations == 40
+    np.testing.assert_allclose(
+        merged.statistics(["mean"])["mean"]["FOPT"].to_numpy(),
+        stats.compute_statistics(table, ["DATE"], aggfuncs=["mean"])["mean"][
+            "FOPT"
+        ].to_numpy(),
+        rtol=1e-6,
+    )
+
+
+def test_sketch_realizations_merged_from_threads():
+    """Groups of realization tables sketched apart and merged give same moments"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    table = make_long_table(nr_reals=30, nr_dates=5)
+    reals = [table.filter(pc.equal(table["REAL"], real)) for real in range(30)]
+    # Realization tables without rows, e.g. from failed fetches, are skipped
+    groups = [reals[start : start + 3] for start in range(0, 30, 3)] + [
+        [table.slice(0, 0)]
+    ]
+    merged = sketch.EnsembleSketch(["DATE"], ["FOPT", "FOPR"])
+
+    def add_group(group):
+        merged.merge(sketch.sketch_realizations(group, ["DATE"], merged.vectors))
+
+    with ThreadPoolExecutor(4) as pool:
+        list(pool.map(add_group, groups))
+    whole = sketch.sketch_table(table, ["DATE"], ["FOPT", "FOPR"])
+    assert merged.nr_realizations == whole.nr_realizations == 30
+    for aggname in ("mean", "std", "min", "max"):
+        for vector in ("FOPT", "FOPR"):
+            np.testing.assert_allclose(
+                merged.statistics([aggname])[aggname][vector].to_numpy(),
+                whole.statistics([aggname])[aggname][vector].to_numpy(),
+                rtol=1e-6,
+                err_msg=f"{aggname} of {vector} differs",
+            )
+
+
+def test_ensemble_sketch_schema():
+    """Statistics have the schema of exact ones, empty cells are missing"""
+    table = make_long_table(nr_reals=10, nr_dates=4)
+    first = pc.equal(table["DATE"], table["DATE"][0])
+    fopr = pc.if_else(first, pa.scalar(None, pa.float64()), table["FOPR"])
+    table = table.set_column(table.column_names.index("FOPR"), "FOPR", fopr)
+    exact = stats.compute_statistics(table, ["DATE"], aggfuncs=["mean", "std", "p90"])
+    approximate = sketch.sketch_realizations(
+        [table.filter(pc.equal(table["REAL"], real)) for real in range(10)],
+        ["DATE"],
+        ["FOPT", "FOPR"],
+    )
+    restored = sketch.EnsembleSketch.from_bytes(approximate.to_bytes())
+    for aggname, stat_table in restored.statistics(["mean", "std", "p90"]).items():
+        assert stat_table.schema.equals(exact[aggname].schema), f"{aggname} schema"
+        assert stat_table["FOPR"][0].as_py() is None, f"{aggname} not missing"
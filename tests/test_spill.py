@@ -0,0 +1,56 @@
+"""Tests module spill.py"""
+import os
+import pyarrow as pa
+from sumo.table_aggregation import spill
+
+
+def make_table(real, rows=5, columns=("DATE", "V")):
+    """Make realization table
+
+    Returns:
+        pa.Table: the table
+    """
+    table = pa.table({name: [float(row) for row in range(rows)] for name in columns})
+    return table.add_column(0, "REAL", pa.array([real] * rows, pa.int16()))
+
+
+def test_spill_folder(tmp_path, monkeypatch):
+    """Test that spilling is off unless folder is given or set in environment"""
+    monkeypatch.delenv(spill.SPILL_FOLDER, raising=False)
+    assert spill.spill_folder() is None, "Spilling should be off"
+    monkeypatch.setenv(spill.SPILL_FOLDER, str(tmp_path))
+    assert spill.spill_folder() == str(tmp_path)
+    assert spill.spill_folder("other") == "other", "Argument should win"
+
+
+def test_spill_writer(tmp_path):
+    """Test that spilled table equals concatenation, with missing columns"""
+    missing = make_table(1, columns=("DATE",)).append_column("V", pa.nulls(5))
+    reordered = make_table(2, columns=("V", "DATE"))
+    tables = [missing, make_table(0), reordered, pa.table([])]
+    writer = spill.SpillWriter(str(tmp_path / "spill"), "summary")
+    for table in tables:
+        writer.write(table)
+    assert writer.rows == 15, "Should have written when all types were known"
+    aggregated = writer.close()
+    assert not os.listdir(tmp_path / "spill"), "Spill file not removed"
+    expected = pa.concat_tables(
+        [table.select(["REAL", "DATE", "V"]) for table in tables[1:3]]
+    )
+    assert aggregated.num_rows == 15
+    assert aggregated.schema.field("V").type == pa.float64(), "Null column not cast"
+    assert aggregated.slice(5).select(["REAL", "DATE", "V"]).equals(expected)
+    assert aggregated["V"].slice(0, 5).null_count == 5, "Missing values lost"
+    empty = spill.SpillWriter(str(tmp_path)).close()
+    assert empty.num_columns == 0, "Nothing written should give empty table"
+
+
+def test_spill_writer_null_column(tmp_path):
+    """Test that a column missing in all realizations does not stop spilling"""
+    writer = spill.SpillWriter(str(tmp_path))
+    for real in range(spill.MAX_PENDING):
+        writer.write(make_table(real).append_column("W", pa.nulls(5)))
+    assert writer.rows == 5 * spill.MAX_PENDING, "Tables kept in memory"
+    aggregated = writer.close()
+    assert aggregated.schema.field("W").type == spill.NULL_TYPE
+    assert aggregated["W"].null_count == aggregated.num_rows
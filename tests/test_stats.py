@@ -0,0 +1,195 @@
+"""Tests module stats.py"""
+import numpy as np
+import pyarrow as pa
+import pytest
+from sumo.table_aggregation import stats
+from helpers import make_long_table
+
+
+def test_compute_statistics_against_pandas():
+    """Compare all statistics with pandas groupby"""
+    table = make_long_table()
+    frame = table.to_pandas()
+    results = stats.compute_statistics(
+        table, ["DATE"], aggfuncs=["mean", "min", "max", "std", "p10", "p90"]
+    )
+    grouped = frame.groupby("DATE")
+    answers = {
+        "mean": grouped.mean(),
+        "min": grouped.min(),
+        "max": grouped.max(),
+        "std": grouped.std(),
+        "p10": grouped.quantile(0.1),
+        "p90": grouped.quantile(0.9),
+    }
+    for aggname, answer in answers.items():
+        result = results[aggname].to_pandas().set_index("DATE")
+        for col_name in ("FOPT", "FOPR"):
+            np.testing.assert_allclose(
+                result[col_name].values,
+                answer[col_name].values,
+                rtol=1e-6,
+                err_msg=f"{aggname} of {col_name} is wrong",
+            )
+
+
+def test_p10_below_p90():
+    """p10 is the 10th percentile, not the 90th"""
+    table = make_long_table(nr_reals=50)
+    results = stats.compute_statistics(table, ["DATE"], aggfuncs=["p10", "p90"])
+    p10 = results["p10"]["FOPT"].to_numpy()
+    p90 = results["p90"]["FOPT"].to_numpy()
+    assert (p10 < p90).all(), "p10 should be smaller than p90"
+
+
+def test_compute_statistics_multiple_index():
+    """Group over two index columns with string keys"""
+    table = pa.table(
+        {
+            "ZONE": ["b", "a", "b", "a", "a"],
+            "REGION": [1, 1, 1, 2, 1],
+            "REAL": [0, 0, 1, 1, 2],
+            "STOIIP": [1.0, 2.0, 3.0, 4.0, 6.0],
+        }
+    )
+    results = stats.compute_statistics(
+        table, ["ZONE", "REGION"], aggfuncs=["mean", "max"]
+    )
+    mean = results["mean"].to_pylist()
+    assert mean == [
+        {"ZONE": "a", "REGION": 1, "STOIIP": 4.0},
+        {"ZONE": "a", "REGION": 2, "STOIIP": 4.0},
+        {"ZONE": "b", "REGION": 1, "STOIIP": 2.0},
+    ], f"Wrong results {mean}"
+
+
+def test_split_statistics():
+    """One table per statistic and vector, with index and vector"""
+    table = make_long_table()
+    split = stats.split_statistics(
+        stats.compute_statistics(table, ["DATE"]), ["DATE"]
+    )
+    assert len(split) == 2 * len(stats.STANDARD_STATS)
+    for aggname, stat_table in split:
+        assert aggname in stats.STANDARD_STATS
+        assert stat_table.column_names[0] == "DATE"
+        assert len(stat_table.column_names) == 2
+
+
+def test_wrong_aggfuncs():
+    """Unknown statistics are rejected"""
+    with pytest.raises(ValueError):
+        stats.check_aggfuncs(["mean", "median"])
+
+
+def test_compute_statistics_shared_with_processes():
+    """Workers attached to the published table give same results"""
+    table = make_long_table(nr_reals=20)
+    serial = stats.compute_statistics(table, ["DATE"])
+    parallel = stats.compute_statistics(table, ["DATE"], processes=2)
+    for aggname, result in serial.items():
+        assert parallel[aggname].equals(result), f"{aggname} differs"
+    assert not stats._ATTACHED, "Table should only be attached in workers"
+
+
+def test_spilled_table_reduced_in_blocks(tmp_path, monkeypatch):
+    """Peak numpy memory for a spilled table is a block, not the whole matrix"""
+    import tracemalloc
+    from sumo.table_aggregation.spill import SpillWriter
+
+    nr_reals, nr_dates, nr_vectors = 20, 100, 400
+    rng = np.random.default_rng(0)
+    writer = SpillWriter(str(tmp_path))
+    for real in range(nr_reals):
+        columns = {"DATE": np.arange(nr_dates), "REAL": np.full(nr_dates, real)}
+        for number in range(nr_vectors):
+            columns[f"V{number}"] = rng.random(nr_dates).astype(np.float32)
+        writer.write(pa.table(columns))
+    table = writer.close()
+    monkeypatch.setattr(stats, "VECTORS_PER_BLOCK", 8)
+    tracemalloc.start()
+    try:
+        results = stats.compute_statistics(table, ["DATE"], aggfuncs=["mean", "p90"])
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    matrix_bytes = nr_vectors * nr_dates * nr_reals * 4
+    assert peak < matrix_bytes / 2, f"Peak {peak} bytes, whole matrix {matrix_bytes}"
+    expected = table.to_pandas().groupby("DATE")["V399"].mean().to_numpy()
+    np.testing.assert_allclose(results["mean"]["V399"].to_numpy(), expected, rtol=1e-6)
+
+
+def test_realization_tables_released_in_blocks(monkeypatch):
+    """Test statistics from realization tables, releasing each block once"""
+    from sumo.table_aggregation.gather import RealizationTables
+
+    table = make_long_table()
+    reals = table["REAL"].to_numpy()
+    realizations = RealizationTables(
+        [table.filter(pa.array(reals == real)) for real in range(5)]
+    )
+    released = []
+
+    def release(columns):
+        released.append(list(columns))
+        realizations.release(columns)
+
+    monkeypatch.setattr(stats, "VECTORS_PER_BLOCK", 1)
+    results = stats.compute_statistics(
+        realizations, ["DATE"], aggfuncs=["mean"], release=release
+    )
+    expected = stats.compute_statistics(table, ["DATE"], aggfuncs=["mean"])
+    assert results["mean"].equals(expected["mean"]), "Statistics differ"
+    assert released == [["FOPT"], ["FOPR"]], "Not released block by block"
+    assert realizations.nbytes == table.select(["DATE", "REAL"]).nbytes
+
+
+@pytest.fixture(name="register_kernel")
+def fixture_register_kernel(monkeypatch):
+    """Return stats.register_kernel, kernels registered are removed after test
+
+    Returns:
+        Callable: the function registering kernels
+    """
+    monkeypatch.setattr(stats, "KERNELS", dict(stats.KERNELS))
+    return stats.register_kernel
+
+
+def range_kernel(block):
+    """Custom kernel, difference between max and min"""
+    return np.nanmax(block.values, axis=-1) - np.nanmin(block.values, axis=-1)
+
+
+def test_registered_kernel(register_kernel):
+    """Registered kernels are used by name, also in worker processes"""
+    register_kernel("range")(range_kernel)
+    table = make_long_table(nr_reals=10)
+    results = stats.compute_statistics(table, ["DATE"], aggfuncs=["range", "max", "min"])
+    np.testing.assert_allclose(
+        results["range"]["FOPT"].to_numpy(),
+        results["max"]["FOPT"].to_numpy() - results["min"]["FOPT"].to_numpy(),
+    )
+    shared = stats.compute_statistics(table, ["DATE"], aggfuncs=["range"], processes=2)
+    assert shared["range"].equals(results["range"])
+
+
+def test_exceedance_kernel():
+    """Probability of exceeding threshold, among realizations with values"""
+    table = pa.table(
+        {"DATE": [1, 1, 1, 1, 2], "REAL": [0, 1, 2, 3, 0], "FOPT": [0.0, 1.0, 2.0, None, 5.0]}
+    )
+    results = stats.compute_statistics(table, ["DATE"], aggfuncs=["exceed_0.5"])
+    assert results["exceed_0.5"]["FOPT"].to_pylist() == [2 / 3, 1.0]
+
+
+def test_wrong_kernel_shape(register_kernel):
+    """Kernels not reducing along realizations are rejected"""
+    register_kernel("identity", lambda block: block.values)
+    with pytest.raises(ValueError):
+        stats.compute_statistics(make_long_table(), ["DATE"], aggfuncs=["identity"])
+
+
+def test_no_leaked_kernels():
+    """Kernels registered by the tests are removed again"""
+    assert set(stats.KERNELS) == {"mean", "std", "min", "max"}, sorted(stats.KERNELS)
+
@@ -1,9 +1,13 @@
 """Tests module _utils.py"""
+import asyncio
 import logging
 from time import sleep
 from uuid import UUID
+import pytest
 import pyarrow as pa
 from sumo.table_aggregation import utilities as ut
+from sumo.table_aggregation.gather import RealizationTables
+from sumo.table_aggregation.utilities import fetch, upload
 import yaml
 import pandas as pd
 import pyarrow as pa
@@ -127,7 +131,7 @@ def test_upload(
 ):
     """Upload data to sumo"""
     # Define paths to check against
-    operations = ("collection", "mean", "min", "max", "p10", "p90")
+    operations = ("collection", "mean", "min", "max", "std", "p10", "p90")
     valids = ["FOPP", "FOPT", "FOPR"]
     all_names = [
         f"summary--{name}--eclipse--{op}--iter-0"
@@ -257,4 +261,293 @@ def test_table_to_bytes():
     print(len(byte_string))
 
 def test_get_object(sumo):
-    table = ut.get_object('8557eacd-ed4f-a80d-d466-467301f22bbd', ["DATE"], sumo)
\ No newline at end of file
+    table = ut.get_object('8557eacd-ed4f-a80d-d466-467301f22bbd', ["DATE"], sumo)
+
+def test_make_resampled_aggregations():
+    """Test collections and statistics made from monthly resampled table"""
+    nr_reals = 3
+    dates = pd.date_range("2020-01-01", "2020-03-31", freq="D")
+    frame = pd.DataFrame(
+        {
+            "DATE": list(dates) * nr_reals,
+            "REAL": [real for real in range(nr_reals) for _ in dates],
+            "FOPT": list(range(len(dates))) * nr_reals,
+        }
+    )
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    results = ut.make_resampled_aggregations(
+        table, ["DATE"], ("monthly",), ["mean"]
+    )
+    operations = [(operation, freq) for operation, _, freq in results]
+    assert operations == [
+        ("collection", "monthly"),
+        ("mean", "monthly"),
+    ], f"Wrong results {operations}"
+    collection = results[0][1]
+    assert collection.num_rows == 3 * nr_reals, "Should have one row per month"
+    first_real = collection.filter(pa.compute.equal(collection["REAL"], 0))
+    assert first_real["FOPT"].to_pylist() == [30, 59, 90], "Last value for totals"
+    assert not ut.make_resampled_aggregations(
+        table, ["DATE", "REAL"], ("monthly",)
+    ), "Only tables indexed by DATE can be resampled"
+
+
+def test_make_resampled_aggregations_date_types():
+    """Test that dates are resampled as timestamps, and strings are skipped"""
+    dates = pa.array(
+        [date.date() for date in pd.date_range("2020-01-01", "2020-02-29")]
+    )
+    table = pa.table(
+        {"DATE": dates, "REAL": [0] * len(dates), "FOPR": [1.0] * len(dates)}
+    )
+    results = ut.make_resampled_aggregations(table, ["DATE"], ("monthly",), None)
+    collection = results[0][1]
+    assert collection["DATE"].type == pa.timestamp("ms"), "Dates not timestamps"
+    assert collection.num_rows == 2, "Should have one row per month"
+    as_strings = table.set_column(0, "DATE", dates.cast(pa.string()))
+    assert not ut.make_resampled_aggregations(
+        as_strings, ["DATE"], ("monthly",)
+    ), "DATE as strings cannot be resampled"
+
+
+def test_timethis_coroutine():
+    """Test that timethis keeps coroutine functions awaitable"""
+
+    @ut.timethis("sleep")
+    async def nap(seconds):
+        await asyncio.sleep(seconds)
+        return seconds
+
+    assert asyncio.iscoroutinefunction(nap), "Should still be coroutine function"
+    assert asyncio.run(nap(0.01)) == 0.01, "Wrong result"
+
+
+def test_blob_to_table_formats():
+    """Test that parquet, feather and csv blobs are told apart and read"""
+    from io import BytesIO
+    import pyarrow.parquet as pq
+    from pyarrow import feather
+
+    table = pa.table({"DATE": ["2020-01-01", "2020-01-02"], "FOPT": [1.0, 2.0]})
+    parquet_sink = BytesIO()
+    pq.write_table(table, parquet_sink)
+    feather_sink = BytesIO()
+    feather.write_feather(table, feather_sink)
+    csv_sink = BytesIO(table.to_pandas().to_csv(index=False).encode("utf-8"))
+    for name, sink in (
+        ("parquet", parquet_sink),
+        ("feather", feather_sink),
+        ("csv", csv_sink),
+    ):
+        read = ut.blob_to_table(BytesIO(sink.getvalue()))
+        assert read.column_names == table.column_names, f"Wrong columns from {name}"
+        assert read["FOPT"].to_pylist() == [1.0, 2.0], f"Wrong values from {name}"
+
+
+def test_facade_names():
+    """Test that names of the utilities are found in their submodules"""
+    from sumo.table_aggregation.utilities import fetch
+
+    assert ut.get_object is fetch.get_object, "Facade should give submodule name"
+    assert "extract_and_upload" in dir(ut), "Lazy names should be listed"
+    try:
+        ut.no_such_name  # pylint: disable=pointless-statement
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError("Unknown name should raise AttributeError")
+
+
+def test_with_realization():
+    """Test that table of shared blob gets new REAL, and shares other columns"""
+    table = pa.table({"REAL": pa.array([0, 0], pa.int16()), "V": [1.0, 2.0]})
+    other = ut.with_realization(table, 3)
+    assert other["REAL"].to_pylist() == [3, 3], "REAL not replaced"
+    assert other["REAL"].type == pa.int16(), "REAL type changed"
+    shared = other["V"].chunk(0).buffers()[1].address
+    assert shared == table["V"].chunk(0).buffers()[1].address, "Vector copied"
+    empty = pa.table([])
+    assert ut.with_realization(empty, 3) is empty, "Table without REAL changed"
+
+
+def test_download_retries(monkeypatch):
+    """Test that downloads are retried, and the last failure raised"""
+    from types import SimpleNamespace
+    from httpx import TransportError
+
+    class FlakySumo:
+        """Fails the given number of gets"""
+
+        def __init__(self, failures):
+            self.failures = failures
+
+        def get(self, query):
+            if self.failures:
+                self.failures -= 1
+                raise TransportError("Connection reset")
+            return SimpleNamespace(content=b"blob")
+
+    monkeypatch.setattr(fetch.time, "sleep", lambda seconds: None)
+    assert fetch.download(FlakySumo(2), "blob", retries=2).content == b"blob"
+    with pytest.raises(TransportError):
+        fetch.download(FlakySumo(2), "blob", retries=1)
+
+
+def test_aggregate_arrow_spill(tmp_path, monkeypatch):
+    """Test that spilled aggregation has the same rows as the one in memory"""
+
+    def reconstruct(object_id, real_nr, sumo, required):
+        table = pa.table({"DATE": [1, 2], "V": [float(real_nr)] * 2})
+        return table.add_column(0, "REAL", pa.array([real_nr] * 2, pa.int16()))
+
+    monkeypatch.setattr(fetch, "reconstruct_table", reconstruct)
+    object_ids = {real: f"id{real}" for real in range(4)}
+
+    async def aggregate(spill):
+        loop = asyncio.get_running_loop()
+        return await ut.aggregate_arrow(object_ids, None, ["DATE", "V"], loop, spill)
+
+    in_memory = asyncio.run(aggregate(None))
+    spilled = asyncio.run(aggregate(str(tmp_path)))
+    assert spilled.sort_by("REAL").equals(in_memory.sort_by("REAL"))
+    assert not list(tmp_path.iterdir()), "Spill file not removed"
+
+
+def test_aggregate_arrow_spill_fails(tmp_path, monkeypatch):
+    """Test that a failed fetch removes the spill file"""
+
+    def reconstruct(object_id, real_nr, sumo, required):
+        if real_nr == 2:
+            raise RuntimeError("Fetch failed")
+        table = pa.table({"DATE": [1, 2], "V": [float(real_nr)] * 2})
+        return table.add_column(0, "REAL", pa.array([real_nr] * 2, pa.int16()))
+
+    monkeypatch.setattr(fetch, "reconstruct_table", reconstruct)
+    object_ids = {real: f"id{real}" for real in range(4)}
+
+    async def aggregate():
+        loop = asyncio.get_running_loop()
+        await ut.aggregate_arrow(object_ids, None, ["DATE", "V"], loop, str(tmp_path))
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(aggregate())
+    assert not list(tmp_path.iterdir()), "Spill file not removed"
+
+
+def test_extract_and_upload_gathered(monkeypatch):
+    """Test that results from realization tables equal those from concat"""
+    tables = [
+        pa.table(
+            {
+                "DATE": [1, 2],
+                "REAL": pa.array([real] * 2, pa.int16()),
+                "V": [1.0, 2.0 + real],
+                "W": [3.0, 4.0],
+            }
+        )
+        for real in range(3)
+    ]
+    uploaded = {}
+
+    def upload_table(sumo, parent_id, table, name, meta, operation, frequency=None):
+        uploaded.setdefault(operation, {})[name] = table
+
+    monkeypatch.setattr(upload, "upload_table", upload_table)
+
+    async def extract(table):
+        loop = asyncio.get_running_loop()
+        await ut.extract_and_upload(
+            None, "case", table, ["DATE"], {}, loop, None, ["mean", "max"], index=False
+        )
+        return {operation: uploaded.pop(operation) for operation in list(uploaded)}
+
+    expected = asyncio.run(extract(pa.concat_tables(tables)))
+    realizations = RealizationTables(tables)
+    gathered = asyncio.run(extract(realizations))
+    assert gathered.keys() == expected.keys() == {"collection", "mean", "max"}
+    for operation, results in gathered.items():
+        assert results.keys() == {"V", "W"}, f"Missing {operation}"
+        for name, table in results.items():
+            assert table.equals(expected[operation][name]), f"{operation} differs"
+    assert realizations.nbytes == 3 * 2 * (8 + 2), "Vectors not released"
+
+
+def test_index_uploaded_once(monkeypatch):
+    """Test that index objects are uploaded once per table, found by content"""
+    uploaded = []
+    failing = set()
+
+    def upload_table(sumo, parent_id, table, name, meta, operation, frequency=None):
+        uploaded.append((meta["data"]["name"], name, operation))
+        return meta["data"]["name"] not in failing
+
+    monkeypatch.setattr(upload, "upload_table", upload_table)
+    ut.forget_uploaded_indexes()
+    table = pa.table({"DATE": [1, 2, 1, 2], "REAL": [0, 0, 1, 1], "V": [1.0] * 4})
+
+    def meta(name):
+        return {
+            "data": {"name": name, "tagname": "tag"},
+            "fmu": {"iteration": {"name": "iter-0"}},
+        }
+
+    async def extract(name, index=True):
+        loop = asyncio.get_running_loop()
+        await ut.extract_and_upload(
+            None, "case", table, ["DATE"], meta(name), loop, None, None, index=index
+        )
+
+    asyncio.run(extract("summary"))
+    asyncio.run(extract("summary"))
+    asyncio.run(extract("other", index=False))
+    indexes = [item for item in uploaded if item[2] == "index"]
+    assert indexes == [("summary", "DATE", "index")], "Index not uploaded once"
+    failing.add("other")
+    asyncio.run(extract("other"))
+    failing.clear()
+    asyncio.run(extract("other"))
+    indexes = [item for item in uploaded if item[2] == "index"]
+    assert indexes[1:] == [("other", "DATE", "index")] * 2, "Failed index not retried"
+
+
+def test_realization_index():
+    """Test that index values of all realizations are kept"""
+    tables = [
+        pa.table({"DATE": [[1, 2], [2, 3]][real], "REAL": [real] * 2})
+        for real in range(2)
+    ]
+    expected = pa.table({"DATE": [1, 2, 3]})
+    assert ut.realization_index(RealizationTables(tables), "DATE").equals(expected)
+    table = pa.concat_tables(tables)
+    assert ut.realization_index(table, "DATE").equals(expected)
+
+
+def test_aggregate_arrow_sketch(tmp_path, monkeypatch):
+    """Test that sketch filled while fetching gives statistics of the table"""
+
+    def reconstruct(object_id, real_nr, sumo, required):
+        table = pa.table({"DATE": [1, 2], "V": [float(real_nr), 2.0 * real_nr]})
+        return table.add_column(0, "REAL", pa.array([real_nr] * 2, pa.int16()))
+
+    monkeypatch.setattr(fetch, "reconstruct_table", reconstruct)
+    object_ids = {real: f"id{real}" for real in range(4)}
+
+    async def aggregate(spill):
+        loop = asyncio.get_running_loop()
+        sketch = ut.segment_sketch(["DATE", "REAL", "V"], ["DATE"], "sketch")
+        table = await ut.aggregate_arrow(
+            object_ids, None, ["DATE", "V"], loop, spill, sketch=sketch
+        )
+        return table, sketch
+
+    for spill in (None, str(tmp_path)):
+        table, sketch = asyncio.run(aggregate(spill))
+        assert sketch.nr_realizations == 4, f"Not all realizations sketched {spill}"
+        streamed = dict(
+            ut.make_stat_aggregations(
+                table, ["DATE"], ["mean", "max"], "sketch", sketch=sketch
+            )
+        )
+        assert streamed["mean"]["V"].to_pylist() == [1.5, 3.0], "Wrong mean"
+        assert streamed["max"]["V"].to_pylist() == [3.0, 6.0], "Wrong max"
+    assert ut.segment_sketch(["DATE", "V"], ["DATE"]) is None, "Sketch when exact"